@@ -5,6 +5,8 @@ from src.controllers.auth import AuthController
 from src.views import login, dashboard, vendas, estoque, fornecedores, relatorios, devolucoes, entrada_produtos
 from src.components.modals import show_confirmation_modal
 from src.utils.state_handlers import has_unsaved_entrada_produtos, limpar_estado_entrada_produtos
+from src.controllers.diario_vendas import iniciar_reprocessador
+from src.controllers.importacao import iniciar_processador_importacoes
 
 
 def configurar_pagina():
@@ -133,6 +135,12 @@ def main():
     configurar_pagina()
     inicializar_estado()
 
+    # Grava no banco as vendas que ficaram no diário local (uma thread por processo)
+    iniciar_reprocessador()
+
+    # Importações de planilhas em segundo plano (retoma as interrompidas)
+    iniciar_processador_importacoes()
+
     # Roteamento básico
     if not st.session_state.autenticado:
         login.mostrar_pagina()
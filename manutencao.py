@@ -0,0 +1,199 @@
+# manutencao.py
+import argparse
+from datetime import datetime
+from src.models import get_db, engine
+from src.controllers.estoque_resumo import EstoqueResumoController
+from src.controllers.venda import VendaController
+from src.controllers.vendas_diarias import VendasDiariasController
+from src.controllers.diario_vendas import diario_vendas
+from src.controllers.importacao import ImportacaoController, processar_importacoes_pendentes
+from src.controllers.exportacao import ExportacaoController, TABELAS_EXPORTACAO, FORMATOS_EXPORTACAO
+from src.utils.busca import criar_indice_busca, reconstruir_indice_busca
+
+
+def reconstruir_estoque(args):
+    """Reconstrói a tabela estoque_resumo a partir dos produtos em estoque"""
+    db = next(get_db())
+    try:
+        grupos = EstoqueResumoController(db).reconstruir()
+        print(f"Resumo do estoque reconstruído: {grupos} grupos")
+    finally:
+        db.close()
+
+
+def reconstruir_busca(args):
+    """Recria o índice de texto completo (FTS5) dos produtos"""
+    criar_indice_busca(engine)
+    print(f"Índice de busca reconstruído: {reconstruir_indice_busca(engine)} produtos")
+
+
+def verificar_vendas(args):
+    """Confere os totais desnormalizados das vendas contra os itens"""
+    db = next(get_db())
+    try:
+        divergentes = VendaController(db).verificar_totais_vendas(corrigir=args.corrigir)
+        for venda in divergentes:
+            print(f"Venda {venda['venda_id']}: valor {venda['valor_total']:.2f} "
+                  f"(itens: {venda['valor_calculado']:.2f}), "
+                  f"{venda['quantidade_itens']} itens (itens: {venda['itens_calculados']})")
+        situacao = "corrigidas" if args.corrigir else "divergentes"
+        print(f"Vendas {situacao}: {len(divergentes)}")
+    finally:
+        db.close()
+
+
+def diario(args):
+    """Mostra o atraso do diário local de vendas e, opcionalmente, reprocessa"""
+    if args.reprocessar:
+        resultado = diario_vendas.reprocessar()
+        if resultado['em_outro_processo']:
+            print("O diário já está sendo reprocessado por outro processo (aplicativo); nada feito")
+        else:
+            print(f"Vendas gravadas: {resultado['gravadas']}, rejeitadas: {resultado['rejeitadas']}")
+    situacao = diario_vendas.situacao()
+    print(f"Pendentes: {situacao['pendentes']} (atraso: {situacao['atraso_segundos']:.0f} s)")
+    if situacao['ultimo_erro']:
+        print(f"Último erro: {situacao['ultimo_erro']}")
+    for venda in diario_vendas.rejeitadas():
+        print(f"Rejeitada {venda['chave']} ({venda['data_hora']}, {venda['cliente_nome']}): "
+              f"{venda['erro']}")
+
+
+def importacoes(args):
+    """Lista as importações de planilhas e, opcionalmente, processa as pendentes"""
+    if args.processar:
+        print(f"Importações encerradas: {processar_importacoes_pendentes()}")
+    db = next(get_db())
+    try:
+        for situacao in ImportacaoController(db).listar_importacoes(limite=args.limite):
+            print(f"Importação {situacao['id']} ({situacao['nome_arquivo']}): {situacao['status']}, "
+                  f"{situacao['linhas_processadas']}/{situacao['total_linhas'] or '?'} linhas, "
+                  f"{situacao['importados']} importados, {situacao['atualizados']} atualizados, "
+                  f"{situacao['ignorados']} ignorados, {situacao['total_erros']} erros")
+            if situacao['mensagem']:
+                print(f"  {situacao['mensagem']}")
+    finally:
+        db.close()
+
+
+def data_argumento(valor: str) -> datetime:
+    """Converte datas da linha de comando (AAAA-MM-DD)"""
+    try:
+        return datetime.strptime(valor, "%Y-%m-%d")
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Data inválida (use AAAA-MM-DD): {valor}")
+
+
+def reconstruir_vendas_diarias(args):
+    """Recalcula os totais diários a partir das vendas finalizadas"""
+    db = next(get_db())
+    try:
+        linhas = VendasDiariasController(db).reconstruir(
+            data_inicio=args.inicio.date() if args.inicio else None,
+            data_fim=args.fim.date() if args.fim else None
+        )
+        print(f"Vendas diárias reconstruídas: {linhas} linhas")
+    finally:
+        db.close()
+
+
+def exportar(args):
+    """Exporta tabelas para arquivos Parquet/Arrow"""
+    if args.incremental and (args.inicio or args.fim):
+        raise SystemExit("--incremental não pode ser combinado com --inicio/--fim")
+    db = next(get_db())
+    try:
+        # A data final inclui o dia inteiro
+        fim = args.fim.replace(hour=23, minute=59, second=59) if args.fim else None
+        resultados = ExportacaoController(db).exportar(
+            args.destino,
+            tabelas=args.tabelas,
+            inicio=args.inicio,
+            fim=fim,
+            incremental=args.incremental,
+            formato=args.formato
+        )
+        for resultado in resultados:
+            print(f"{resultado['tabela']}: {resultado['linhas']} linhas -> {resultado['arquivo']}")
+            if resultado['exclusoes']:
+                print(f"  {resultado['exclusoes']} exclusões -> {resultado['arquivo_exclusoes']}")
+    finally:
+        db.close()
+
+
+def criar_parser() -> argparse.ArgumentParser:
+    """Define os comandos de manutenção disponíveis"""
+    parser = argparse.ArgumentParser(description="Rotinas de manutenção do banco de dados")
+    comandos = parser.add_subparsers(dest="comando", required=True)
+
+    comando = comandos.add_parser(
+        "reconstruir-estoque",
+        help="Reconstrói o resumo materializado do estoque"
+    )
+    comando.set_defaults(executar=reconstruir_estoque)
+
+    comando = comandos.add_parser(
+        "reconstruir-busca",
+        help="Recria o índice de texto completo dos produtos"
+    )
+    comando.set_defaults(executar=reconstruir_busca)
+
+    comando = comandos.add_parser(
+        "verificar-vendas",
+        help="Confere valor total e quantidade de itens das vendas"
+    )
+    comando.add_argument("--corrigir", action="store_true",
+                         help="Regrava os totais divergentes a partir dos itens")
+    comando.set_defaults(executar=verificar_vendas)
+
+    comando = comandos.add_parser(
+        "reconstruir-vendas-diarias",
+        help="Recalcula os totais diários de vendas (todo o histórico ou um período)"
+    )
+    comando.add_argument("--inicio", type=data_argumento, help="Data inicial (AAAA-MM-DD)")
+    comando.add_argument("--fim", type=data_argumento, help="Data final (AAAA-MM-DD)")
+    comando.set_defaults(executar=reconstruir_vendas_diarias)
+
+    comando = comandos.add_parser(
+        "diario-vendas",
+        help="Mostra as vendas pendentes/rejeitadas do diário local"
+    )
+    comando.add_argument("--reprocessar", action="store_true",
+                         help="Grava agora no banco as vendas pendentes")
+    comando.set_defaults(executar=diario)
+
+    comando = comandos.add_parser(
+        "importacoes",
+        help="Mostra o progresso das importações de planilhas de produtos"
+    )
+    comando.add_argument("--processar", action="store_true",
+                         help="Processa agora as importações pendentes ou interrompidas")
+    comando.add_argument("--limite", type=int, default=20, help="Importações listadas")
+    comando.set_defaults(executar=importacoes)
+
+    comando = comandos.add_parser(
+        "exportar",
+        help="Exporta vendas, itens, produtos e notas para Parquet/Arrow"
+    )
+    comando.add_argument("--destino", default="exportacoes", help="Diretório dos arquivos")
+    comando.add_argument("--tabelas", nargs="+", choices=list(TABELAS_EXPORTACAO),
+                         help="Tabelas a exportar (padrão: todas)")
+    comando.add_argument("--inicio", type=data_argumento, help="Data inicial (AAAA-MM-DD)")
+    comando.add_argument("--fim", type=data_argumento, help="Data final (AAAA-MM-DD)")
+    comando.add_argument("--incremental", action="store_true",
+                         help="Exporta só as linhas inseridas, alteradas ou excluídas desde "
+                              "a última exportação incremental (sem --inicio/--fim)")
+    comando.add_argument("--formato", choices=list(FORMATOS_EXPORTACAO), default="parquet")
+    comando.set_defaults(executar=exportar)
+
+    return parser
+
+
+if __name__ == "__main__":
+    args = criar_parser().parse_args()
+    try:
+        args.executar(args)
+    except Exception as e:
+        print("\nFalha na manutenção do banco de dados!")
+        print(f"Erro: {str(e)}")
+        exit(1)
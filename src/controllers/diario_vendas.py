@@ -0,0 +1,318 @@
+# src/controllers/diario_vendas.py
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Dict, Iterator, List, Optional, Tuple
+from sqlalchemy.orm import Session
+from ..models import get_db, FormaPagamento, Venda
+from .venda import VendaController, BancoOcupado
+
+try:
+    import fcntl
+except ImportError:  # Windows: trava de arquivo pelo msvcrt
+    fcntl = None
+    import msvcrt
+
+# Diretório do diário local de vendas (relativo ao diretório do aplicativo)
+DIRETORIO_DIARIO = "diario_vendas"
+
+# Espera máxima pelo bloqueio do banco no caixa antes de anotar a venda no diário
+ESPERA_BLOQUEIO_CAIXA_MS = 500
+
+# Intervalo (segundos) entre as tentativas de reprocessar o diário
+INTERVALO_REPROCESSAMENTO = 5
+
+
+def _travar_arquivo(arquivo, esperar: bool = True) -> bool:
+    """
+    Trava exclusiva do arquivo entre processos (flock no POSIX, msvcrt.locking
+    no Windows). Com esperar=False retorna False se outro processo tem a trava.
+    """
+    if fcntl is not None:
+        try:
+            fcntl.flock(arquivo, fcntl.LOCK_EX if esperar else fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return True
+        except BlockingIOError:
+            return False
+
+    # msvcrt trava bytes a partir da posição atual: sempre o primeiro byte
+    while True:
+        arquivo.seek(0)
+        try:
+            msvcrt.locking(arquivo.fileno(), msvcrt.LK_NBLCK, 1)
+            return True
+        except OSError:
+            if not esperar:
+                return False
+            time.sleep(0.05)
+
+
+def _destravar_arquivo(arquivo):
+    if fcntl is not None:
+        fcntl.flock(arquivo, fcntl.LOCK_UN)
+    else:
+        arquivo.seek(0)
+        msvcrt.locking(arquivo.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def _agora() -> datetime:
+    """Momento atual em UTC sem fuso, como o CURRENT_TIMESTAMP gravado pelo banco"""
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+class DiarioVendas:
+    """
+    Diário local (JSONL, só acrescenta) das vendas fechadas no caixa que não
+    puderam ser gravadas porque o banco estava bloqueado. Cada linha vai para
+    o disco (fsync) antes de o caixa receber a confirmação. A posição até onde
+    o diário já foi reprocessado fica em um arquivo ao lado; vendas recusadas
+    na gravação (ex.: estoque insuficiente) vão para rejeitadas.jsonl.
+    O aplicativo e o manutencao.py usam o mesmo diário: leitura, escrita e
+    esvaziamento são feitos com uma trava de arquivo em vendas.trava,
+    e só um processo reprocessa por vez (reprocessamento.trava).
+    """
+
+    def __init__(self, diretorio: str = DIRETORIO_DIARIO):
+        self.diretorio = diretorio
+        self.arquivo = os.path.join(diretorio, "vendas.jsonl")
+        self.arquivo_posicao = os.path.join(diretorio, "vendas.pos")
+        self.arquivo_rejeitadas = os.path.join(diretorio, "rejeitadas.jsonl")
+        self.arquivo_trava = os.path.join(diretorio, "vendas.trava")
+        self.arquivo_trava_reprocessamento = os.path.join(diretorio, "reprocessamento.trava")
+        self._trava = threading.Lock()
+        self.ultimo_erro: Optional[str] = None
+        self.ultimo_reprocessamento: Optional[datetime] = None
+
+    @contextmanager
+    def _travado(self) -> Iterator[None]:
+        """
+        Trava o diário entre as threads deste processo e entre processos
+        (o manutencao.py e o aplicativo gravam e esvaziam o mesmo arquivo)
+        """
+        with self._trava:
+            os.makedirs(self.diretorio, exist_ok=True)
+            with open(self.arquivo_trava, "a+") as trava:
+                _travar_arquivo(trava)
+                try:
+                    yield
+                finally:
+                    _destravar_arquivo(trava)
+
+    def _acrescentar(self, arquivo: str, registro: Dict):
+        """Acrescenta uma linha JSON ao arquivo e força a gravação no disco"""
+        with open(arquivo, "a", encoding="utf-8") as saida:
+            saida.write(json.dumps(registro, ensure_ascii=False) + "\n")
+            saida.flush()
+            os.fsync(saida.fileno())
+
+    def _ler_posicao(self) -> int:
+        try:
+            with open(self.arquivo_posicao, encoding="utf-8") as entrada:
+                return int(entrada.read().strip() or 0)
+        except FileNotFoundError:
+            return 0
+
+    def _gravar_posicao(self, posicao: int):
+        """Grava a posição em um arquivo temporário e troca (não fica pela metade)"""
+        temporario = self.arquivo_posicao + ".tmp"
+        with open(temporario, "w", encoding="utf-8") as saida:
+            saida.write(str(posicao))
+            saida.flush()
+            os.fsync(saida.fileno())
+        os.replace(temporario, self.arquivo_posicao)
+
+    def anotar(self, registro: Dict):
+        """Anota uma venda no diário"""
+        with self._travado():
+            self._acrescentar(self.arquivo, registro)
+
+    def pendentes(self) -> List[Tuple[int, Dict]]:
+        """
+        Vendas ainda não reprocessadas, com a posição do fim de cada linha
+        Uma última linha incompleta (queda durante a gravação) é ignorada
+        """
+        with self._travado():
+            posicao = self._ler_posicao()
+            try:
+                with open(self.arquivo, "rb") as entrada:
+                    entrada.seek(posicao)
+                    conteudo = entrada.read()
+            except FileNotFoundError:
+                return []
+
+        registros = []
+        for linha in conteudo.splitlines(keepends=True):
+            if not linha.endswith(b"\n"):
+                break
+            posicao += len(linha)
+            registros.append((posicao, json.loads(linha)))
+        return registros
+
+    def confirmar(self, posicao: int):
+        """
+        Marca o diário como reprocessado até a posição informada
+        Quando tudo foi reprocessado, o arquivo é esvaziado (com a trava de
+        arquivo: nenhum outro processo pode estar acrescentando vendas)
+        """
+        with self._travado():
+            if os.path.exists(self.arquivo) and os.path.getsize(self.arquivo) == posicao:
+                with open(self.arquivo, "w", encoding="utf-8"):
+                    pass
+                posicao = 0
+            self._gravar_posicao(posicao)
+
+    def rejeitar(self, registro: Dict, erro: str):
+        """Guarda uma venda que o banco recusou, para conferência manual"""
+        with self._travado():
+            self._acrescentar(self.arquivo_rejeitadas, {**registro, "erro": erro})
+
+    def rejeitadas(self) -> List[Dict]:
+        """Vendas do diário recusadas na gravação"""
+        try:
+            with open(self.arquivo_rejeitadas, encoding="utf-8") as entrada:
+                return [json.loads(linha) for linha in entrada if linha.strip()]
+        except FileNotFoundError:
+            return []
+
+    def situacao(self) -> Dict:
+        """
+        Atraso do diário: vendas pendentes, idade da mais antiga (segundos),
+        rejeitadas, último erro e último reprocessamento
+        """
+        pendentes = self.pendentes()
+        mais_antiga = (
+            datetime.fromisoformat(pendentes[0][1]["data_hora"]) if pendentes else None
+        )
+        return {
+            "pendentes": len(pendentes),
+            "mais_antiga": mais_antiga,
+            "atraso_segundos": (_agora() - mais_antiga).total_seconds() if mais_antiga else 0.0,
+            "rejeitadas": len(self.rejeitadas()),
+            "ultimo_erro": self.ultimo_erro,
+            "ultimo_reprocessamento": self.ultimo_reprocessamento
+        }
+
+    def reprocessar(self) -> Dict:
+        """
+        Grava no banco as vendas pendentes, em ordem, pelo checkout do VendaController
+        A chave de cada venda torna a gravação idempotente (uma venda gravada
+        antes de a posição ser confirmada não é duplicada). Para no primeiro
+        bloqueio do banco; vendas recusadas por outro motivo vão para as rejeitadas.
+        Se outro processo já estiver reprocessando, não faz nada e retorna
+        em_outro_processo=True.
+        """
+        os.makedirs(self.diretorio, exist_ok=True)
+        with open(self.arquivo_trava_reprocessamento, "a+") as trava:
+            if not _travar_arquivo(trava, esperar=False):
+                return {"gravadas": 0, "rejeitadas": 0, "em_outro_processo": True}
+            try:
+                return self._reprocessar_pendentes()
+            finally:
+                _destravar_arquivo(trava)
+
+    def _reprocessar_pendentes(self) -> Dict:
+        gravadas = 0
+        rejeitadas = 0
+        for posicao, registro in self.pendentes():
+            db = next(get_db())
+            try:
+                VendaController(db).checkout(
+                    carrinho=registro["carrinho"],
+                    forma_pagamento=FormaPagamento(registro["forma_pagamento"]),
+                    usuario_id=registro["usuario_id"],
+                    cliente_nome=registro["cliente_nome"],
+                    cliente_cpf=registro["cliente_cpf"],
+                    chave_idempotencia=registro["chave"],
+                    data_hora=datetime.fromisoformat(registro["data_hora"])
+                )
+                gravadas += 1
+            except BancoOcupado as e:
+                self.ultimo_erro = str(e)
+                break
+            except Exception as e:
+                self.rejeitar(registro, str(e))
+                rejeitadas += 1
+            finally:
+                db.close()
+            self.confirmar(posicao)
+        else:
+            self.ultimo_erro = None
+
+        self.ultimo_reprocessamento = _agora()
+        return {"gravadas": gravadas, "rejeitadas": rejeitadas, "em_outro_processo": False}
+
+
+class ReprocessadorDiario(threading.Thread):
+    """Thread que reprocessa o diário periodicamente (ou assim que acordada)"""
+
+    def __init__(self, diario: DiarioVendas, intervalo: float = INTERVALO_REPROCESSAMENTO):
+        super().__init__(name="reprocessador-diario-vendas", daemon=True)
+        self.diario = diario
+        self.intervalo = intervalo
+        self._acordar = threading.Event()
+
+    def acordar(self):
+        self._acordar.set()
+
+    def run(self):
+        while True:
+            self._acordar.wait(self.intervalo)
+            self._acordar.clear()
+            try:
+                self.diario.reprocessar()
+            except Exception as e:
+                self.diario.ultimo_erro = str(e)
+
+
+# Instância única do processo (compartilhada entre as sessões do Streamlit)
+diario_vendas = DiarioVendas()
+_reprocessador: Optional[ReprocessadorDiario] = None
+_trava_reprocessador = threading.Lock()
+
+
+def iniciar_reprocessador() -> ReprocessadorDiario:
+    """Inicia a thread de reprocessamento do diário (uma vez por processo)"""
+    global _reprocessador
+    with _trava_reprocessador:
+        if _reprocessador is None or not _reprocessador.is_alive():
+            _reprocessador = ReprocessadorDiario(diario_vendas)
+            _reprocessador.start()
+        return _reprocessador
+
+
+def registrar_venda_caixa(db: Session,
+                          carrinho: List[Dict],
+                          forma_pagamento: FormaPagamento,
+                          usuario_id: int,
+                          cliente_nome: str,
+                          cliente_cpf: Optional[str] = None) -> Tuple[Optional[Venda], str]:
+    """
+    Registra a venda do caixa no banco; se o banco estiver bloqueado por
+    outros escritores, anota no diário para gravação posterior
+    Retorna (venda, chave); venda é None quando ficou no diário
+    """
+    registro = {
+        "chave": str(uuid.uuid4()),
+        "data_hora": _agora().isoformat(),
+        "carrinho": carrinho,
+        "forma_pagamento": forma_pagamento.value,
+        "usuario_id": usuario_id,
+        "cliente_nome": cliente_nome,
+        "cliente_cpf": cliente_cpf
+    }
+    try:
+        venda = VendaController(db).checkout(
+            carrinho, forma_pagamento, usuario_id, cliente_nome, cliente_cpf,
+            chave_idempotencia=registro["chave"],
+            espera_bloqueio_ms=ESPERA_BLOQUEIO_CAIXA_MS
+        )
+        return venda, registro["chave"]
+    except BancoOcupado:
+        diario_vendas.anotar(registro)
+        if _reprocessador is not None:
+            _reprocessador.acordar()
+        return None, registro["chave"]
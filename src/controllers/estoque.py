@@ -1,84 +1,211 @@
 # src/controllers/estoque.py
-from typing import List, Dict, Optional
+import base64
+import csv
+import io
+import json
+from typing import List, Dict, Iterator, Optional, Union
 from datetime import datetime, timedelta
 from sqlalchemy.orm import Session
-from sqlalchemy import func, and_, or_
-from ..models import Produto, NotaEntrada, Fornecedor, StatusProduto
+from sqlalchemy import func, and_, or_, tuple_, case, exists, select
+from ..models import (Produto, NotaEntrada, Fornecedor, StatusProduto, EstoqueResumo,
+                      Venda, ItemVenda, StatusVenda)
+from ..utils.busca import (montar_consulta_fts, subconsulta_busca, indice_produtos,
+                           similaridade_texto)
+
+# Critérios de classificação dos grupos de estoque
+DIAS_SEM_MOVIMENTO = 90  # Mais de 90 dias desde a primeira entrada = Sem Movimento
+LIMITE_BAIXO_ESTOQUE = 3  # 3 ou menos peças = Baixo Estoque
+FAIXAS_ANTIGUIDADE_PADRAO = (30, 60, 90)  # Limites em dias das faixas de antiguidade
+
+# Exportação do estoque em CSV: linhas lidas do banco e gravadas por lote
+TAMANHO_LOTE_EXPORTACAO = 1000
+COLUNAS_EXPORTACAO_CSV = [
+    'Status', 'Referência', 'Descrição', 'Tamanho', 'Quantidade',
+    'Valor Unitário', 'Fornecedor', 'Data Entrada', 'Dias em Estoque'
+]
+
+
+def nomes_faixas_antiguidade(limites: List[int]) -> List[str]:
+    """Gera as chaves das faixas de antiguidade (ex: ate_30_dias, 30_60_dias, mais_90_dias)"""
+    nomes = [f"ate_{limites[0]}_dias"]
+    nomes += [f"{inicio}_{fim}_dias" for inicio, fim in zip(limites, limites[1:])]
+    nomes.append(f"mais_{limites[-1]}_dias")
+    return nomes
+
+
+def linha_csv_estoque(grupo: Dict) -> list:
+    """Converte um grupo do estoque (formato das telas) em uma linha do CSV de exportação"""
+    return [
+        grupo['status'].split(' ', 1)[1],  # Sem o emoji
+        grupo['referencia'],
+        grupo['descricao'],
+        grupo['tamanho'],
+        grupo['quantidade_total'],
+        f"R$ {grupo['valor_unitario']:.2f}".replace('.', ','),
+        grupo['fornecedor'],
+        grupo['data_entrada'],
+        grupo['dias_em_estoque']
+    ]
+
+
+def codificar_cursor(chave: list) -> str:
+    """Gera o token opaco de continuação a partir da chave do último registro"""
+    dados = json.dumps(chave, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(dados).decode('ascii')
+
+
+def decodificar_cursor(cursor: str) -> list:
+    """Recupera a chave do último registro a partir do token de continuação"""
+    try:
+        chave = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    except ValueError:
+        raise ValueError("Cursor de paginação inválido")
+    if not isinstance(chave, list) or len(chave) != 3:
+        raise ValueError("Cursor de paginação inválido")
+    return chave
 
 
 class EstoqueController:
     def __init__(self, db: Session):
         self.db = db
 
-    def visualizar_estoque_completo(self, page: int = 1, per_page: int = 50) -> Dict:
+    def _query_estoque_agrupado(self,
+                                data_limite: datetime,
+                                fornecedor_id: Optional[int] = None,
+                                tamanho: Union[str, List[str], None] = None,
+                                status: Union[str, List[str], None] = None):
+        """
+        Monta a query do estoque agrupado por referência, tamanho e fornecedor
+        Lê o resumo materializado (estoque_resumo), uma linha por grupo
+        """
+        query = (
+            self.db.query(
+                EstoqueResumo.referencia,
+                EstoqueResumo.descricao,
+                EstoqueResumo.tamanho,
+                EstoqueResumo.quantidade_total,
+                EstoqueResumo.valor_unitario_medio,
+                EstoqueResumo.fornecedor_id,
+                Fornecedor.nome.label('fornecedor_nome'),
+                EstoqueResumo.primeira_entrada,
+                EstoqueResumo.ultima_entrada
+            )
+            .join(Fornecedor, EstoqueResumo.fornecedor_id == Fornecedor.id)
+        )
+
+        if fornecedor_id:
+            query = query.filter(EstoqueResumo.fornecedor_id == fornecedor_id)
+
+        # Tamanho e status aceitam um valor ou uma lista de valores
+        if tamanho:
+            tamanhos = [tamanho] if isinstance(tamanho, str) else list(tamanho)
+            query = query.filter(EstoqueResumo.tamanho.in_(tamanhos))
+
+        if status:
+            lista_status = [status] if isinstance(status, str) else list(status)
+            query = query.filter(or_(
+                *[self._condicao_status(item, data_limite) for item in lista_status]
+            ))
+
+        return query
+
+    def _condicao_status(self, status: str, data_limite: datetime):
+        """
+        Condição SQL de um status de grupo do resumo do estoque
+        """
+        if status == "sem_movimento":
+            return EstoqueResumo.primeira_entrada < data_limite
+        if status == "baixo_estoque":
+            return and_(
+                EstoqueResumo.primeira_entrada >= data_limite,
+                EstoqueResumo.quantidade_total <= LIMITE_BAIXO_ESTOQUE
+            )
+        if status == "em_estoque":
+            return and_(
+                EstoqueResumo.primeira_entrada >= data_limite,
+                EstoqueResumo.quantidade_total > LIMITE_BAIXO_ESTOQUE
+            )
+        raise ValueError(f"Status inválido: {status}")
+
+    def _formatar_grupo_estoque(self, produto, hoje: datetime, data_limite: datetime) -> Dict:
+        """
+        Converte uma linha do estoque agrupado no formato exibido nas telas
+        """
+        # Calcula dias desde a primeira entrada
+        dias_em_estoque = (hoje - produto.primeira_entrada).days
+
+        # Determina o status do produto (mesmo critério do filtro em SQL)
+        if produto.primeira_entrada < data_limite:
+            status = "⚠️ Sem Movim"
+        elif produto.quantidade_total <= LIMITE_BAIXO_ESTOQUE:
+            status = "⚡ Baixo Estoq"
+        else:
+            status = "✅ Em Estoque"
+
+        return {
+            "status": status,
+            "referencia": produto.referencia,
+            "descricao": produto.descricao,
+            "tamanho": produto.tamanho,
+            "quantidade_total": produto.quantidade_total,
+            "valor_unitario": float(produto.valor_unitario_medio),
+            "fornecedor": produto.fornecedor_nome,
+            "data_entrada": produto.primeira_entrada.strftime("%d/%m/%Y"),
+            "dias_em_estoque": dias_em_estoque
+        }
+
+    def _ordenacao_estoque(self, ordenar_por: str) -> list:
+        """
+        Critérios de ordenação do estoque agrupado
+        Desempata pela chave do grupo para manter a paginação estável
+        """
+        ordenacoes = {
+            "referencia": [EstoqueResumo.referencia.asc()],
+            "quantidade": [EstoqueResumo.quantidade_total.desc()],
+            "valor": [EstoqueResumo.valor_unitario_medio.desc()],
+            "antiguidade": [EstoqueResumo.primeira_entrada.asc()]
+        }
+        if ordenar_por not in ordenacoes:
+            raise ValueError(f"Ordenação inválida: {ordenar_por}")
+
+        return ordenacoes[ordenar_por] + [
+            EstoqueResumo.referencia,
+            EstoqueResumo.tamanho,
+            EstoqueResumo.fornecedor_id
+        ]
+
+    def visualizar_estoque_completo(self,
+                                    page: int = 1,
+                                    per_page: int = 50,
+                                    fornecedor_id: Optional[int] = None,
+                                    tamanho: Optional[str] = None,
+                                    status: Optional[str] = None,
+                                    ordenar_por: str = "referencia") -> Dict:
         """
         Retorna visão paginada do estoque completo com produtos agrupados
+        Filtros, status e ordenação são aplicados no banco antes da paginação
+        status: 'em_estoque', 'baixo_estoque' ou 'sem_movimento'
+        ordenar_por: 'referencia', 'quantidade', 'valor' ou 'antiguidade'
         """
         try:
-            # Query base para produtos agrupados
-            query = (
-                self.db.query(
-                    Produto.referencia,
-                    Produto.descricao,
-                    Produto.tamanho,
-                    func.sum(Produto.quantidade_atual).label('quantidade_total'),
-                    func.avg(Produto.valor_unitario).label('valor_unitario_medio'),
-                    Fornecedor.nome.label('fornecedor_nome'),
-                    func.min(NotaEntrada.data_emissao).label('primeira_entrada'),
-                    func.max(NotaEntrada.data_emissao).label('ultima_entrada')
-                )
-                .join(NotaEntrada, Produto.nota_entrada_id == NotaEntrada.id)
-                .join(Fornecedor, NotaEntrada.fornecedor_id == Fornecedor.id)
-                .filter(Produto.status == StatusProduto.EM_ESTOQUE)
-                .group_by(
-                    Produto.referencia,
-                    Produto.descricao,
-                    Produto.tamanho,
-                    Fornecedor.nome
-                )
-            )
+            hoje = datetime.now()
+            data_limite = hoje - timedelta(days=DIAS_SEM_MOVIMENTO)
 
-            # Contagem total para paginação
+            query = self._query_estoque_agrupado(data_limite, fornecedor_id, tamanho, status)
+            ordenacao = self._ordenacao_estoque(ordenar_por)
+
+            # Contagem total para paginação (já considerando os filtros)
             total = query.count()
 
-            # Query para os dados da página atual
             produtos = (
-                query.order_by(Produto.referencia)
+                query.order_by(*ordenacao)
                 .offset((page - 1) * per_page)
                 .limit(per_page)
                 .all()
             )
 
-            # Calcula dias em estoque e status para cada grupo
-            hoje = datetime.now()
-            dados_produtos = []
-
-            for produto in produtos:
-                # Calcula dias desde a primeira entrada
-                dias_em_estoque = (hoje - produto.primeira_entrada).days
-
-                # Determina o status do produto
-                if dias_em_estoque > 90:  # Mais de 90 dias = Sem Movimento
-                    status = "⚠️ Sem Movim"
-                elif produto.quantidade_total <= 3:  # 3 ou menos = Baixo Estoque
-                    status = "⚡ Baixo Estoq"
-                else:
-                    status = "✅ Em Estoque"
-
-                dados_produtos.append({
-                    "status": status,
-                    "referencia": produto.referencia,
-                    "descricao": produto.descricao,
-                    "tamanho": produto.tamanho,
-                    "quantidade_total": produto.quantidade_total,
-                    "valor_unitario": float(produto.valor_unitario_medio),
-                    "fornecedor": produto.fornecedor_nome,
-                    "data_entrada": produto.primeira_entrada.strftime("%d/%m/%Y"),
-                    "dias_em_estoque": dias_em_estoque
-                })
-
             return {
-                "produtos": dados_produtos,
+                "produtos": [self._formatar_grupo_estoque(p, hoje, data_limite) for p in produtos],
                 "total": total,
                 "pages": (total + per_page - 1) // per_page,
                 "current_page": page
@@ -87,6 +214,188 @@ class EstoqueController:
         except Exception as e:
             raise Exception(f"Erro ao visualizar estoque: {str(e)}")
 
+    def visualizar_estoque_cursor(self,
+                                  cursor: Optional[str] = None,
+                                  per_page: int = 50,
+                                  fornecedor_id: Optional[int] = None,
+                                  tamanho: Optional[str] = None,
+                                  status: Optional[str] = None,
+                                  contar_total: bool = False) -> Dict:
+        """
+        Retorna uma página do estoque agrupado usando paginação por cursor (keyset)
+        A página é localizada pela chave (referencia, tamanho, fornecedor), então
+        qualquer página custa o mesmo que a primeira. O total só é calculado
+        quando contar_total=True, pois exige agregar o estoque inteiro.
+        """
+        try:
+            hoje = datetime.now()
+            data_limite = hoje - timedelta(days=DIAS_SEM_MOVIMENTO)
+
+            query = self._query_estoque_agrupado(data_limite, fornecedor_id, tamanho, status)
+
+            total = query.count() if contar_total else None
+
+            # A chave do cursor é a chave única do resumo (busca pelo índice)
+            if cursor:
+                query = query.filter(
+                    tuple_(
+                        EstoqueResumo.referencia,
+                        EstoqueResumo.tamanho,
+                        EstoqueResumo.fornecedor_id
+                    ) > tuple_(*decodificar_cursor(cursor))
+                )
+
+            # Busca um registro extra para saber se existe próxima página
+            produtos = (
+                query.order_by(
+                    EstoqueResumo.referencia,
+                    EstoqueResumo.tamanho,
+                    EstoqueResumo.fornecedor_id
+                )
+                .limit(per_page + 1)
+                .all()
+            )
+
+            proximo_cursor = None
+            if len(produtos) > per_page:
+                produtos = produtos[:per_page]
+                ultimo = produtos[-1]
+                proximo_cursor = codificar_cursor(
+                    [ultimo.referencia, ultimo.tamanho, ultimo.fornecedor_id]
+                )
+
+            return {
+                "produtos": [self._formatar_grupo_estoque(p, hoje, data_limite) for p in produtos],
+                "total": total,
+                "proximo_cursor": proximo_cursor
+            }
+
+        except Exception as e:
+            raise Exception(f"Erro ao visualizar estoque: {str(e)}")
+
+    def exportar_estoque_csv(self,
+                             fornecedor_id: Optional[int] = None,
+                             tamanho: Optional[str] = None,
+                             status: Optional[str] = None,
+                             ordenar_por: str = "referencia",
+                             tamanho_lote: int = TAMANHO_LOTE_EXPORTACAO) -> Iterator[str]:
+        """
+        Gera o CSV do estoque agrupado completo (todas as páginas) em trechos
+        As linhas são lidas do banco em lotes (yield_per) e cada lote é
+        devolvido já formatado, então a memória usada não cresce com o estoque.
+        O primeiro trecho começa com o BOM do UTF-8, para abrir no Excel.
+        """
+        try:
+            hoje = datetime.now()
+            data_limite = hoje - timedelta(days=DIAS_SEM_MOVIMENTO)
+
+            query = self._query_estoque_agrupado(
+                data_limite, fornecedor_id, tamanho, status
+            ).order_by(
+                *self._ordenacao_estoque(ordenar_por)
+            ).execution_options(
+                stream_results=True
+            ).yield_per(tamanho_lote)
+
+            buffer = io.StringIO()
+            escritor = csv.writer(buffer)
+
+            buffer.write('\ufeff')
+            escritor.writerow(COLUNAS_EXPORTACAO_CSV)
+
+            for numero, produto in enumerate(query, start=1):
+                escritor.writerow(linha_csv_estoque(
+                    self._formatar_grupo_estoque(produto, hoje, data_limite)
+                ))
+
+                if numero % tamanho_lote == 0:
+                    yield buffer.getvalue()
+                    buffer.seek(0)
+                    buffer.truncate()
+
+            if buffer.tell():
+                yield buffer.getvalue()
+
+        except Exception as e:
+            raise Exception(f"Erro ao exportar estoque: {str(e)}")
+
+    def pesquisar_estoque(self,
+                          termo: str = "",
+                          campos: Optional[List[str]] = None,
+                          tamanhos: Optional[List[str]] = None,
+                          status: Optional[List[str]] = None,
+                          fornecedor_id: Optional[int] = None,
+                          limite: int = 200) -> List[Dict]:
+        """
+        Busca no estoque agrupado usando o índice de texto completo (FTS5)
+        Cada palavra do termo é buscada por prefixo nos campos informados
+        (codigo_barras, referencia, descricao, fornecedor; padrão: todos), aceitando
+        também termos parecidos (erros de digitação), e os grupos são ordenados
+        por similaridade e relevância. Sem termo, aplica apenas os filtros.
+        """
+        try:
+            hoje = datetime.now()
+            data_limite = hoje - timedelta(days=DIAS_SEM_MOVIMENTO)
+
+            query = self._query_estoque_agrupado(data_limite, fornecedor_id, tamanhos, status)
+
+            tem_termo = bool(termo and termo.strip())
+            aproximada = tem_termo and campos != ["codigo_barras"]
+
+            if tem_termo:
+                consulta = montar_consulta_fts(
+                    termo, campos, indice_produtos(self.db) if aproximada else None
+                )
+                if not consulta:
+                    return []
+
+                # Melhor relevância entre os produtos de cada grupo
+                busca = subconsulta_busca(consulta)
+                grupos = self.db.query(
+                    Produto.referencia,
+                    Produto.tamanho,
+                    NotaEntrada.fornecedor_id,
+                    func.min(busca.c.rank).label('rank')
+                ).join(
+                    busca, busca.c.produto_id == Produto.id
+                ).join(
+                    NotaEntrada, Produto.nota_entrada_id == NotaEntrada.id
+                ).filter(
+                    Produto.status == StatusProduto.EM_ESTOQUE
+                ).group_by(
+                    Produto.referencia,
+                    Produto.tamanho,
+                    NotaEntrada.fornecedor_id
+                ).subquery()
+
+                query = query.join(
+                    grupos,
+                    and_(
+                        EstoqueResumo.referencia == grupos.c.referencia,
+                        EstoqueResumo.tamanho == grupos.c.tamanho,
+                        EstoqueResumo.fornecedor_id == grupos.c.fornecedor_id
+                    )
+                ).order_by(grupos.c.rank)
+
+            produtos = query.order_by(
+                EstoqueResumo.referencia,
+                EstoqueResumo.tamanho,
+                EstoqueResumo.fornecedor_id
+            ).limit(limite).all()
+
+            resultados = [self._formatar_grupo_estoque(p, hoje, data_limite) for p in produtos]
+
+            # Coincidências exatas e por prefixo antes das aproximadas
+            if aproximada:
+                resultados.sort(key=lambda r: -similaridade_texto(
+                    termo, f"{r['referencia']} {r['descricao']} {r['fornecedor']}"
+                ))
+
+            return resultados
+
+        except Exception as e:
+            raise Exception(f"Erro ao pesquisar estoque: {str(e)}")
+
     def buscar_estoque(self,
                        termo: str,
                        filtro: str = "referencia") -> List[Dict]:
@@ -106,15 +415,18 @@ class EstoqueController:
                 Produto.status == StatusProduto.EM_ESTOQUE
             )
 
-            # Aplicar filtro de busca
-            if filtro == "referencia":
-                query = query.filter(Produto.referencia.ilike(f"%{termo}%"))
-            elif filtro == "descricao":
-                query = query.filter(Produto.descricao.ilike(f"%{termo}%"))
-            elif filtro == "codigo_barras":
+            # Aplicar filtro de busca (código exato pelo índice único, demais pelo
+            # índice de texto, tolerando erros de digitação)
+            if filtro == "codigo_barras":
                 query = query.filter(Produto.codigo_barras == termo)
-            elif filtro == "fornecedor":
-                query = query.filter(Fornecedor.nome.ilike(f"%{termo}%"))
+            elif filtro in ("referencia", "descricao", "fornecedor"):
+                consulta = montar_consulta_fts(termo, [filtro], indice_produtos(self.db))
+                if not consulta:
+                    return []
+                busca = subconsulta_busca(consulta)
+                query = query.join(
+                    busca, busca.c.produto_id == Produto.id
+                ).order_by(busca.c.rank)
 
             resultados = []
             for produto, numero_nota, fornecedor_nome in query.all():
@@ -130,6 +442,9 @@ class EstoqueController:
                     "fornecedor": fornecedor_nome
                 })
 
+            if filtro in ("referencia", "descricao", "fornecedor"):
+                resultados.sort(key=lambda r: -similaridade_texto(termo, r[filtro]))
+
             return resultados
 
         except Exception as e:
@@ -140,17 +455,14 @@ class EstoqueController:
         Análise do estoque por fornecedor
         """
         try:
+            # Lê o resumo materializado em vez de agregar todos os produtos
             query = self.db.query(
                 Fornecedor.nome,
-                func.count(Produto.id).label('total_produtos'),
-                func.sum(Produto.quantidade_atual).label('total_pecas'),
-                func.sum(Produto.quantidade_atual * Produto.valor_unitario).label('valor_total')
-            ).join(
-                NotaEntrada, Fornecedor.id == NotaEntrada.fornecedor_id
+                func.sum(EstoqueResumo.total_lotes).label('total_produtos'),
+                func.sum(EstoqueResumo.quantidade_total).label('total_pecas'),
+                func.sum(EstoqueResumo.valor_total).label('valor_total')
             ).join(
-                Produto, NotaEntrada.id == Produto.nota_entrada_id
-            ).filter(
-                Produto.status == StatusProduto.EM_ESTOQUE
+                EstoqueResumo, Fornecedor.id == EstoqueResumo.fornecedor_id
             ).group_by(
                 Fornecedor.id, Fornecedor.nome
             )
@@ -172,39 +484,48 @@ class EstoqueController:
         except Exception as e:
             raise Exception(f"Erro ao analisar estoque por fornecedor: {str(e)}")
 
-    def analise_estoque_antiguidade(self) -> Dict:
+    def analise_estoque_antiguidade(self, faixas: Optional[List[int]] = None) -> Dict:
         """
         Análise do estoque por antiguidade dos produtos
+        faixas: limites das faixas em dias (padrão 30/60/90); todas as faixas
+        são calculadas em uma única consulta agrupada por CASE
         """
         try:
-            hoje = datetime.now()
-            faixas = {
-                "ate_30_dias": (hoje - timedelta(days=30), hoje),
-                "30_60_dias": (hoje - timedelta(days=60), hoje - timedelta(days=30)),
-                "60_90_dias": (hoje - timedelta(days=90), hoje - timedelta(days=60)),
-                "mais_90_dias": (None, hoje - timedelta(days=90))
-            }
+            limites = sorted(set(faixas or FAIXAS_ANTIGUIDADE_PADRAO))
+            if limites[0] <= 0:
+                raise ValueError("Os limites das faixas devem ser positivos")
 
-            resultado = {}
-            for faixa, (data_inicio, data_fim) in faixas.items():
-                query = self.db.query(
-                    func.count(Produto.id).label('total_produtos'),
-                    func.sum(Produto.quantidade_atual).label('total_pecas'),
-                    func.sum(Produto.quantidade_atual * Produto.valor_unitario).label('valor_total')
-                ).join(
-                    NotaEntrada, Produto.nota_entrada_id == NotaEntrada.id
-                ).filter(
-                    Produto.status == StatusProduto.EM_ESTOQUE
-                )
+            hoje = datetime.now()
+            nomes = nomes_faixas_antiguidade(limites)
 
-                if data_inicio:
-                    query = query.filter(NotaEntrada.data_emissao >= data_inicio)
-                if data_fim:
-                    query = query.filter(NotaEntrada.data_emissao < data_fim)
+            # Cada produto cai na primeira faixa cujo limite ainda o contém
+            faixa = case(
+                *[
+                    (NotaEntrada.data_emissao >= hoje - timedelta(days=dias), indice)
+                    for indice, dias in enumerate(limites)
+                ],
+                else_=len(limites)
+            ).label('faixa')
 
-                total_produtos, total_pecas, valor_total = query.first()
+            query = self.db.query(
+                faixa,
+                func.count(Produto.id).label('total_produtos'),
+                func.sum(Produto.quantidade_atual).label('total_pecas'),
+                func.sum(Produto.quantidade_atual * Produto.valor_unitario).label('valor_total')
+            ).join(
+                NotaEntrada, Produto.nota_entrada_id == NotaEntrada.id
+            ).filter(
+                Produto.status == StatusProduto.EM_ESTOQUE
+            ).group_by(
+                faixa
+            )
 
-                resultado[faixa] = {
+            resultado = {
+                nome: {"total_produtos": 0, "total_pecas": 0, "valor_total": 0.0}
+                for nome in nomes
+            }
+            for indice, total_produtos, total_pecas, valor_total in query.all():
+                resultado[nomes[indice]] = {
                     "total_produtos": total_produtos or 0,
                     "total_pecas": total_pecas or 0,
                     "valor_total": float(valor_total or 0)
@@ -215,24 +536,68 @@ class EstoqueController:
         except Exception as e:
             raise Exception(f"Erro ao analisar estoque por antiguidade: {str(e)}")
 
+    def _filtros_sem_movimento(self, data_limite: datetime) -> List:
+        """
+        Critério de produto sem movimento: em estoque, com entrada anterior ao
+        limite e sem nenhuma venda finalizada a partir do limite
+        """
+        vendido_no_periodo = exists().where(
+            ItemVenda.produto_id == Produto.id,
+            Venda.id == ItemVenda.venda_id,
+            Venda.status == StatusVenda.FINALIZADA,
+            Venda.data_hora >= data_limite
+        )
+        return [
+            Produto.status == StatusProduto.EM_ESTOQUE,
+            NotaEntrada.data_emissao < data_limite,
+            ~vendido_no_periodo
+        ]
+
+    def contar_produtos_sem_movimento(self, dias: int = 30) -> int:
+        """
+        Conta produtos sem movimentação no período especificado
+        A contagem é feita no banco, sem carregar os produtos
+        """
+        try:
+            data_limite = datetime.now() - timedelta(days=dias)
+
+            return self.db.query(func.count(Produto.id)).join(
+                NotaEntrada, Produto.nota_entrada_id == NotaEntrada.id
+            ).filter(
+                *self._filtros_sem_movimento(data_limite)
+            ).scalar() or 0
+
+        except Exception as e:
+            raise Exception(f"Erro ao contar produtos sem movimento: {str(e)}")
+
     def produtos_sem_movimento(self, dias: int = 30) -> List[Dict]:
         """
         Lista produtos sem movimentação no período especificado
+        A última movimentação é a venda mais recente do produto ou, sem vendas, a entrada
         """
         try:
-            data_limite = datetime.now() - timedelta(days=dias)
+            hoje = datetime.now()
+            data_limite = hoje - timedelta(days=dias)
+
+            ultima_venda = select(
+                func.max(Venda.data_hora)
+            ).where(
+                ItemVenda.produto_id == Produto.id,
+                Venda.id == ItemVenda.venda_id,
+                Venda.status == StatusVenda.FINALIZADA
+            ).correlate(Produto).scalar_subquery()
 
             produtos = self.db.query(
                 Produto,
                 NotaEntrada.numero_nota,
-                Fornecedor.nome.label('fornecedor_nome')
+                Fornecedor.nome.label('fornecedor_nome'),
+                func.coalesce(ultima_venda, NotaEntrada.data_emissao).label('ultima_movimentacao')
             ).join(
                 NotaEntrada, Produto.nota_entrada_id == NotaEntrada.id
             ).join(
                 Fornecedor, NotaEntrada.fornecedor_id == Fornecedor.id
             ).filter(
-                Produto.status == StatusProduto.EM_ESTOQUE,
-                NotaEntrada.data_emissao < data_limite
+                *self._filtros_sem_movimento(data_limite)
             ).all()
 
             return [{
@@ -245,8 +610,8 @@ class EstoqueController:
                 "valor_unitario": float(p.valor_unitario),
                 "nota_entrada": nota,
                 "fornecedor": fornecedor,
-                "dias_sem_movimento": (datetime.now() - p.data_registro).days
-            } for p, nota, fornecedor in produtos]
+                "dias_sem_movimento": (hoje - ultima_movimentacao).days
+            } for p, nota, fornecedor, ultima_movimentacao in produtos]
 
         except Exception as e:
-            raise Exception(f"Erro ao listar produtos sem movimento: {str(e)}")
\ No newline at end of file
+            raise Exception(f"Erro ao listar produtos sem movimento: {str(e)}")
@@ -0,0 +1,136 @@
+# src/controllers/estoque_resumo.py
+from typing import Iterable, List, Tuple
+from sqlalchemy.orm import Session
+from sqlalchemy import func, select, delete, insert, tuple_
+from ..models import Produto, NotaEntrada, StatusProduto, EstoqueResumo
+
+# Quantidade de grupos recalculados por comando (limita os parâmetros do IN)
+TAMANHO_LOTE_GRUPOS = 300
+
+
+# Mantém a tabela estoque_resumo sincronizada com os produtos em estoque.
+# Os métodos de atualização não fazem commit: são chamados dentro da
+# transação da operação que movimentou o estoque.
+class EstoqueResumoController:
+    def __init__(self, db: Session):
+        self.db = db
+
+    def _select_grupos(self):
+        """
+        Agregação dos produtos em estoque por referência, tamanho e fornecedor
+        """
+        return select(
+            Produto.referencia,
+            Produto.tamanho,
+            NotaEntrada.fornecedor_id,
+            func.max(Produto.descricao),
+            func.count(Produto.id),
+            func.sum(Produto.quantidade_atual),
+            func.avg(Produto.valor_unitario),
+            func.sum(Produto.quantidade_atual * Produto.valor_unitario),
+            func.min(NotaEntrada.data_emissao),
+            func.max(NotaEntrada.data_emissao)
+        ).join(
+            NotaEntrada, Produto.nota_entrada_id == NotaEntrada.id
+        ).where(
+            Produto.status == StatusProduto.EM_ESTOQUE
+        ).group_by(
+            Produto.referencia,
+            Produto.tamanho,
+            NotaEntrada.fornecedor_id
+        )
+
+    def _inserir_grupos(self, consulta):
+        """
+        Insere no resumo o resultado de uma consulta de _select_grupos
+        """
+        self.db.execute(
+            insert(EstoqueResumo).from_select(
+                [
+                    EstoqueResumo.referencia,
+                    EstoqueResumo.tamanho,
+                    EstoqueResumo.fornecedor_id,
+                    EstoqueResumo.descricao,
+                    EstoqueResumo.total_lotes,
+                    EstoqueResumo.quantidade_total,
+                    EstoqueResumo.valor_unitario_medio,
+                    EstoqueResumo.valor_total,
+                    EstoqueResumo.primeira_entrada,
+                    EstoqueResumo.ultima_entrada
+                ],
+                consulta
+            )
+        )
+
+    def atualizar_grupos(self, chaves: Iterable[Tuple[str, str, int]]):
+        """
+        Recalcula os grupos (referencia, tamanho, fornecedor_id) informados
+        Grupos sem produtos em estoque deixam de existir no resumo
+        """
+        chaves = list(set(chaves))
+        for inicio in range(0, len(chaves), TAMANHO_LOTE_GRUPOS):
+            lote = chaves[inicio:inicio + TAMANHO_LOTE_GRUPOS]
+
+            self.db.execute(
+                delete(EstoqueResumo).where(
+                    tuple_(
+                        EstoqueResumo.referencia,
+                        EstoqueResumo.tamanho,
+                        EstoqueResumo.fornecedor_id
+                    ).in_(lote)
+                )
+            )
+            self._inserir_grupos(
+                self._select_grupos().where(
+                    tuple_(
+                        Produto.referencia,
+                        Produto.tamanho,
+                        NotaEntrada.fornecedor_id
+                    ).in_(lote)
+                )
+            )
+
+    def chaves_produtos(self, produto_ids: Iterable[int]) -> List[Tuple[str, str, int]]:
+        """
+        Retorna as chaves de grupo dos produtos informados
+        """
+        produto_ids = list(set(produto_ids))
+        chaves = []
+        for inicio in range(0, len(produto_ids), TAMANHO_LOTE_GRUPOS):
+            chaves.extend(
+                tuple(chave) for chave in self.db.query(
+                    Produto.referencia,
+                    Produto.tamanho,
+                    NotaEntrada.fornecedor_id
+                ).join(
+                    NotaEntrada, Produto.nota_entrada_id == NotaEntrada.id
+                ).filter(
+                    Produto.id.in_(produto_ids[inicio:inicio + TAMANHO_LOTE_GRUPOS])
+                ).distinct().all()
+            )
+        return chaves
+
+    def atualizar_produtos(self, produto_ids: Iterable[int]):
+        """
+        Recalcula os grupos do resumo afetados pelos produtos informados
+        """
+        # A sessão não usa autoflush: garante que as alterações pendentes entrem no cálculo
+        self.db.flush()
+        self.atualizar_grupos(self.chaves_produtos(produto_ids))
+
+    def reconstruir(self) -> int:
+        """
+        Reconstrói o resumo inteiro a partir dos produtos em estoque
+        Retorna a quantidade de grupos gerados
+        """
+        try:
+            self.db.execute(delete(EstoqueResumo))
+            self._inserir_grupos(self._select_grupos())
+            total = self.db.query(func.count(EstoqueResumo.id)).scalar()
+
+            self.db.commit()
+            return total
+
+        except Exception as e:
+            self.db.rollback()
+            raise Exception(f"Erro ao reconstruir resumo do estoque: {str(e)}")
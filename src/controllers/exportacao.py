@@ -0,0 +1,265 @@
+# src/controllers/exportacao.py
+import enum
+import os
+from typing import Dict, List, Optional, Tuple
+from datetime import datetime
+from sqlalchemy.orm import Session
+from sqlalchemy import select, text, Integer, String, DateTime, Numeric, Boolean, Enum
+from ..models import Venda, ItemVenda, Produto, NotaEntrada, MarcaExportacao
+from ..utils.alteracoes import valor_atual_alteracoes
+
+# Linhas lidas do banco e gravadas no arquivo por vez
+TAMANHO_LOTE_EXPORTACAO = 50000
+
+FORMATOS_EXPORTACAO = {"parquet": ".parquet", "arrow": ".arrow"}
+
+# Tabelas exportáveis e a coluna de data usada no filtro por período.
+# Itens de venda não têm data própria: o período é o da venda.
+TABELAS_EXPORTACAO = {
+    "vendas": (Venda.__table__, Venda.data_hora),
+    "itens_venda": (ItemVenda.__table__, Venda.data_hora),
+    "produtos": (Produto.__table__, Produto.data_registro),
+    "notas_entrada": (NotaEntrada.__table__, NotaEntrada.data_emissao),
+}
+
+
+def _importar_pyarrow():
+    """Importa o pyarrow, dependência opcional usada apenas na exportação"""
+    try:
+        import pyarrow
+        import pyarrow.parquet
+        import pyarrow.ipc
+    except ImportError:
+        raise ImportError("Exportação requer o pacote pyarrow (pip install pyarrow)")
+    return pyarrow
+
+
+def _tipo_arrow(pa, coluna):
+    """Tipo Arrow equivalente ao tipo da coluna no banco"""
+    tipo = coluna.type
+    if isinstance(tipo, Enum):
+        return pa.dictionary(pa.int8(), pa.string())
+    if isinstance(tipo, Boolean):
+        return pa.bool_()
+    if isinstance(tipo, Integer):
+        return pa.int64()
+    if isinstance(tipo, Numeric):
+        return pa.decimal128(tipo.precision, tipo.scale)
+    if isinstance(tipo, DateTime):
+        return pa.timestamp("us")
+    if isinstance(tipo, String):
+        return pa.string()
+    raise ValueError(f"Tipo de coluna sem equivalente para exportação: {coluna.name}")
+
+
+def _abrir_escritor(pa, arquivo: str, esquema, formato: str):
+    """Escritor Parquet (zstd) ou Arrow IPC (zstd) do arquivo"""
+    if formato == "parquet":
+        return pa.parquet.ParquetWriter(arquivo, esquema, compression="zstd")
+    return pa.ipc.new_file(
+        arquivo, esquema,
+        options=pa.ipc.IpcWriteOptions(compression="zstd")
+    )
+
+
+class ExportacaoController:
+    def __init__(self, db: Session):
+        self.db = db
+
+    def _consulta_tabela(self,
+                         tabela: str,
+                         inicio: Optional[datetime],
+                         fim: Optional[datetime],
+                         alteracoes: Optional[Tuple[int, int]]):
+        """
+        SELECT (Core) das linhas da tabela no período ou, no modo incremental,
+        alteradas na faixa (marca d'água, teto] da sequência de alterações
+        """
+        tabela_banco, coluna_data = TABELAS_EXPORTACAO[tabela]
+
+        if alteracoes:
+            marca, teto = alteracoes
+            return select(tabela_banco).where(
+                tabela_banco.c.seq_alteracao > marca,
+                tabela_banco.c.seq_alteracao <= teto
+            ).order_by(tabela_banco.c.seq_alteracao)
+
+        consulta = select(tabela_banco)
+
+        if inicio or fim:
+            if tabela == "itens_venda":
+                consulta = consulta.join(Venda.__table__, tabela_banco.c.venda_id == Venda.id)
+            if inicio:
+                consulta = consulta.where(coluna_data >= inicio)
+            if fim:
+                consulta = consulta.where(coluna_data <= fim)
+
+        return consulta.order_by(tabela_banco.c.id)
+
+    def obter_marca(self, tabela: str) -> int:
+        """
+        Valor da sequência de alterações até o qual a tabela já foi exportada
+        no modo incremental (0 se nunca exportada)
+        """
+        return self.db.query(MarcaExportacao.ultima_alteracao).filter(
+            MarcaExportacao.tabela == tabela
+        ).scalar() or 0
+
+    def _exportar_exclusoes(self, pa, tabela: str, arquivo: str, formato: str,
+                            marca: int, teto: int) -> int:
+        """
+        Grava os ids excluídos da tabela na faixa (marca, teto] da sequência
+        de alterações. Retorna quantos; sem exclusões, nenhum arquivo é criado.
+        """
+        exclusoes = self.db.execute(text("""
+            SELECT registro_id, seq_alteracao FROM exportacao_exclusoes
+            WHERE tabela = :tabela AND seq_alteracao > :marca AND seq_alteracao <= :teto
+            ORDER BY seq_alteracao
+        """), {"tabela": tabela, "marca": marca, "teto": teto}).all()
+        if not exclusoes:
+            return 0
+
+        esquema = pa.schema([
+            pa.field("id", pa.int64(), nullable=False),
+            pa.field("seq_alteracao", pa.int64(), nullable=False)
+        ])
+        escritor = _abrir_escritor(pa, arquivo, esquema, formato)
+        try:
+            ids, sequencias = zip(*exclusoes)
+            escritor.write_table(pa.Table.from_arrays(
+                [pa.array(ids, pa.int64()), pa.array(sequencias, pa.int64())], schema=esquema
+            ))
+        finally:
+            escritor.close()
+        return len(exclusoes)
+
+    def exportar_tabela(self,
+                        tabela: str,
+                        diretorio: str,
+                        inicio: Optional[datetime] = None,
+                        fim: Optional[datetime] = None,
+                        incremental: bool = False,
+                        formato: str = "parquet",
+                        tamanho_lote: int = TAMANHO_LOTE_EXPORTACAO) -> Dict:
+        """
+        Exporta uma tabela para um arquivo Parquet (zstd) ou Arrow IPC, em lotes
+        As linhas são lidas com SELECTs do Core, sem montar objetos do ORM.
+        No modo incremental exporta as linhas inseridas ou alteradas desde a
+        marca d'água (pela seq_alteracao mantida por triggers, não pelo id):
+        uma linha alterada depois de exportada sai de novo, e quem consome
+        fica com a versão de maior seq_alteracao de cada id. Linhas excluídas
+        vão para um arquivo "_exclusoes" ao lado. A marca avança depois que
+        os arquivos são gravados. Não aceita período (inicio/fim).
+        """
+        try:
+            if tabela not in TABELAS_EXPORTACAO:
+                raise ValueError(f"Tabela não exportável: {tabela}")
+            if formato not in FORMATOS_EXPORTACAO:
+                raise ValueError(f"Formato de exportação inválido: {formato}")
+            if incremental and (inicio or fim):
+                raise ValueError("A exportação incremental não aceita período (início/fim)")
+
+            pa = _importar_pyarrow()
+            tabela_banco = TABELAS_EXPORTACAO[tabela][0]
+            colunas = list(tabela_banco.columns)
+            esquema = pa.schema([
+                pa.field(c.name, _tipo_arrow(pa, c), nullable=c.nullable) for c in colunas
+            ])
+
+            alteracoes = None
+            if incremental:
+                # O teto é lido antes das linhas: tudo até ele já está confirmado, e o
+                # que for gravado durante a exportação fica para a próxima
+                marca = self.obter_marca(tabela)
+                alteracoes = (marca, valor_atual_alteracoes(self.db.connection()))
+            consulta = self._consulta_tabela(tabela, inicio, fim, alteracoes)
+
+            # Nome do arquivo identifica a tabela, o período e o momento da exportação
+            partes = [tabela]
+            if inicio:
+                partes.append(inicio.strftime("%Y%m%d"))
+            if fim:
+                partes.append(fim.strftime("%Y%m%d"))
+            if incremental:
+                partes.append(f"desde_{alteracoes[0]}")
+            partes.append(datetime.now().strftime("%Y%m%d_%H%M%S"))
+            os.makedirs(diretorio, exist_ok=True)
+            arquivo = os.path.join(diretorio, "_".join(partes) + FORMATOS_EXPORTACAO[formato])
+
+            escritor = _abrir_escritor(pa, arquivo, esquema, formato)
+
+            total_linhas = 0
+            ultimo_id = 0
+            try:
+                resultado = self.db.execute(
+                    consulta.execution_options(stream_results=True, yield_per=tamanho_lote)
+                )
+                for lote in resultado.partitions():
+                    valores = list(zip(*lote))
+                    dados = [
+                        [v.value if isinstance(v, enum.Enum) else v for v in valores[i]]
+                        if isinstance(coluna.type, Enum) else list(valores[i])
+                        for i, coluna in enumerate(colunas)
+                    ]
+                    escritor.write_table(pa.Table.from_arrays(
+                        [pa.array(d, type=campo.type) for d, campo in zip(dados, esquema)],
+                        schema=esquema
+                    ))
+                    total_linhas += len(lote)
+                    ultimo_id = max(ultimo_id, max(linha.id for linha in lote))
+            finally:
+                escritor.close()
+
+            exclusoes = 0
+            arquivo_exclusoes = None
+            if incremental:
+                arquivo_exclusoes = os.path.join(
+                    diretorio, "_".join(partes + ["exclusoes"]) + FORMATOS_EXPORTACAO[formato]
+                )
+                exclusoes = self._exportar_exclusoes(pa, tabela, arquivo_exclusoes, formato,
+                                                     *alteracoes)
+                if not exclusoes:
+                    arquivo_exclusoes = None
+
+                if total_linhas or exclusoes:
+                    marca = self.db.query(MarcaExportacao).filter(
+                        MarcaExportacao.tabela == tabela
+                    ).first()
+                    if not marca:
+                        marca = MarcaExportacao(tabela=tabela, ultimo_id=0)
+                        self.db.add(marca)
+                    marca.ultimo_id = max(marca.ultimo_id, ultimo_id)
+                    marca.ultima_alteracao = alteracoes[1]
+                    marca.data_exportacao = datetime.now()
+                    marca.arquivo = arquivo
+                    self.db.commit()
+
+            return {
+                "tabela": tabela,
+                "arquivo": arquivo,
+                "linhas": total_linhas,
+                "ultimo_id": ultimo_id,
+                "ultima_alteracao": alteracoes[1] if incremental else None,
+                "exclusoes": exclusoes,
+                "arquivo_exclusoes": arquivo_exclusoes
+            }
+
+        except Exception as e:
+            self.db.rollback()
+            raise Exception(f"Erro ao exportar {tabela}: {str(e)}")
+
+    def exportar(self,
+                 diretorio: str,
+                 tabelas: Optional[List[str]] = None,
+                 inicio: Optional[datetime] = None,
+                 fim: Optional[datetime] = None,
+                 incremental: bool = False,
+                 formato: str = "parquet") -> List[Dict]:
+        """
+        Exporta as tabelas informadas (padrão: vendas, itens_venda, produtos e
+        notas_entrada), um arquivo por tabela
+        """
+        return [
+            self.exportar_tabela(tabela, diretorio, inicio, fim, incremental, formato)
+            for tabela in (tabelas or list(TABELAS_EXPORTACAO))
+        ]
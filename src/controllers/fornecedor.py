@@ -1,8 +1,8 @@
 # src/controllers/fornecedor.py
 from typing import Optional, List
 from sqlalchemy.orm import Session
-from sqlalchemy import or_
 from ..models import Fornecedor, LogAcao, TipoAcao, NotaEntrada, StatusNota
+from ..utils.busca import indice_fornecedores
 
 
 class FornecedorController:
@@ -147,16 +147,34 @@ class FornecedorController:
     def pesquisar_fornecedores(self, termo_busca: str) -> List[Fornecedor]:
         """
         Pesquisa fornecedores por nome ou CNPJ
-        Retorna lista de fornecedores que correspondem à busca
+        O nome é buscado no índice de trigramas, tolerando erros de digitação;
+        sem termo, retorna todos os fornecedores ativos por nome
+        Retorna lista de fornecedores ordenada pela similaridade com a busca
         """
         try:
-            return self.db.query(Fornecedor).filter(
-                Fornecedor.ativo == True,
-                or_(
-                    Fornecedor.nome.ilike(f"%{termo_busca}%"),
+            # Sem termo, lista todos os fornecedores ativos
+            termo_busca = termo_busca.strip()
+            if not termo_busca:
+                return self.db.query(Fornecedor).filter(
+                    Fornecedor.ativo == True
+                ).order_by(Fornecedor.nome).all()
+
+            # Busca sem letras é por CNPJ (tabela pequena, comparação direta)
+            if not any(c.isalpha() for c in termo_busca):
+                return self.db.query(Fornecedor).filter(
+                    Fornecedor.ativo == True,
                     Fornecedor.cnpj.ilike(f"%{termo_busca}%")
-                )
-            ).order_by(Fornecedor.nome).all()
+                ).order_by(Fornecedor.nome).all()
+
+            similares = dict(indice_fornecedores(self.db).buscar(termo_busca))
+            if not similares:
+                return []
+
+            fornecedores = self.db.query(Fornecedor).filter(
+                Fornecedor.ativo == True,
+                Fornecedor.id.in_(similares)
+            ).all()
+            return sorted(fornecedores, key=lambda f: (-similares[f.id], f.nome))
         except Exception as e:
             raise Exception(f"Erro ao pesquisar fornecedores: {str(e)}")
 
@@ -0,0 +1,432 @@
+# src/controllers/importacao.py
+import os
+import shutil
+import threading
+from typing import Dict, List, Optional
+import pandas as pd
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+from ..models import (get_db, Importacao, ErroImportacao, StatusImportacao, NotaEntrada,
+                      StatusNota, LogAcao, TipoAcao)
+from ..utils.cache_produtos import cache_codigos
+from ..utils.database import banco_bloqueado
+from ..utils.planilhas import ler_planilha_em_blocos, hash_arquivo
+from ..utils.validators import validar_produtos_importacao, COLUNAS_RELATORIO_ERROS
+from .nota_entrada import NotaEntradaController
+from .venda import BancoOcupado
+
+# Diretório das planilhas em importação (relativo ao diretório do aplicativo)
+DIRETORIO_IMPORTACOES = "importacoes"
+
+# Linhas gravadas por transação (e entre dois pontos de retomada)
+TAMANHO_BLOCO_IMPORTACAO = 2000
+
+# Intervalo (segundos) entre as verificações de importações pendentes
+INTERVALO_PROCESSAMENTO_IMPORTACOES = 5
+
+STATUS_ATIVOS = (StatusImportacao.PENDENTE, StatusImportacao.EM_ANDAMENTO)
+
+
+class ImportacaoController:
+    def __init__(self, db: Session):
+        self.db = db
+        self.nota_controller = NotaEntradaController(db)
+
+    def criar_importacao(self,
+                         nota_id: int,
+                         caminho: str,
+                         nome_arquivo: str,
+                         usuario_id: int,
+                         tudo_ou_nada: bool = False,
+                         total_linhas: Optional[int] = None) -> Importacao:
+        """
+        Registra a importação de uma planilha já salva em disco, para processamento
+        em segundo plano. O arquivo é movido para DIRETORIO_IMPORTACOES (sobrevive
+        a reinícios do servidor). Se o mesmo arquivo (pelo hash do conteúdo) já
+        estiver em importação ou já tiver sido importado para a nota, retorna a
+        importação existente sem criar outra.
+        """
+        try:
+            nota = self.db.query(NotaEntrada).filter(
+                NotaEntrada.id == nota_id,
+                NotaEntrada.status == StatusNota.ATIVA
+            ).first()
+
+            if not nota:
+                raise ValueError("Nota de entrada não encontrada ou não está ativa")
+
+            hash_conteudo = hash_arquivo(caminho)
+            existente = self.buscar_importacao_arquivo(nota_id, hash_conteudo)
+
+            if existente:
+                os.remove(caminho)
+                return existente
+
+            importacao = Importacao(
+                nota_entrada_id=nota_id,
+                usuario_id=usuario_id,
+                nome_arquivo=nome_arquivo,
+                arquivo=caminho,
+                hash_arquivo=hash_conteudo,
+                status=StatusImportacao.PENDENTE,
+                tudo_ou_nada=tudo_ou_nada,
+                total_linhas=total_linhas,
+                ultima_linha=0,
+                importados=0,
+                atualizados=0,
+                ignorados=0,
+                total_erros=0
+            )
+            self.db.add(importacao)
+            self.db.flush()  # Para obter o ID da importação
+
+            os.makedirs(DIRETORIO_IMPORTACOES, exist_ok=True)
+            destino = os.path.join(
+                DIRETORIO_IMPORTACOES,
+                f"{importacao.id}{os.path.splitext(nome_arquivo)[1].lower()}"
+            )
+            shutil.move(caminho, destino)
+            importacao.arquivo = destino
+
+            # Registra no log
+            log = LogAcao(
+                usuario_id=usuario_id,
+                tipo_acao=TipoAcao.INSERCAO_ITEM,
+                descricao=f"Importação da planilha {nome_arquivo} para a nota {nota.numero_nota}",
+                tabela_afetada="importacoes",
+                referencia_id=importacao.id
+            )
+            self.db.add(log)
+
+            self.db.commit()
+            return importacao
+
+        except Exception as e:
+            self.db.rollback()
+            raise Exception(f"Erro ao criar importação: {str(e)}")
+
+    def buscar_importacao_arquivo(self, nota_id: int, hash_conteudo: str) -> Optional[Importacao]:
+        """
+        Importação do mesmo arquivo (hash SHA-256 do conteúdo) para a nota que
+        esteja em andamento ou concluída; importações com erro não contam
+        """
+        return self.db.query(Importacao).filter(
+            Importacao.nota_entrada_id == nota_id,
+            Importacao.hash_arquivo == hash_conteudo,
+            Importacao.status.in_(STATUS_ATIVOS + (StatusImportacao.CONCLUIDA,))
+        ).order_by(Importacao.id.desc()).first()
+
+    def situacao(self, importacao_id: int) -> Dict:
+        """
+        Progresso de uma importação (consultado periodicamente pela tela)
+        """
+        try:
+            importacao = self.db.query(Importacao).filter(
+                Importacao.id == importacao_id
+            ).first()
+
+            if not importacao:
+                raise ValueError("Importação não encontrada")
+
+            return self._situacao(importacao)
+        except Exception as e:
+            raise Exception(f"Erro ao consultar importação: {str(e)}")
+
+    def _situacao(self, importacao: Importacao) -> Dict:
+        percentual = None
+        if importacao.status == StatusImportacao.CONCLUIDA:
+            percentual = 100.0
+        elif importacao.total_linhas:
+            percentual = min(importacao.ultima_linha / importacao.total_linhas * 100, 100.0)
+
+        return {
+            "id": importacao.id,
+            "nome_arquivo": importacao.nome_arquivo,
+            "status": importacao.status.value,
+            "tudo_ou_nada": importacao.tudo_ou_nada,
+            "total_linhas": importacao.total_linhas,
+            "linhas_processadas": importacao.ultima_linha,
+            "importados": importacao.importados,
+            "atualizados": importacao.atualizados,
+            "ignorados": importacao.ignorados,
+            "total_erros": importacao.total_erros,
+            "percentual": percentual,
+            "mensagem": importacao.mensagem,
+            "data_criacao": importacao.data_criacao,
+            "data_atualizacao": importacao.data_atualizacao,
+            "data_conclusao": importacao.data_conclusao
+        }
+
+    def listar_importacoes(self,
+                           nota_id: Optional[int] = None,
+                           limite: Optional[int] = None) -> List[Dict]:
+        """
+        Importações (da nota, se informada), da mais recente para a mais antiga
+        """
+        try:
+            query = self.db.query(Importacao)
+
+            if nota_id:
+                query = query.filter(Importacao.nota_entrada_id == nota_id)
+
+            query = query.order_by(Importacao.id.desc())
+            if limite:
+                query = query.limit(limite)
+
+            return [self._situacao(importacao) for importacao in query.all()]
+        except Exception as e:
+            raise Exception(f"Erro ao listar importações: {str(e)}")
+
+    def listar_erros(self, importacao_id: int, limite: Optional[int] = None) -> Dict[str, list]:
+        """
+        Log de erros da importação, em colunas ({linha, codigo_barras, campo, erro})
+        """
+        try:
+            query = self.db.query(
+                ErroImportacao.linha,
+                ErroImportacao.codigo_barras,
+                ErroImportacao.campo,
+                ErroImportacao.erro
+            ).filter(
+                ErroImportacao.importacao_id == importacao_id
+            ).order_by(ErroImportacao.linha, ErroImportacao.id)
+
+            if limite:
+                query = query.limit(limite)
+
+            linhas = query.all()
+            return {
+                coluna: [linha[posicao] for linha in linhas]
+                for posicao, coluna in enumerate(COLUNAS_RELATORIO_ERROS)
+            }
+        except Exception as e:
+            raise Exception(f"Erro ao listar erros da importação: {str(e)}")
+
+    def proxima_pendente(self) -> Optional[Importacao]:
+        """
+        Importação mais antiga ainda por fazer (pendente ou interrompida)
+        """
+        return self.db.query(Importacao).filter(
+            Importacao.status.in_(STATUS_ATIVOS)
+        ).order_by(Importacao.id).first()
+
+    def _registrar_erros(self, importacao: Importacao, erros: List[Dict]):
+        if erros:
+            self.db.bulk_insert_mappings(ErroImportacao, [
+                {"importacao_id": importacao.id, **erro} for erro in erros
+            ])
+            importacao.total_erros += len(erros)
+
+    def _encerrar(self, importacao: Importacao, status: StatusImportacao,
+                  mensagem: Optional[str] = None):
+        """Grava o status final e remove a cópia da planilha"""
+        importacao.status = status
+        importacao.mensagem = mensagem[:500] if mensagem else None
+        importacao.data_atualizacao = func.now()
+        importacao.data_conclusao = func.now()
+        self.db.commit()
+
+        if os.path.exists(importacao.arquivo):
+            os.remove(importacao.arquivo)
+
+    def _gravar_tudo_ou_nada(self, importacao: Importacao, nota: NotaEntrada):
+        """
+        Importação tudo ou nada: o arquivo inteiro é gravado em uma única transação,
+        com ultima_linha e os contadores confirmados só no fim. Qualquer erro de
+        validação (inclusive código cadastrado em outra nota durante a importação)
+        desfaz tudo e encerra com ERRO; depois do primeiro erro os blocos seguintes
+        só são validados, para o log de erros completo. Erros do banco são levantados
+        (nada fica gravado).
+        """
+        resultado = {"importados": 0, "atualizados": 0, "ignorados": 0}
+        erros = []
+        codigos = []
+        codigos_arquivo = set()
+        linhas = 0
+        for tabela in ler_planilha_em_blocos(importacao.arquivo, TAMANHO_BLOCO_IMPORTACAO):
+            if erros:
+                erros.extend(self.nota_controller.validar_bloco_importacao(
+                    nota.id, tabela, 2 + linhas, codigos_arquivo
+                )['erros'])
+            else:
+                bloco = self.nota_controller.gravar_bloco_importacao(
+                    nota, tabela, importacao.usuario_id, 2 + linhas, codigos_arquivo
+                )
+                erros.extend(bloco['erros'])
+                codigos.extend(bloco['codigos'])
+                for contador in resultado:
+                    resultado[contador] += bloco[contador]
+            linhas += len(tabela)
+
+        if erros:
+            self.db.rollback()
+            importacao.total_linhas = linhas
+            self._registrar_erros(importacao, erros)
+            self._encerrar(importacao, StatusImportacao.ERRO,
+                           "Nenhum produto importado: há linhas com erro")
+            return
+
+        importacao.importados += resultado['importados']
+        importacao.atualizados += resultado['atualizados']
+        importacao.ignorados += resultado['ignorados']
+        importacao.ultima_linha = importacao.total_linhas = linhas
+        self._encerrar(importacao, StatusImportacao.CONCLUIDA)
+        cache_codigos.invalidar(codigos)
+
+    def _gravar_bloco(self, importacao: Importacao, nota: NotaEntrada,
+                      tabela: pd.DataFrame, primeira_linha: int, codigos_arquivo: set):
+        """
+        Grava um bloco e avança o ponto de retomada na mesma transação
+        """
+        try:
+            resultado = self.nota_controller.gravar_bloco_importacao(
+                nota, tabela, importacao.usuario_id, primeira_linha, codigos_arquivo
+            )
+        except Exception as e:
+            self.db.rollback()
+            if banco_bloqueado(e):
+                raise
+            # Bloco recusado pelo banco: vai para o log de erros e a importação segue
+            resultado = {"importados": 0, "atualizados": 0, "ignorados": 0, "codigos": [], "erros": [{
+                "linha": primeira_linha,
+                "codigo_barras": None,
+                "campo": None,
+                "erro": (f"Erro ao gravar as linhas {primeira_linha} a "
+                         f"{primeira_linha + len(tabela) - 1}: {str(e)}")
+            }]}
+
+        self._registrar_erros(importacao, resultado['erros'])
+        importacao.importados += resultado['importados']
+        importacao.atualizados += resultado['atualizados']
+        importacao.ignorados += resultado['ignorados']
+        importacao.ultima_linha += len(tabela)
+        importacao.data_atualizacao = func.now()
+        self.db.commit()
+        cache_codigos.invalidar(resultado['codigos'])
+
+    def processar(self, importacao_id: int) -> Importacao:
+        """
+        Processa (ou retoma) uma importação, um bloco por transação
+        Cada bloco grava produtos, logs, resumo do estoque, erros e a nova
+        ultima_linha juntos; depois de uma queda, a importação recomeça na
+        primeira linha ainda não confirmada. Importações tudo ou nada usam uma
+        única transação (_gravar_tudo_ou_nada) e recomeçam do início.
+        Com o banco bloqueado levanta BancoOcupado e a importação continua
+        EM_ANDAMENTO (é retomada na próxima tentativa).
+        """
+        importacao = self.db.query(Importacao).filter(
+            Importacao.id == importacao_id
+        ).first()
+
+        if not importacao or importacao.status not in STATUS_ATIVOS:
+            return importacao
+
+        try:
+            nota = self.db.query(NotaEntrada).filter(
+                NotaEntrada.id == importacao.nota_entrada_id,
+                NotaEntrada.status == StatusNota.ATIVA
+            ).first()
+
+            if not nota:
+                raise ValueError("Nota de entrada não encontrada ou não está ativa")
+            if not os.path.exists(importacao.arquivo):
+                raise ValueError("Arquivo da importação não encontrado")
+
+            importacao.status = StatusImportacao.EM_ANDAMENTO
+            importacao.data_atualizacao = func.now()
+            self.db.commit()
+
+            if importacao.tudo_ou_nada:
+                self._gravar_tudo_ou_nada(importacao, nota)
+                return importacao
+
+            codigos_arquivo = set()
+            linhas = 0
+            for tabela in ler_planilha_em_blocos(importacao.arquivo, TAMANHO_BLOCO_IMPORTACAO):
+                # Linhas já confirmadas antes de uma interrupção: só refaz os códigos do arquivo
+                confirmadas = min(max(importacao.ultima_linha - linhas, 0), len(tabela))
+                if confirmadas:
+                    codigos_arquivo.update(
+                        validar_produtos_importacao(tabela.iloc[:confirmadas])[0]['codigo_barras']
+                    )
+                if confirmadas < len(tabela):
+                    self._gravar_bloco(importacao, nota, tabela.iloc[confirmadas:],
+                                       2 + linhas + confirmadas, codigos_arquivo)
+                linhas += len(tabela)
+
+            importacao.total_linhas = linhas
+            self._encerrar(importacao, StatusImportacao.CONCLUIDA)
+            return importacao
+
+        except Exception as e:
+            self.db.rollback()
+            if banco_bloqueado(e):
+                raise BancoOcupado("Banco de dados ocupado; importação será retomada") from e
+            self._encerrar(importacao, StatusImportacao.ERRO, str(e))
+            raise Exception(f"Erro ao processar importação: {str(e)}")
+
+
+def processar_importacoes_pendentes() -> int:
+    """
+    Processa em ordem as importações pendentes ou interrompidas
+    Para no banco bloqueado ou em erro; retorna quantas foram encerradas
+    """
+    processadas = 0
+    while True:
+        db = next(get_db())
+        try:
+            controller = ImportacaoController(db)
+            importacao = controller.proxima_pendente()
+            if importacao is None:
+                return processadas
+            controller.processar(importacao.id)
+            processadas += 1
+        finally:
+            db.close()
+
+
+class ProcessadorImportacoes(threading.Thread):
+    """Thread que processa as importações em segundo plano (periodicamente ou assim que acordada)"""
+
+    def __init__(self, intervalo: float = INTERVALO_PROCESSAMENTO_IMPORTACOES):
+        super().__init__(name="processador-importacoes", daemon=True)
+        self.intervalo = intervalo
+        self.ultimo_erro: Optional[str] = None
+        self._acordar = threading.Event()
+
+    def acordar(self):
+        self._acordar.set()
+
+    def run(self):
+        while True:
+            try:
+                processar_importacoes_pendentes()
+                self.ultimo_erro = None
+            except Exception as e:
+                self.ultimo_erro = str(e)
+            self._acordar.wait(self.intervalo)
+            self._acordar.clear()
+
+
+# Instância única do processo (compartilhada entre as sessões do Streamlit)
+_processador: Optional[ProcessadorImportacoes] = None
+_trava_processador = threading.Lock()
+
+
+def iniciar_processador_importacoes() -> ProcessadorImportacoes:
+    """
+    Inicia a thread de importações (uma vez por processo); importações
+    interrompidas por um reinício são retomadas logo na primeira passada
+    """
+    global _processador
+    with _trava_processador:
+        if _processador is None or not _processador.is_alive():
+            _processador = ProcessadorImportacoes()
+            _processador.start()
+        return _processador
+
+
+def acordar_processador_importacoes():
+    """Pede à thread de importações para verificar as pendentes agora"""
+    if _processador is not None:
+        _processador.acordar()
@@ -1,14 +1,26 @@
 # src/controllers/nota_entrada.py
-from typing import Optional, List
+from typing import Optional, List, Dict, Iterable, Callable, Union
 from datetime import datetime
+from itertools import chain
+import pandas as pd
 from sqlalchemy.orm import Session
-from sqlalchemy import or_
+from sqlalchemy import or_, select, insert, literal
 from ..models import NotaEntrada, Fornecedor, Produto, LogAcao, TipoAcao, StatusNota, StatusProduto
+from ..utils.cache_produtos import cache_codigos
+from ..utils.validators import validar_produtos_importacao
+from .estoque_resumo import EstoqueResumoController
+
+# Produtos gravados por transação na importação em lote
+TAMANHO_LOTE_IMPORTACAO = 2000
+
+# Códigos por consulta IN na verificação de duplicados (abaixo do limite de variáveis do SQLite)
+TAMANHO_LOTE_CODIGOS = 10000
 
 
 class NotaEntradaController:
     def __init__(self, db: Session):
         self.db = db
+        self.resumo_controller = EstoqueResumoController(db)
 
     def criar_nota_entrada(self,
                            numero_nota: str,
@@ -125,13 +137,338 @@ class NotaEntradaController:
             )
             self.db.add(log)
 
+            # Atualiza o resumo do estoque na mesma transação
+            self.resumo_controller.atualizar_produtos([produto.id])
+
             self.db.commit()
+            cache_codigos.invalidar([codigo_barras])
             return produto
 
         except Exception as e:
             self.db.rollback()
             raise Exception(f"Erro ao adicionar produto: {str(e)}")
 
+    def _produtos_cadastrados(self, codigos: List[str]) -> pd.DataFrame:
+        """
+        Produtos que já existem com os códigos informados, para comparar com a planilha
+        """
+        colunas = [
+            Produto.id, Produto.codigo_barras, Produto.nota_entrada_id, Produto.referencia,
+            Produto.descricao, Produto.tamanho, Produto.valor_unitario,
+            Produto.quantidade_inicial, Produto.quantidade_atual, Produto.status
+        ]
+        linhas = []
+        for inicio in range(0, len(codigos), TAMANHO_LOTE_CODIGOS):
+            linhas.extend(self.db.query(*colunas).filter(
+                Produto.codigo_barras.in_(codigos[inicio:inicio + TAMANHO_LOTE_CODIGOS])
+            ).all())
+        return pd.DataFrame(linhas, columns=[coluna.key for coluna in colunas])
+
+    def _gravar_lote_importacao(self, nota: NotaEntrada, lote: List[Dict], usuario_id: int):
+        """
+        Insere um lote de produtos da nota, com os logs e o resumo do estoque
+        """
+        self.db.bulk_insert_mappings(Produto, lote)
+
+        # Um log por produto, gerado no banco a partir dos produtos recém-inseridos
+        self.db.execute(insert(LogAcao).from_select(
+            [LogAcao.usuario_id, LogAcao.tipo_acao, LogAcao.descricao,
+             LogAcao.tabela_afetada, LogAcao.referencia_id],
+            select(
+                literal(usuario_id),
+                literal(TipoAcao.INSERCAO_ITEM, LogAcao.tipo_acao.type),
+                literal(f"Produto adicionado à nota {nota.numero_nota}: ") + Produto.descricao,
+                literal("produtos"),
+                Produto.id
+            ).where(
+                Produto.nota_entrada_id == nota.id,
+                Produto.codigo_barras.in_([registro['codigo_barras'] for registro in lote])
+            ).order_by(Produto.id)
+        ))
+
+        # Atualiza o resumo do estoque na mesma transação
+        self.resumo_controller.atualizar_grupos(
+            (registro['referencia'], registro['tamanho'], nota.fornecedor_id)
+            for registro in lote
+        )
+
+    def _atualizar_lote_importacao(self, nota: NotaEntrada, atualizar: pd.DataFrame, usuario_id: int):
+        """
+        Regrava os produtos da nota que mudaram na planilha, com logs e resumo do estoque
+        """
+        self.db.bulk_update_mappings(Produto, atualizar[
+            ['id', 'referencia', 'descricao', 'tamanho', 'valor_unitario', 'quantidade']
+        ].rename(
+            columns={'quantidade': 'quantidade_inicial'}
+        ).assign(
+            quantidade_atual=atualizar['quantidade']
+        ).astype(object).to_dict('records'))
+
+        self.db.execute(insert(LogAcao).from_select(
+            [LogAcao.usuario_id, LogAcao.tipo_acao, LogAcao.descricao,
+             LogAcao.tabela_afetada, LogAcao.referencia_id],
+            select(
+                literal(usuario_id),
+                literal(TipoAcao.ALTERACAO_PRODUTO, LogAcao.tipo_acao.type),
+                literal(f"Produto atualizado pela importação na nota {nota.numero_nota}: ") +
+                Produto.descricao,
+                literal("produtos"),
+                Produto.id
+            ).where(
+                Produto.id.in_(atualizar['id'].tolist())
+            ).order_by(Produto.id)
+        ))
+
+        # Grupos de antes e de depois da alteração
+        self.resumo_controller.atualizar_grupos(
+            (referencia, tamanho, nota.fornecedor_id)
+            for referencia, tamanho in chain(
+                zip(atualizar['referencia'], atualizar['tamanho']),
+                zip(atualizar['referencia_atual'], atualizar['tamanho_atual'])
+            )
+        )
+
+    def validar_bloco_importacao(self,
+                                 nota_id: int,
+                                 tabela: pd.DataFrame,
+                                 primeira_linha: int,
+                                 codigos_arquivo: set) -> Dict:
+        """
+        Valida um bloco de linhas da planilha e decide, de uma vez para o bloco,
+        o que fazer com cada código de barras:
+        - novo: inserido
+        - já cadastrado nesta nota com os mesmos dados: ignorado (reimportação)
+        - já cadastrado nesta nota com dados diferentes: atualizado, se o produto
+          ainda não foi movimentado (senão vai para os erros)
+        - cadastrado em outra nota ou repetido no arquivo: erro
+        codigos_arquivo: códigos dos blocos anteriores do mesmo arquivo
+        (atualizado com os deste bloco)
+        Retorna {'novos', 'atualizar' (DataFrames), 'ignorados', 'erros'}
+        """
+        validos, erros = validar_produtos_importacao(tabela, primeira_linha)
+
+        # isin em colunas de texto do pandas converte o conjunto inteiro a cada
+        # chamada; com objetos Python a busca usa tabela hash
+        validos = validos.reset_index(drop=True).astype({
+            'codigo_barras': object, 'referencia': object, 'descricao': object, 'tamanho': object
+        })
+        repetidos = validos['codigo_barras'].isin(codigos_arquivo).to_numpy()
+        codigos_arquivo.update(validos['codigo_barras'])
+
+        # Uma consulta para os códigos já cadastrados, comparados às linhas com um merge
+        linhas = validos.merge(
+            self._produtos_cadastrados(validos.loc[~repetidos, 'codigo_barras'].tolist()),
+            on='codigo_barras', how='left', suffixes=('', '_atual')
+        )
+        cadastrados = linhas['id'].notna().to_numpy() & ~repetidos
+        mesma_nota = cadastrados & (linhas['nota_entrada_id'] == nota_id).to_numpy()
+        iguais = (
+            (linhas['referencia'] == linhas['referencia_atual']) &
+            (linhas['descricao'] == linhas['descricao_atual']) &
+            (linhas['tamanho'] == linhas['tamanho_atual']) &
+            (linhas['valor_unitario'] == linhas['valor_unitario_atual'].astype(float).round(2)) &
+            (linhas['quantidade'] == linhas['quantidade_inicial'])
+        ).to_numpy()
+        intocados = (
+            (linhas['quantidade_atual'] == linhas['quantidade_inicial']) &
+            (linhas['status'] == StatusProduto.EM_ESTOQUE)
+        ).to_numpy()
+
+        ignorar = mesma_nota & iguais
+        atualizar = mesma_nota & ~iguais & intocados
+
+        for mascara, mensagem in (
+                (repetidos, "Código de barras repetido no arquivo"),
+                (cadastrados & ~mesma_nota, "Código de barras já cadastrado em outra nota"),
+                (mesma_nota & ~iguais & ~intocados,
+                 "Produto já movimentado; alteração da planilha não aplicada")):
+            erros.extend(
+                {
+                    "linha": int(linha),
+                    "codigo_barras": codigo,
+                    "campo": "codigo_barras",
+                    "erro": mensagem
+                }
+                for linha, codigo in zip(linhas.loc[mascara, 'linha'],
+                                         linhas.loc[mascara, 'codigo_barras'])
+            )
+
+        return {
+            "novos": validos[~repetidos & ~cadastrados],
+            "atualizar": linhas[atualizar].astype({'id': int}),
+            "ignorados": int(ignorar.sum()),
+            "erros": erros
+        }
+
+    def _gravar_validos(self,
+                        nota: NotaEntrada,
+                        bloco: Dict,
+                        usuario_id: int,
+                        confirmar: bool,
+                        tamanho_lote: int,
+                        relatorio: Dict):
+        """
+        Grava o bloco validado (atualizações e depois inserções em lotes),
+        acumulando o resultado no relatório
+        Com confirmar=True faz um commit por lote e um lote recusado pelo banco
+        vai para os erros; senão a transação fica aberta e o erro é levantado
+        """
+        relatorio['ignorados'] += bloco['ignorados']
+
+        novos = bloco['novos']
+        registros = novos.drop(columns='linha').rename(
+            columns={'quantidade': 'quantidade_inicial'}
+        ).assign(
+            quantidade_atual=novos['quantidade'],
+            nota_entrada_id=nota.id,
+            status=StatusProduto.EM_ESTOQUE,
+            usuario_registro_id=usuario_id
+        ).astype(object).to_dict('records')
+
+        # O primeiro "lote" são as atualizações do bloco, se houver
+        lotes = [('atualizados', bloco['atualizar'], bloco['atualizar']['linha'].tolist(),
+                  bloco['atualizar']['codigo_barras'].tolist())] if len(bloco['atualizar']) else []
+        lotes += [
+            ('importados', registros[inicio:inicio + tamanho_lote],
+             novos['linha'].iloc[inicio:inicio + tamanho_lote].tolist(),
+             [registro['codigo_barras'] for registro in registros[inicio:inicio + tamanho_lote]])
+            for inicio in range(0, len(registros), tamanho_lote)
+        ]
+
+        for contador, lote, numeros_linha, codigos in lotes:
+            try:
+                if contador == 'atualizados':
+                    self._atualizar_lote_importacao(nota, lote, usuario_id)
+                else:
+                    self._gravar_lote_importacao(nota, lote, usuario_id)
+                if confirmar:
+                    self.db.commit()
+                    cache_codigos.invalidar(codigos)
+                relatorio[contador] += len(lote)
+            except Exception as e:
+                if not confirmar:
+                    raise
+                # Lote recusado pelo banco: as linhas vão para o relatório e a importação segue
+                self.db.rollback()
+                relatorio['erros'].extend(
+                    {
+                        "linha": linha,
+                        "codigo_barras": codigo,
+                        "campo": None,
+                        "erro": f"Erro ao gravar lote: {str(e)}"
+                    }
+                    for linha, codigo in zip(numeros_linha, codigos)
+                )
+
+    def gravar_bloco_importacao(self,
+                                nota: NotaEntrada,
+                                tabela: pd.DataFrame,
+                                usuario_id: int,
+                                primeira_linha: int,
+                                codigos_arquivo: set) -> Dict:
+        """
+        Valida e grava um bloco da planilha sem confirmar a transação
+        (usado pelas importações em segundo plano, que gravam o progresso
+        na mesma transação). Erros do banco são levantados.
+        Retorna {'importados', 'atualizados', 'ignorados', 'erros', 'codigos'}
+        (codigos: códigos gravados)
+        """
+        bloco = self.validar_bloco_importacao(nota.id, tabela, primeira_linha, codigos_arquivo)
+        relatorio = {
+            "importados": 0,
+            "atualizados": 0,
+            "ignorados": 0,
+            "erros": bloco['erros'],
+            "codigos": bloco['novos']['codigo_barras'].tolist() +
+                       bloco['atualizar']['codigo_barras'].tolist()
+        }
+        self._gravar_validos(nota, bloco, usuario_id, False, TAMANHO_LOTE_IMPORTACAO, relatorio)
+        return relatorio
+
+    def importar_produtos_blocos(self,
+                                 nota_id: int,
+                                 blocos: Iterable[pd.DataFrame],
+                                 usuario_id: int,
+                                 tudo_ou_nada: bool = False,
+                                 primeira_linha: int = 2,
+                                 tamanho_lote: int = TAMANHO_LOTE_IMPORTACAO,
+                                 total_linhas: Optional[int] = None,
+                                 progresso: Optional[Callable[[int, Optional[int]], None]] = None) -> Dict:
+        """
+        Importa os produtos de uma planilha lida em blocos (ver utils.planilhas)
+        Cada bloco é validado de uma vez (validar_bloco_importacao): os produtos já
+        cadastrados vêm de uma consulta IN e reimportar a mesma planilha só ignora
+        as linhas iguais. As linhas novas são inseridas em lotes (bulk insert + logs
+        por INSERT ... SELECT), um commit por lote, antes de o próximo bloco ser lido.
+        Com tudo_ou_nada=True tudo vai em uma única transação, desfeita se alguma
+        linha tiver erro (após o primeiro erro os blocos seguintes só são validados).
+        progresso(linhas_processadas, total_linhas) é chamado após cada bloco.
+        Retorna {'total_linhas', 'importados', 'atualizados', 'ignorados',
+                 'erros': [{linha, codigo_barras, campo, erro}]}
+        """
+        try:
+            nota = self.db.query(NotaEntrada).filter(
+                NotaEntrada.id == nota_id,
+                NotaEntrada.status == StatusNota.ATIVA
+            ).first()
+
+            if not nota:
+                raise ValueError("Nota de entrada não encontrada ou não está ativa")
+
+            relatorio = {
+                "total_linhas": 0, "importados": 0, "atualizados": 0, "ignorados": 0, "erros": []
+            }
+            codigos_arquivo = set()
+            for tabela in blocos:
+                bloco = self.validar_bloco_importacao(
+                    nota.id, tabela, primeira_linha + relatorio['total_linhas'], codigos_arquivo
+                )
+                relatorio['total_linhas'] += len(tabela)
+                relatorio['erros'].extend(bloco['erros'])
+
+                if not (tudo_ou_nada and relatorio['erros']):
+                    self._gravar_validos(
+                        nota, bloco, usuario_id, not tudo_ou_nada, tamanho_lote, relatorio
+                    )
+
+                if progresso:
+                    progresso(relatorio['total_linhas'], total_linhas)
+
+            if tudo_ou_nada:
+                if relatorio['erros']:
+                    self.db.rollback()
+                    relatorio['importados'] = relatorio['atualizados'] = 0
+                else:
+                    self.db.commit()
+                    cache_codigos.invalidar(list(codigos_arquivo))
+
+            relatorio['erros'].sort(key=lambda erro: erro['linha'])
+            return relatorio
+
+        except Exception as e:
+            self.db.rollback()
+            raise Exception(f"Erro ao importar produtos: {str(e)}")
+
+    def importar_produtos_lote(self,
+                               nota_id: int,
+                               linhas: Union[pd.DataFrame, Iterable[Dict]],
+                               usuario_id: int,
+                               tudo_ou_nada: bool = False,
+                               primeira_linha: int = 2,
+                               tamanho_lote: int = TAMANHO_LOTE_IMPORTACAO) -> Dict:
+        """
+        Importa para a nota os produtos já carregados em memória
+        linhas: DataFrame ou lista de dicts com as colunas de COLUNAS_IMPORTACAO_PRODUTOS
+        Mesmas regras e retorno de importar_produtos_blocos (um único bloco)
+        """
+        tabela = linhas if isinstance(linhas, pd.DataFrame) else pd.DataFrame(list(linhas))
+        return self.importar_produtos_blocos(
+            nota_id, [tabela], usuario_id,
+            tudo_ou_nada=tudo_ou_nada,
+            primeira_linha=primeira_linha,
+            tamanho_lote=tamanho_lote
+        )
+
     def finalizar_nota(self, nota_id: int, usuario_id: int) -> bool:
         """
         Finaliza uma nota de entrada, impedindo novas alterações
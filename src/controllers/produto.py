@@ -2,25 +2,68 @@
 from typing import Optional, List, Dict, Tuple
 from datetime import datetime
 from sqlalchemy.orm import Session
-from sqlalchemy import or_, and_, func
-from ..models import Produto, NotaEntrada, StatusProduto, LogAcao, TipoAcao
+from sqlalchemy import or_, and_, func, case, literal, select
+from ..models import Produto, StatusProduto, LogAcao, TipoAcao, EstoqueResumo
+from ..utils.busca import montar_consulta_fts, subconsulta_busca
+from ..utils.cache_produtos import cache_codigos, ProdutoCodigo
+from .estoque_resumo import EstoqueResumoController
+
+class ConflitoEstoque(Exception):
+    """O estoque do produto mudou (outra venda) entre a alocação e a baixa"""
+
 
 class ProdutoController:
     def __init__(self, db: Session):
         self.db = db
+        self.resumo_controller = EstoqueResumoController(db)
+
+    def _carregar_produto_codigo(self, codigo_barras: str) -> Optional[ProdutoCodigo]:
+        """Lê do banco os dados do produto usados na leitura do código de barras"""
+        linha = self.db.query(
+            Produto.id,
+            Produto.nota_entrada_id,
+            Produto.valor_unitario,
+            Produto.quantidade_atual,
+            Produto.status,
+            Produto.referencia,
+            Produto.tamanho,
+            Produto.descricao
+        ).filter(
+            Produto.codigo_barras == codigo_barras
+        ).first()
+        return ProdutoCodigo(*linha) if linha else None
+
+    def consultar_codigo_barras(self,
+                                codigo_barras: str,
+                                usar_cache: bool = True) -> Optional[ProdutoCodigo]:
+        """
+        Consulta um produto pelo código de barras usando o cache em memória
+        Retorna os dados do produto (qualquer status) ou None se não existir
+        usar_cache=False lê direto do banco (ex.: dentro de uma transação de venda)
+        """
+        try:
+            if not usar_cache:
+                return self._carregar_produto_codigo(codigo_barras)
+            return cache_codigos.obter(codigo_barras, self._carregar_produto_codigo)
+        except Exception as e:
+            raise Exception(f"Erro ao consultar código de barras: {str(e)}")
 
     def buscar_produto_codigo_barras(self, codigo_barras: str) -> Optional[Produto]:
         """
-        Busca um produto pelo código de barras
+        Busca um produto em estoque pelo código de barras
         """
         try:
-            return self.db.query(Produto).filter(
-                Produto.codigo_barras == codigo_barras,
-                Produto.status == StatusProduto.EM_ESTOQUE
-            ).first()
+            item = cache_codigos.obter(codigo_barras, self._carregar_produto_codigo)
+            if item is None or item.status != StatusProduto.EM_ESTOQUE:
+                return None
+            return self.db.get(Produto, item.produto_id)
         except Exception as e:
             raise Exception(f"Erro ao buscar produto: {str(e)}")
 
+    def metricas_cache_codigos(self) -> Dict:
+        """Métricas do cache de códigos de barras (acertos, faltas, taxa de acerto)"""
+        return cache_codigos.metricas()
+
     def buscar_produtos_disponiveis(self,
                                   referencia: Optional[str] = None,
                                   descricao: Optional[str] = None,
@@ -34,10 +77,17 @@ class ProdutoController:
                 Produto.quantidade_atual > 0
             )
 
-            if referencia:
-                query = query.filter(Produto.referencia.ilike(f"%{referencia}%"))
-            if descricao:
-                query = query.filter(Produto.descricao.ilike(f"%{descricao}%"))
+            # Referência e descrição são buscadas por prefixo no índice de texto
+            consultas = [
+                montar_consulta_fts(termo, [campo])
+                for campo, termo in (("referencia", referencia), ("descricao", descricao))
+                if termo
+            ]
+            if consultas:
+                if not all(consultas):
+                    return []
+                busca = subconsulta_busca(" AND ".join(consultas))
+                query = query.join(busca, busca.c.produto_id == Produto.id)
             if tamanho:
                 query = query.filter(Produto.tamanho == tamanho)
 
@@ -45,6 +95,30 @@ class ProdutoController:
         except Exception as e:
             raise Exception(f"Erro ao buscar produtos disponíveis: {str(e)}")
 
+    def select_fila_fifo(self, referencia: str, tamanho: str, limite: int):
+        """
+        Primeiros lotes em estoque da referência/tamanho na ordem FIFO
+        Percorre o índice idx_produto_fifo e lê só até o limite: como todo lote
+        em estoque tem ao menos uma peça, limite = quantidade desejada basta
+        """
+        return select(
+            Produto.id,
+            Produto.codigo_barras,
+            Produto.referencia,
+            Produto.tamanho,
+            Produto.valor_unitario,
+            Produto.quantidade_atual,
+            Produto.nota_entrada_id,
+            Produto.fifo_key
+        ).where(
+            Produto.referencia == referencia,
+            Produto.tamanho == tamanho,
+            Produto.status == StatusProduto.EM_ESTOQUE,
+            Produto.quantidade_atual > 0
+        ).order_by(
+            Produto.fifo_key
+        ).limit(limite)
+
     def calcular_produtos_venda_fifo(self,
                                    referencia: str,
                                    tamanho: str,
@@ -54,22 +128,14 @@ class ProdutoController:
         Retorna lista de produtos com suas respectivas quantidades para venda
         """
         try:
-            # Busca produtos disponíveis ordenados por data de entrada (FIFO)
-            produtos = self.db.query(Produto).join(
-                NotaEntrada, Produto.nota_entrada_id == NotaEntrada.id
-            ).filter(
-                Produto.referencia == referencia,
-                Produto.tamanho == tamanho,
-                Produto.status == StatusProduto.EM_ESTOQUE,
-                Produto.quantidade_atual > 0
-            ).order_by(
-                NotaEntrada.data_emissao,
-                Produto.data_registro
-            ).all()
-
-            if not produtos:
+            if quantidade_desejada <= 0:
                 return []
 
+            # Só os lotes necessários, já na ordem FIFO (fifo_key)
+            produtos = self.db.execute(
+                self.select_fila_fifo(referencia, tamanho, quantidade_desejada)
+            )
+
             produtos_venda = []
             quantidade_restante = quantidade_desejada
 
@@ -98,45 +164,75 @@ class ProdutoController:
         except Exception as e:
             raise Exception(f"Erro ao calcular produtos para venda: {str(e)}")
 
-    def atualizar_estoque_venda(self,
-                               produtos_venda: List[Dict],
-                               usuario_id: int) -> bool:
+    def baixar_estoque(self, produtos_venda: List[Dict]):
         """
-        Atualiza o estoque após uma venda
+        Baixa no banco as quantidades vendidas com UPDATE condicional
+        Só altera o produto se ele ainda estiver em estoque com quantidade
+        suficiente; caso contrário levanta ConflitoEstoque (nada é lido antes,
+        então duas vendas simultâneas não conseguem vender a mesma peça)
         """
-        try:
-            for item in produtos_venda:
-                produto = self.db.query(Produto).filter(
-                    Produto.id == item['produto_id']
-                ).first()
+        quantidades = {}
+        for item in produtos_venda:
+            quantidades[item['produto_id']] = quantidades.get(item['produto_id'], 0) + item['quantidade']
 
-                if not produto:
-                    raise ValueError(f"Produto não encontrado: {item['produto_id']}")
+        for produto_id, quantidade in quantidades.items():
+            alterados = self.db.query(Produto).filter(
+                Produto.id == produto_id,
+                Produto.status == StatusProduto.EM_ESTOQUE,
+                Produto.quantidade_atual >= quantidade
+            ).update({
+                Produto.quantidade_atual: Produto.quantidade_atual - quantidade,
+                Produto.status: case(
+                    (Produto.quantidade_atual == quantidade,
+                     literal(StatusProduto.VENDIDO, Produto.status.type)),
+                    else_=Produto.status
+                )
+            }, synchronize_session=False)
 
-                # Atualiza quantidade
-                nova_quantidade = produto.quantidade_atual - item['quantidade']
-                if nova_quantidade < 0:
-                    raise ValueError(f"Quantidade insuficiente para o produto: {produto.codigo_barras}")
+            if not alterados:
+                raise ConflitoEstoque(f"Quantidade insuficiente para o produto: {produto_id}")
 
-                produto.quantidade_atual = nova_quantidade
+    def registrar_baixa_venda(self, produtos_venda: List[Dict], usuario_id: int):
+        """
+        Baixa o estoque vendido, registra os logs e atualiza o resumo, sem commit
+        (para compor a transação de quem chama)
+        Levanta ConflitoEstoque se outra venda consumiu o estoque alocado
+        """
+        self.baixar_estoque(produtos_venda)
+
+        for item in produtos_venda:
+            # Registra no log
+            log = LogAcao(
+                usuario_id=usuario_id,
+                tipo_acao=TipoAcao.VENDA,
+                descricao=f"Venda de {item['quantidade']} unidades do produto {item['codigo_barras']}",
+                tabela_afetada="produtos",
+                referencia_id=item['produto_id']
+            )
+            self.db.add(log)
 
-                # Atualiza status se necessário
-                if nova_quantidade == 0:
-                    produto.status = StatusProduto.VENDIDO
+        # Atualiza o resumo do estoque na mesma transação
+        self.resumo_controller.atualizar_produtos(
+            item['produto_id'] for item in produtos_venda
+        )
 
-                # Registra no log
-                log = LogAcao(
-                    usuario_id=usuario_id,
-                    tipo_acao=TipoAcao.VENDA,
-                    descricao=f"Venda de {item['quantidade']} unidades do produto {produto.codigo_barras}",
-                    tabela_afetada="produtos",
-                    referencia_id=produto.id
-                )
-                self.db.add(log)
+    def atualizar_estoque_venda(self,
+                               produtos_venda: List[Dict],
+                               usuario_id: int) -> bool:
+        """
+        Atualiza o estoque após uma venda
+        Levanta ConflitoEstoque se outra venda consumiu o estoque alocado
+        """
+        try:
+            self.registrar_baixa_venda(produtos_venda, usuario_id)
 
             self.db.commit()
+            cache_codigos.invalidar(item['codigo_barras'] for item in produtos_venda)
             return True
 
+        except ConflitoEstoque:
+            self.db.rollback()
+            raise
         except Exception as e:
             self.db.rollback()
             raise Exception(f"Erro ao atualizar estoque: {str(e)}")
@@ -146,15 +242,11 @@ class ProdutoController:
         Retorna estatísticas gerais do estoque
         """
         try:
-            total_produtos = self.db.query(Produto).filter(
-                Produto.status == StatusProduto.EM_ESTOQUE
-            ).count()
-
-            valor_total = self.db.query(
-                func.sum(Produto.valor_unitario * Produto.quantidade_atual)
-            ).filter(
-                Produto.status == StatusProduto.EM_ESTOQUE
-            ).scalar() or 0
+            # Totais lidos do resumo materializado (uma linha por grupo)
+            total_produtos, valor_total = self.db.query(
+                func.coalesce(func.sum(EstoqueResumo.total_lotes), 0),
+                func.coalesce(func.sum(EstoqueResumo.valor_total), 0)
+            ).one()
 
             produtos_zerados = self.db.query(Produto).filter(
                 Produto.status == StatusProduto.EM_ESTOQUE,
@@ -202,6 +294,7 @@ class ProdutoController:
         Processa a devolução de produtos
         """
         try:
+            codigos_alterados = []
             for item in produtos_devolucao:
                 produto = self.db.query(Produto).filter(
                     Produto.id == item['produto_id'],
@@ -210,6 +303,7 @@ class ProdutoController:
 
                 if not produto:
                     raise ValueError(f"Produto não encontrado ou não disponível: {item['produto_id']}")
+                codigos_alterados.append(produto.codigo_barras)
 
                 if item['quantidade'] > produto.quantidade_atual:
                     raise ValueError(f"Quantidade para devolução maior que disponível: {produto.codigo_barras}")
@@ -228,7 +322,13 @@ class ProdutoController:
                 )
                 self.db.add(log)
 
+            # Atualiza o resumo do estoque na mesma transação
+            self.resumo_controller.atualizar_produtos(
+                item['produto_id'] for item in produtos_devolucao
+            )
+
             self.db.commit()
+            cache_codigos.invalidar(codigos_alterados)
             return True
 
         except Exception as e:
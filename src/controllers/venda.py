@@ -1,17 +1,88 @@
 # src/controllers/venda.py
-from typing import Optional, List, Dict
-from datetime import datetime
+import threading
+from typing import Optional, List, Dict, Tuple, Callable, TypeVar, Iterator
+from collections import defaultdict
+from datetime import datetime, timedelta
 from decimal import Decimal
 from sqlalchemy.orm import Session
-from sqlalchemy import func
-from ..models import Venda, ItemVenda, Produto, LogAcao, TipoAcao, FormaPagamento, StatusVenda
-from .produto import ProdutoController
+from sqlalchemy import func, or_, select, insert, literal, cast, case, union_all, String
+from sqlalchemy.exc import OperationalError
+from ..models import (Venda, ItemVenda, Produto, LogAcao, TipoAcao,
+                      FormaPagamento, StatusVenda, StatusProduto, VendaDiaria, Usuario)
+from ..utils.cache_produtos import cache_codigos
+from ..utils.database import iniciar_transacao_escrita, banco_bloqueado
+from .produto import ProdutoController, ConflitoEstoque
+from .vendas_diarias import VendasDiariasController
+
+# Vendas estornadas por comando no cancelamento em lote (limita os parâmetros do IN)
+TAMANHO_LOTE_ESTORNO = 300
+
+# Intervalos e agrupamentos aceitos em serie_temporal
+GRANULARIDADES_SERIE = ("hora", "dia", "semana", "mes")
+AGRUPAMENTOS_SERIE = ("forma_pagamento", "usuario")
+
+# Tentativas de alocação do estoque quando outra venda altera os mesmos produtos
+MAXIMO_TENTATIVAS_ALOCACAO = 3
+
+T = TypeVar("T")
+
+# Contadores de concorrência na alocação (compartilhados entre as sessões do processo)
+_metricas_alocacao = {"operacoes": 0, "conflitos": 0, "repeticoes": 0, "falhas": 0}
+_trava_metricas = threading.Lock()
+
+
+class BancoOcupado(Exception):
+    """O banco continuou bloqueado por outros escritores depois das tentativas"""
+
+
+def _contar_alocacao(**incrementos):
+    with _trava_metricas:
+        for chave, valor in incrementos.items():
+            _metricas_alocacao[chave] += valor
+
+
+def _expressao_periodo(coluna, granularidade: str):
+    """Início do intervalo (texto ISO) que contém a data da coluna, calculado no SQLite"""
+    if granularidade == "hora":
+        return func.strftime('%Y-%m-%d %H:00:00', coluna)
+    if granularidade == "dia":
+        return func.date(coluna)
+    if granularidade == "semana":
+        # Semanas começam na segunda-feira
+        return func.date(coluna, '-6 days', 'weekday 1')
+    return func.strftime('%Y-%m-01', coluna)
+
+
+def _inicio_periodo(momento: datetime, granularidade: str) -> datetime:
+    """Início do intervalo que contém o momento (mesma regra de _expressao_periodo)"""
+    if granularidade == "hora":
+        return momento.replace(minute=0, second=0, microsecond=0)
+    inicio_dia = momento.replace(hour=0, minute=0, second=0, microsecond=0)
+    if granularidade == "dia":
+        return inicio_dia
+    if granularidade == "semana":
+        return inicio_dia - timedelta(days=inicio_dia.weekday())
+    return inicio_dia.replace(day=1)
+
+
+def _proximo_periodo(periodo: datetime, granularidade: str) -> datetime:
+    """Início do intervalo seguinte"""
+    if granularidade == "hora":
+        return periodo + timedelta(hours=1)
+    if granularidade == "dia":
+        return periodo + timedelta(days=1)
+    if granularidade == "semana":
+        return periodo + timedelta(days=7)
+    if periodo.month == 12:
+        return periodo.replace(year=periodo.year + 1, month=1)
+    return periodo.replace(month=periodo.month + 1)
 
 
 class VendaController:
     def __init__(self, db: Session):
         self.db = db
         self.produto_controller = ProdutoController(db)
+        self.vendas_diarias_controller = VendasDiariasController(db)
 
     def iniciar_venda(self,
                       usuario_id: int,
@@ -58,7 +129,7 @@ class VendaController:
         """
         Adiciona um item à venda usando a lógica FIFO
         """
-        try:
+        def alocar_e_baixar() -> Tuple[List[ItemVenda], List[Dict]]:
             # Calcula quais produtos serão usados (FIFO)
             produtos_venda = self.produto_controller.calcular_produtos_venda_fifo(
                 referencia=referencia,
@@ -81,38 +152,470 @@ class VendaController:
                 self.db.add(item)
                 itens_venda.append(item)
 
-            # Atualiza o estoque
-            self.produto_controller.atualizar_estoque_venda(produtos_venda, usuario_id)
+            # Atualiza o estoque (na mesma transação)
+            self.produto_controller.registrar_baixa_venda(produtos_venda, usuario_id)
+
+            # Soma os novos itens ao total da venda
+            self._aplicar_delta_venda(
+                venda_id,
+                sum(Decimal(p['valor_unitario']) * p['quantidade'] for p in produtos_venda),
+                len(itens_venda)
+            )
+            self.vendas_diarias_controller.atualizar_vendas([venda_id])
+            return itens_venda, produtos_venda
+
+        try:
+            itens_venda, produtos_venda = self._executar_alocacao(alocar_e_baixar)
+
+            self.db.commit()
+            cache_codigos.invalidar(p['codigo_barras'] for p in produtos_venda)
+            return itens_venda
+
+        except Exception as e:
+            self.db.rollback()
+            raise Exception(f"Erro ao adicionar item: {str(e)}")
+
+    def adicionar_item_por_codigo(self,
+                                  venda_id: int,
+                                  codigo_barras: str,
+                                  usuario_id: int,
+                                  quantidade: int = 1) -> List[ItemVenda]:
+        """
+        Adiciona à venda a peça lida pelo código de barras
+        O lote é localizado pelo índice único de codigo_barras e baixado
+        diretamente; só quando ele não tem a quantidade pedida a venda segue
+        o FIFO da referência/tamanho do lote.
+        """
+        def alocar_e_baixar() -> Tuple[List[ItemVenda], List[Dict]]:
+            # Leitura direta do banco (não do cache): já dentro da transação de escrita
+            lote = self.produto_controller.consultar_codigo_barras(codigo_barras, usar_cache=False)
+            if not lote:
+                raise ValueError(f"Produto não encontrado: {codigo_barras}")
+
+            if lote.status == StatusProduto.EM_ESTOQUE and lote.quantidade_atual >= quantidade:
+                produtos_venda = [{
+                    'produto_id': lote.produto_id,
+                    'codigo_barras': codigo_barras,
+                    'valor_unitario': lote.valor_unitario,
+                    'quantidade': quantidade,
+                    'nota_entrada_id': lote.nota_entrada_id
+                }]
+            else:
+                # Lote esgotado: outra peça da mesma referência/tamanho, pelo FIFO
+                produtos_venda = self.produto_controller.calcular_produtos_venda_fifo(
+                    referencia=lote.referencia,
+                    tamanho=lote.tamanho,
+                    quantidade_desejada=quantidade
+                )
+                if not produtos_venda:
+                    raise ValueError("Produtos insuficientes em estoque")
+
+            itens_venda = []
+            for produto_info in produtos_venda:
+                item = ItemVenda(
+                    venda_id=venda_id,
+                    produto_id=produto_info['produto_id'],
+                    quantidade=produto_info['quantidade'],
+                    valor_unitario=produto_info['valor_unitario'],
+                    nota_entrada_id=produto_info['nota_entrada_id']
+                )
+                self.db.add(item)
+                itens_venda.append(item)
+
+            self.produto_controller.registrar_baixa_venda(produtos_venda, usuario_id)
+            self._aplicar_delta_venda(
+                venda_id,
+                sum(Decimal(p['valor_unitario']) * p['quantidade'] for p in produtos_venda),
+                len(itens_venda)
+            )
+            self.vendas_diarias_controller.atualizar_vendas([venda_id])
+            return itens_venda, produtos_venda
+
+        try:
+            if not isinstance(quantidade, int) or quantidade <= 0:
+                raise ValueError(f"Quantidade inválida: {quantidade}")
 
-            # Atualiza o valor total da venda
-            self.atualizar_valor_total(venda_id)
+            itens_venda, produtos_venda = self._executar_alocacao(alocar_e_baixar)
 
             self.db.commit()
+            cache_codigos.invalidar(p['codigo_barras'] for p in produtos_venda)
             return itens_venda
 
         except Exception as e:
             self.db.rollback()
             raise Exception(f"Erro ao adicionar item: {str(e)}")
 
+    def _executar_alocacao(self,
+                           operacao: Callable[[], T],
+                           espera_bloqueio_ms: Optional[int] = None) -> T:
+        """
+        Executa uma alocação de estoque com bloqueio de escrita e repetição limitada
+        Se outra venda consumir o estoque entre a leitura e a baixa (ConflitoEstoque)
+        ou o banco estiver bloqueado, desfaz a transação e tenta de novo, até
+        MAXIMO_TENTATIVAS_ALOCACAO vezes (depois disso, BancoOcupado se o
+        problema foi o bloqueio). espera_bloqueio_ms limita a espera por tentativa.
+        """
+        _contar_alocacao(operacoes=1)
+        for tentativa in range(1, MAXIMO_TENTATIVAS_ALOCACAO + 1):
+            try:
+                iniciar_transacao_escrita(self.db, espera_bloqueio_ms)
+                return operacao()
+            except (ConflitoEstoque, OperationalError) as e:
+                self.db.rollback()
+                if isinstance(e, OperationalError) and not banco_bloqueado(e):
+                    raise
+                _contar_alocacao(conflitos=1)
+                if tentativa == MAXIMO_TENTATIVAS_ALOCACAO:
+                    _contar_alocacao(falhas=1)
+                    if isinstance(e, OperationalError):
+                        raise BancoOcupado("Banco de dados ocupado; tente novamente") from e
+                    raise ValueError(
+                        "Estoque alterado por outra venda; tente novamente"
+                    ) from e
+                _contar_alocacao(repeticoes=1)
+
+    def metricas_concorrencia(self) -> Dict:
+        """Contadores de conflitos e repetições na alocação de estoque"""
+        with _trava_metricas:
+            metricas = dict(_metricas_alocacao)
+        metricas["taxa_conflito"] = (
+            metricas["conflitos"] / metricas["operacoes"] if metricas["operacoes"] else 0.0
+        )
+        return metricas
+
+    def _alocar_carrinho(self, carrinho: List[Dict]) -> Tuple[List[Dict], Dict[int, int]]:
+        """
+        Aloca os produtos de todas as linhas do carrinho com uma única consulta
+        Linhas com codigo_barras usam aquele produto (ou o FIFO da
+        referência/tamanho, se informados e o lote estiver esgotado); as demais
+        seguem o FIFO da referência/tamanho. Retorna as alocações (no formato de
+        calcular_produtos_venda_fifo) e o saldo final de cada produto usado.
+        """
+        # Peças pedidas por referência/tamanho (inclui linhas com código, que
+        # podem cair no FIFO se o lote estiver esgotado)
+        pares = defaultdict(int)
+        codigos = set()
+        for linha in carrinho:
+            quantidade = linha.get('quantidade', 1)
+            if not isinstance(quantidade, int) or quantidade <= 0:
+                raise ValueError(f"Quantidade inválida no carrinho: {quantidade}")
+            if linha.get('codigo_barras'):
+                codigos.add(linha['codigo_barras'])
+            if linha.get('referencia') and linha.get('tamanho'):
+                pares[(linha['referencia'], linha['tamanho'])] += quantidade
+            elif not linha.get('codigo_barras'):
+                raise ValueError("Cada linha do carrinho precisa de codigo_barras ou referencia e tamanho")
+
+        # Uma fila FIFO limitada por grupo (um lote tem ao menos uma peça; os
+        # lotes lidos pelo código podem estar entre eles) e os lotes dos códigos,
+        # tudo em uma consulta
+        consultas = [
+            self.produto_controller.select_fila_fifo(
+                referencia, tamanho, quantidade + len(codigos)
+            ).subquery()
+            for (referencia, tamanho), quantidade in pares.items()
+        ]
+        if codigos:
+            consultas.append(select(
+                Produto.id,
+                Produto.codigo_barras,
+                Produto.referencia,
+                Produto.tamanho,
+                Produto.valor_unitario,
+                Produto.quantidade_atual,
+                Produto.nota_entrada_id,
+                Produto.fifo_key
+            ).where(
+                Produto.codigo_barras.in_(list(codigos)),
+                Produto.status == StatusProduto.EM_ESTOQUE,
+                Produto.quantidade_atual > 0
+            ).subquery())
+
+        lotes = {
+            lote.id: lote for lote in self.db.execute(
+                union_all(*[select(consulta) for consulta in consultas])
+            )
+        }
+        lotes = sorted(lotes.values(), key=lambda lote: lote.fifo_key)
+
+        saldos = {lote.id: lote.quantidade_atual for lote in lotes}
+        por_codigo = {lote.codigo_barras: lote for lote in lotes}
+        por_grupo = defaultdict(list)
+        for lote in lotes:
+            por_grupo[(lote.referencia, lote.tamanho)].append(lote)
+
+        alocacoes = []
+
+        def alocar(lote, quantidade):
+            saldos[lote.id] -= quantidade
+            alocacoes.append({
+                'produto_id': lote.id,
+                'codigo_barras': lote.codigo_barras,
+                'valor_unitario': lote.valor_unitario,
+                'quantidade': quantidade,
+                'nota_entrada_id': lote.nota_entrada_id
+            })
+
+        # Produtos escolhidos pelo código primeiro, para o FIFO não consumi-los.
+        # Se o lote do código se esgotou e a linha traz referência/tamanho,
+        # ela segue o FIFO como as demais.
+        linhas_fifo = []
+        for linha in carrinho:
+            if linha.get('codigo_barras'):
+                quantidade = linha.get('quantidade', 1)
+                lote = por_codigo.get(linha['codigo_barras'])
+                if lote and saldos[lote.id] >= quantidade:
+                    alocar(lote, quantidade)
+                elif linha.get('referencia') and linha.get('tamanho'):
+                    linhas_fifo.append(linha)
+                else:
+                    raise ValueError(f"Produto indisponível em estoque: {linha['codigo_barras']}")
+            else:
+                linhas_fifo.append(linha)
+
+        for linha in linhas_fifo:
+            restante = linha.get('quantidade', 1)
+            for lote in por_grupo[(linha['referencia'], linha['tamanho'])]:
+                if restante <= 0:
+                    break
+                usar = min(saldos[lote.id], restante)
+                if usar > 0:
+                    alocar(lote, usar)
+                    restante -= usar
+            if restante > 0:
+                raise ValueError(
+                    f"Produtos insuficientes em estoque: {linha['referencia']} tamanho {linha['tamanho']}"
+                )
+
+        usados = {alocacao['produto_id'] for alocacao in alocacoes}
+        return alocacoes, {produto_id: saldos[produto_id] for produto_id in usados}
+
+    def checkout(self,
+                 carrinho: List[Dict],
+                 forma_pagamento: FormaPagamento,
+                 usuario_id: int,
+                 cliente_nome: str,
+                 cliente_cpf: Optional[str] = None,
+                 chave_idempotencia: Optional[str] = None,
+                 data_hora: Optional[datetime] = None,
+                 espera_bloqueio_ms: Optional[int] = None) -> Venda:
+        """
+        Registra uma venda completa em uma única transação
+        carrinho: lista de linhas {'referencia', 'tamanho', 'quantidade'} ou
+        {'codigo_barras', 'quantidade'} (quantidade padrão 1); linhas com código
+        podem trazer também referencia/tamanho para o FIFO se o lote se esgotar
+        Aloca o estoque (FIFO) de todas as linhas em uma consulta, insere itens
+        e logs em lote, baixa o estoque e atualiza o resumo com um único commit.
+        Se outra venda consumir o mesmo estoque, a alocação é refeita.
+        chave_idempotencia: com a chave de uma venda já gravada, retorna essa
+        venda sem gravar de novo. data_hora: momento da venda, se não for agora
+        Levanta BancoOcupado (sem encapsular) se o banco seguir bloqueado;
+        espera_bloqueio_ms encurta a espera pelo bloqueio em cada tentativa.
+        """
+        try:
+            if not carrinho:
+                raise ValueError("Não é possível finalizar uma venda sem itens")
+
+            venda, alocacoes = self._executar_alocacao(
+                lambda: self._registrar_venda(
+                    carrinho, forma_pagamento, usuario_id, cliente_nome, cliente_cpf,
+                    chave_idempotencia, data_hora
+                ),
+                espera_bloqueio_ms
+            )
+
+            self.db.commit()
+            cache_codigos.invalidar(a['codigo_barras'] for a in alocacoes)
+            return venda
+
+        except BancoOcupado:
+            self.db.rollback()
+            raise
+        except Exception as e:
+            self.db.rollback()
+            if banco_bloqueado(e):
+                raise BancoOcupado("Banco de dados ocupado; tente novamente") from e
+            raise Exception(f"Erro ao registrar venda: {str(e)}")
+
+    def _registrar_venda(self,
+                         carrinho: List[Dict],
+                         forma_pagamento: FormaPagamento,
+                         usuario_id: int,
+                         cliente_nome: str,
+                         cliente_cpf: Optional[str],
+                         chave_idempotencia: Optional[str] = None,
+                         data_hora: Optional[datetime] = None) -> Tuple[Venda, List[Dict]]:
+        """
+        Aloca o carrinho e grava venda, itens, baixa de estoque e logs (sem commit)
+        """
+        # Conferida já com o bloqueio de escrita: duas gravações da mesma chave não passam daqui
+        if chave_idempotencia:
+            venda = self.db.query(Venda).filter(
+                Venda.chave_idempotencia == chave_idempotencia
+            ).first()
+            if venda:
+                return venda, []
+
+        alocacoes, saldos = self._alocar_carrinho(carrinho)
+        valor_total = sum(
+            (Decimal(a['valor_unitario']) * a['quantidade'] for a in alocacoes),
+            Decimal('0')
+        )
+
+        venda = Venda(
+            usuario_id=usuario_id,
+            cliente_nome=cliente_nome,
+            cliente_cpf=cliente_cpf,
+            valor_total=valor_total,
+            quantidade_itens=len(alocacoes),
+            forma_pagamento=forma_pagamento,
+            status=StatusVenda.FINALIZADA,
+            chave_idempotencia=chave_idempotencia
+        )
+        if data_hora:
+            venda.data_hora = data_hora
+        self.db.add(venda)
+        self.db.flush()  # Para obter o ID da venda
+
+        self.db.bulk_insert_mappings(ItemVenda, [
+            {
+                'venda_id': venda.id,
+                'produto_id': a['produto_id'],
+                'quantidade': a['quantidade'],
+                'valor_unitario': a['valor_unitario'],
+                'nota_entrada_id': a['nota_entrada_id']
+            }
+            for a in alocacoes
+        ])
+
+        # Baixa condicional: levanta ConflitoEstoque se outra venda chegou antes
+        self.produto_controller.baixar_estoque(alocacoes)
+
+        logs = [
+            {
+                'usuario_id': usuario_id,
+                'tipo_acao': TipoAcao.VENDA,
+                'descricao': f"Venda de {a['quantidade']} unidades do produto {a['codigo_barras']}",
+                'tabela_afetada': "produtos",
+                'referencia_id': a['produto_id']
+            }
+            for a in alocacoes
+        ]
+        logs.append({
+            'usuario_id': usuario_id,
+            'tipo_acao': TipoAcao.VENDA,
+            'descricao': f"Finalização de venda - Valor: R${valor_total:.2f}",
+            'tabela_afetada': "vendas",
+            'referencia_id': venda.id
+        })
+        self.db.bulk_insert_mappings(LogAcao, logs)
+
+        # Atualiza o resumo do estoque e os totais diários na mesma transação
+        self.produto_controller.resumo_controller.atualizar_produtos(saldos.keys())
+        self.vendas_diarias_controller.atualizar_vendas([venda.id])
+
+        return venda, alocacoes
+
+    def _aplicar_delta_venda(self, venda_id: int, valor: Decimal, itens: int):
+        """
+        Soma (ou subtrai) valor e quantidade de itens aos totais da venda
+        com um UPDATE relativo, sem recalcular a partir dos itens e sem commit
+        """
+        alteradas = self.db.query(Venda).filter(Venda.id == venda_id).update({
+            Venda.valor_total: Venda.valor_total + valor,
+            Venda.quantidade_itens: Venda.quantidade_itens + itens
+        }, synchronize_session=False)
+        if not alteradas:
+            raise ValueError("Venda não encontrada")
+
+    def remover_item(self, venda_id: int, item_id: int, usuario_id: int) -> bool:
+        """
+        Remove um item da venda, devolvendo as peças ao estoque
+        Os totais da venda são ajustados pela diferença, na mesma transação
+        """
+        try:
+            return self.devolver_itens(venda_id, [{'item_id': item_id}], usuario_id)
+
+        except Exception as e:
+            raise Exception(f"Erro ao remover item: {str(e)}")
+
     def atualizar_valor_total(self, venda_id: int):
         """
-        Atualiza o valor total da venda
+        Recalcula os totais de uma venda a partir dos itens (sem commit)
+        O caminho normal mantém os totais por diferença; isto é para correções
         """
         try:
-            total = self.db.query(
-                func.sum(ItemVenda.quantidade * ItemVenda.valor_unitario)
+            total, itens = self.db.query(
+                func.coalesce(func.sum(ItemVenda.quantidade * ItemVenda.valor_unitario), 0),
+                func.count(ItemVenda.id)
             ).filter(
                 ItemVenda.venda_id == venda_id
-            ).scalar() or 0
+            ).one()
 
-            venda = self.db.query(Venda).filter(Venda.id == venda_id).first()
-            venda.valor_total = total
+            self.db.query(Venda).filter(Venda.id == venda_id).update({
+                Venda.valor_total: total,
+                Venda.quantidade_itens: itens
+            }, synchronize_session=False)
 
-            self.db.commit()
+        except Exception as e:
+            raise Exception(f"Erro ao atualizar valor total: {str(e)}")
+
+    def verificar_totais_vendas(self, corrigir: bool = False) -> List[Dict]:
+        """
+        Confere em lote os totais desnormalizados (valor_total e quantidade_itens)
+        de todas as vendas contra os itens, com uma única consulta agregada
+        Com corrigir=True, regrava os totais divergentes e faz commit
+        Retorna as vendas divergentes com os valores gravados e os calculados
+        """
+        try:
+            itens = self.db.query(
+                ItemVenda.venda_id,
+                func.sum(ItemVenda.quantidade * ItemVenda.valor_unitario).label('valor'),
+                func.count(ItemVenda.id).label('itens')
+            ).group_by(ItemVenda.venda_id).subquery()
+
+            valor_calculado = func.round(func.coalesce(itens.c.valor, 0), 2)
+            itens_calculados = func.coalesce(itens.c.itens, 0)
+
+            divergentes = self.db.query(
+                Venda.id,
+                Venda.valor_total,
+                Venda.quantidade_itens,
+                valor_calculado.label('valor_calculado'),
+                itens_calculados.label('itens_calculados')
+            ).outerjoin(
+                itens, itens.c.venda_id == Venda.id
+            ).filter(or_(
+                func.round(Venda.valor_total, 2) != valor_calculado,
+                Venda.quantidade_itens.is_(None),
+                Venda.quantidade_itens != itens_calculados
+            )).all()
+
+            if corrigir and divergentes:
+                self.db.bulk_update_mappings(Venda, [
+                    {
+                        'id': venda.id,
+                        'valor_total': Decimal(str(venda.valor_calculado)),
+                        'quantidade_itens': venda.itens_calculados
+                    }
+                    for venda in divergentes
+                ])
+                self.db.commit()
+
+            return [
+                {
+                    "venda_id": venda.id,
+                    "valor_total": float(venda.valor_total or 0),
+                    "valor_calculado": float(venda.valor_calculado),
+                    "quantidade_itens": venda.quantidade_itens,
+                    "itens_calculados": venda.itens_calculados
+                }
+                for venda in divergentes
+            ]
 
         except Exception as e:
             self.db.rollback()
-            raise Exception(f"Erro ao atualizar valor total: {str(e)}")
+            raise Exception(f"Erro ao verificar totais das vendas: {str(e)}")
 
     def finalizar_venda(self,
                         venda_id: int,
@@ -133,7 +636,10 @@ class VendaController:
             if not itens:
                 raise ValueError("Não é possível finalizar uma venda sem itens")
 
+            # A troca da forma de pagamento move a venda de linha nos totais diários
+            chaves_anteriores = self.vendas_diarias_controller.chaves_vendas([venda_id])
             venda.forma_pagamento = forma_pagamento
+            self.vendas_diarias_controller.atualizar_vendas([venda_id], chaves_anteriores)
 
             # Registra no log
             log = LogAcao(
@@ -157,41 +663,231 @@ class VendaController:
         Cancela uma venda e estorna os produtos para o estoque
         """
         try:
-            venda = self.db.query(Venda).filter(Venda.id == venda_id).first()
-            if not venda:
+            return self.cancelar_vendas([venda_id], usuario_id) == 1
+
+        except Exception as e:
+            raise Exception(f"Erro ao cancelar venda: {str(e)}")
+
+    def cancelar_vendas(self, venda_ids: List[int], usuario_id: int) -> int:
+        """
+        Cancela as vendas informadas em uma única transação
+        O estoque é estornado com um UPDATE por lote de vendas (somando os
+        itens_venda de cada produto) e os logs são gravados com INSERT ... SELECT,
+        sem carregar itens ou produtos. Retorna a quantidade de vendas canceladas.
+        """
+        try:
+            iniciar_transacao_escrita(self.db)
+            produtos = self._estornar_vendas(list(set(venda_ids)), usuario_id)
+
+            self.db.commit()
+            cache_codigos.invalidar(codigo for _, codigo in produtos)
+            return len(set(venda_ids))
+
+        except Exception as e:
+            self.db.rollback()
+            raise Exception(f"Erro ao cancelar vendas: {str(e)}")
+
+    def _estornar_vendas(self, venda_ids: List[int], usuario_id: int) -> List[Tuple[int, str]]:
+        """
+        Estorna o estoque, registra os logs e marca as vendas como canceladas
+        (sem commit). Retorna (produto_id, codigo_barras) dos produtos estornados.
+        """
+        if not venda_ids:
+            raise ValueError("Nenhuma venda informada")
+
+        situacoes = {}
+        for inicio in range(0, len(venda_ids), TAMANHO_LOTE_ESTORNO):
+            situacoes.update(self.db.query(Venda.id, Venda.status).filter(
+                Venda.id.in_(venda_ids[inicio:inicio + TAMANHO_LOTE_ESTORNO])
+            ).all())
+        for venda_id in venda_ids:
+            if venda_id not in situacoes:
+                raise ValueError(f"Venda não encontrada: {venda_id}")
+            if situacoes[venda_id] != StatusVenda.FINALIZADA:
+                raise ValueError(f"Venda já cancelada: {venda_id}")
+
+        chaves_diarias = self.vendas_diarias_controller.chaves_vendas(venda_ids)
+        produtos = []
+
+        for inicio in range(0, len(venda_ids), TAMANHO_LOTE_ESTORNO):
+            lote = venda_ids[inicio:inicio + TAMANHO_LOTE_ESTORNO]
+
+            produtos.extend(self.db.query(Produto.id, Produto.codigo_barras).join(
+                ItemVenda, ItemVenda.produto_id == Produto.id
+            ).filter(
+                ItemVenda.venda_id.in_(lote)
+            ).distinct().all())
+
+            # Cada produto recebe de volta a soma das quantidades vendidas no lote
+            devolvido = select(func.sum(ItemVenda.quantidade)).where(
+                ItemVenda.produto_id == Produto.id,
+                ItemVenda.venda_id.in_(lote)
+            ).scalar_subquery()
+            self.db.query(Produto).filter(
+                Produto.id.in_(select(ItemVenda.produto_id).where(ItemVenda.venda_id.in_(lote)))
+            ).update({
+                Produto.quantidade_atual: Produto.quantidade_atual + devolvido,
+                Produto.status: StatusProduto.EM_ESTOQUE
+            }, synchronize_session=False)
+
+            # Logs de estorno por item e de cancelamento por venda, gerados no banco
+            self.db.execute(insert(LogAcao).from_select(
+                [LogAcao.usuario_id, LogAcao.tipo_acao, LogAcao.descricao,
+                 LogAcao.tabela_afetada, LogAcao.referencia_id],
+                select(
+                    literal(usuario_id),
+                    literal(TipoAcao.VENDA, LogAcao.tipo_acao.type),
+                    literal("Estorno de ") + cast(ItemVenda.quantidade, String) +
+                    literal(" unidades do produto ") + Produto.codigo_barras +
+                    literal(" da venda ") + cast(ItemVenda.venda_id, String),
+                    literal("produtos"),
+                    Produto.id
+                ).select_from(ItemVenda).join(
+                    Produto, ItemVenda.produto_id == Produto.id
+                ).where(
+                    ItemVenda.venda_id.in_(lote)
+                ).order_by(ItemVenda.id)
+            ))
+            self.db.execute(insert(LogAcao).from_select(
+                [LogAcao.usuario_id, LogAcao.tipo_acao, LogAcao.descricao,
+                 LogAcao.tabela_afetada, LogAcao.referencia_id],
+                select(
+                    literal(usuario_id),
+                    literal(TipoAcao.VENDA, LogAcao.tipo_acao.type),
+                    literal("Cancelamento de venda - ID: ") + cast(Venda.id, String),
+                    literal("vendas"),
+                    Venda.id
+                ).where(
+                    Venda.id.in_(lote)
+                ).order_by(Venda.id)
+            ))
+
+            self.db.query(Venda).filter(Venda.id.in_(lote)).update(
+                {Venda.status: StatusVenda.CANCELADA}, synchronize_session=False
+            )
+
+        # Atualiza o resumo do estoque e os totais diários na mesma transação
+        self.produto_controller.resumo_controller.atualizar_produtos(
+            produto_id for produto_id, _ in produtos
+        )
+        self.vendas_diarias_controller.atualizar_chaves(chaves_diarias)
+        return produtos
+
+    def devolver_itens(self, venda_id: int, devolucoes: List[Dict], usuario_id: int) -> bool:
+        """
+        Devolução parcial de uma venda finalizada
+        devolucoes: lista de {'item_id', 'quantidade'} (sem quantidade, devolve o item inteiro)
+        As peças voltam ao estoque com um único UPDATE, os itens são reduzidos
+        (ou removidos, se devolvidos por inteiro) e os totais da venda e do dia
+        são ajustados na mesma transação. Se todos os itens forem devolvidos
+        por inteiro, a venda é cancelada.
+        """
+        try:
+            if not devolucoes:
+                raise ValueError("Nenhum item informado para devolução")
+
+            iniciar_transacao_escrita(self.db)
+
+            status = self.db.query(Venda.status).filter(Venda.id == venda_id).scalar()
+            if status is None:
                 raise ValueError("Venda não encontrada")
+            if status != StatusVenda.FINALIZADA:
+                raise ValueError("Venda já cancelada")
 
-            # Estorna os produtos para o estoque
-            itens = self.db.query(ItemVenda).filter(
-                ItemVenda.venda_id == venda_id
-            ).all()
+            itens = {
+                item.id: item for item in self.db.query(
+                    ItemVenda.id,
+                    ItemVenda.produto_id,
+                    ItemVenda.quantidade,
+                    ItemVenda.valor_unitario,
+                    Produto.codigo_barras
+                ).join(
+                    Produto, ItemVenda.produto_id == Produto.id
+                ).filter(
+                    ItemVenda.venda_id == venda_id
+                )
+            }
 
-            for item in itens:
-                produto = self.db.query(Produto).filter(
-                    Produto.id == item.produto_id
-                ).first()
+            # Quantidade devolvida por item (o mesmo item pode aparecer mais de uma vez)
+            por_item = defaultdict(int)
+            for devolucao in devolucoes:
+                item = itens.get(devolucao['item_id'])
+                if not item:
+                    raise ValueError(f"Item não encontrado na venda: {devolucao['item_id']}")
+                quantidade = devolucao.get('quantidade', item.quantidade)
+                if not isinstance(quantidade, int) or quantidade <= 0:
+                    raise ValueError(f"Quantidade inválida para devolução: {quantidade}")
+                por_item[item.id] += quantidade
+            for item_id, quantidade in por_item.items():
+                if quantidade > itens[item_id].quantidade:
+                    raise ValueError(
+                        f"Quantidade para devolução maior que a vendida: {itens[item_id].codigo_barras}"
+                    )
 
-                produto.quantidade_atual += item.quantidade
-                produto.status = StatusProduto.EM_ESTOQUE
+            removidos = [
+                item_id for item_id, quantidade in por_item.items()
+                if quantidade == itens[item_id].quantidade
+            ]
+            if len(removidos) == len(itens):
+                produtos = self._estornar_vendas([venda_id], usuario_id)
+                self.db.commit()
+                cache_codigos.invalidar(codigo for _, codigo in produtos)
+                return True
 
-            venda.status = StatusVenda.CANCELADA
+            por_produto = defaultdict(int)
+            for item_id, quantidade in por_item.items():
+                por_produto[itens[item_id].produto_id] += quantidade
 
-            # Registra no log
-            log = LogAcao(
-                usuario_id=usuario_id,
-                tipo_acao=TipoAcao.VENDA,
-                descricao=f"Cancelamento de venda - ID: {venda_id}",
-                tabela_afetada="vendas",
-                referencia_id=venda.id
+            self.db.query(Produto).filter(Produto.id.in_(list(por_produto))).update({
+                Produto.quantidade_atual: Produto.quantidade_atual + case(
+                    por_produto, value=Produto.id
+                ),
+                Produto.status: StatusProduto.EM_ESTOQUE
+            }, synchronize_session=False)
+
+            parciais = {
+                item_id: quantidade for item_id, quantidade in por_item.items()
+                if item_id not in removidos
+            }
+            if parciais:
+                self.db.query(ItemVenda).filter(ItemVenda.id.in_(list(parciais))).update({
+                    ItemVenda.quantidade: ItemVenda.quantidade - case(parciais, value=ItemVenda.id)
+                }, synchronize_session=False)
+            if removidos:
+                self.db.query(ItemVenda).filter(ItemVenda.id.in_(removidos)).delete(
+                    synchronize_session=False
+                )
+
+            self._aplicar_delta_venda(
+                venda_id,
+                -sum(itens[item_id].valor_unitario * quantidade
+                     for item_id, quantidade in por_item.items()),
+                -len(removidos)
             )
-            self.db.add(log)
+
+            self.db.bulk_insert_mappings(LogAcao, [
+                {
+                    'usuario_id': usuario_id,
+                    'tipo_acao': TipoAcao.VENDA,
+                    'descricao': f"Devolução de {quantidade} unidades do produto "
+                                 f"{itens[item_id].codigo_barras} da venda {venda_id}",
+                    'tabela_afetada': "produtos",
+                    'referencia_id': itens[item_id].produto_id
+                }
+                for item_id, quantidade in por_item.items()
+            ])
+
+            # Atualiza o resumo do estoque e os totais diários na mesma transação
+            self.produto_controller.resumo_controller.atualizar_produtos(por_produto.keys())
+            self.vendas_diarias_controller.atualizar_vendas([venda_id])
 
             self.db.commit()
+            cache_codigos.invalidar(itens[item_id].codigo_barras for item_id in por_item)
             return True
 
         except Exception as e:
             self.db.rollback()
-            raise Exception(f"Erro ao cancelar venda: {str(e)}")
+            raise Exception(f"Erro ao devolver itens: {str(e)}")
 
     def buscar_venda(self, venda_id: int) -> Optional[Dict]:
         """
@@ -214,78 +910,212 @@ class VendaController:
         except Exception as e:
             raise Exception(f"Erro ao buscar venda: {str(e)}")
 
+    def _query_relatorio_vendas(self, data_inicio: datetime, data_fim: datetime):
+        """
+        Linhas leves (sem objetos do ORM) das vendas finalizadas do período
+        A quantidade de itens vem da coluna mantida na própria venda
+        """
+        return self.db.query(
+            Venda.id,
+            Venda.data_hora,
+            Venda.cliente_nome,
+            Venda.valor_total,
+            Venda.forma_pagamento,
+            Venda.quantidade_itens
+        ).filter(
+            Venda.data_hora >= data_inicio,
+            Venda.data_hora <= data_fim,
+            Venda.status == StatusVenda.FINALIZADA
+        ).order_by(
+            Venda.data_hora,
+            Venda.id
+        )
+
+    def _formatar_linha_relatorio(self, venda) -> Dict:
+        return {
+            "id": venda.id,
+            "data_hora": venda.data_hora,
+            "cliente_nome": venda.cliente_nome,
+            "valor_total": float(venda.valor_total),
+            "forma_pagamento": venda.forma_pagamento.value,
+            "quantidade_itens": venda.quantidade_itens
+        }
+
     def relatorio_vendas_periodo(self,
                                  data_inicio: datetime,
-                                 data_fim: datetime) -> List[Dict]:
+                                 data_fim: datetime,
+                                 page: Optional[int] = None,
+                                 per_page: int = 100) -> List[Dict]:
         """
-        Gera relatório de vendas por período
+        Gera relatório de vendas por período com uma única consulta
+        Com page, retorna apenas aquela página (per_page vendas)
         """
         try:
-            vendas = self.db.query(Venda).filter(
-                Venda.data_hora >= data_inicio,
-                Venda.data_hora <= data_fim,
-                Venda.status == StatusVenda.FINALIZADA
-            ).all()
+            query = self._query_relatorio_vendas(data_inicio, data_fim)
+            if page:
+                query = query.offset((page - 1) * per_page).limit(per_page)
 
-            relatorio = []
-            for venda in vendas:
-                itens = self.db.query(ItemVenda).filter(
-                    ItemVenda.venda_id == venda.id
-                ).all()
+            return [self._formatar_linha_relatorio(venda) for venda in query]
+
+        except Exception as e:
+            raise Exception(f"Erro ao gerar relatório: {str(e)}")
 
-                relatorio.append({
-                    "id": venda.id,
-                    "data_hora": venda.data_hora,
-                    "cliente_nome": venda.cliente_nome,
-                    "valor_total": float(venda.valor_total),
-                    "forma_pagamento": venda.forma_pagamento.value,
-                    "quantidade_itens": len(itens)
-                })
+    def iterar_vendas_periodo(self,
+                              data_inicio: datetime,
+                              data_fim: datetime,
+                              tamanho_lote: int = 1000) -> Iterator[Dict]:
+        """
+        Percorre as vendas do período lendo do banco em lotes (yield_per),
+        para períodos longos sem carregar tudo na memória
+        """
+        try:
+            query = self._query_relatorio_vendas(data_inicio, data_fim).execution_options(
+                stream_results=True
+            ).yield_per(tamanho_lote)
 
-            return relatorio
+            for venda in query:
+                yield self._formatar_linha_relatorio(venda)
 
         except Exception as e:
             raise Exception(f"Erro ao gerar relatório: {str(e)}")
 
-    def resumo_vendas_dia(self, data: datetime) -> Dict:
+    def resumo_vendas_dia(self, data: datetime, usuario_id: Optional[int] = None) -> Dict:
         """
-        Retorna resumo das vendas do dia
+        Retorna resumo das vendas do dia, lido dos totais diários
+        Inclui os totais do dia anterior e a variação do valor (na mesma consulta)
         """
         try:
-            inicio_dia = data.replace(hour=0, minute=0, second=0, microsecond=0)
-            fim_dia = data.replace(hour=23, minute=59, second=59, microsecond=999999)
-
-            total_vendas = self.db.query(func.count(Venda.id)).filter(
-                Venda.data_hora.between(inicio_dia, fim_dia),
-                Venda.status == StatusVenda.FINALIZADA
-            ).scalar()
-
-            valor_total = self.db.query(func.sum(Venda.valor_total)).filter(
-                Venda.data_hora.between(inicio_dia, fim_dia),
-                Venda.status == StatusVenda.FINALIZADA
-            ).scalar() or 0
-
-            vendas_por_pagamento = self.db.query(
-                Venda.forma_pagamento,
-                func.count(Venda.id),
-                func.sum(Venda.valor_total)
+            dia = data.date() if isinstance(data, datetime) else data
+            dia_anterior = dia - timedelta(days=1)
+
+            query = self.db.query(
+                VendaDiaria.data,
+                VendaDiaria.forma_pagamento,
+                func.sum(VendaDiaria.total_vendas),
+                func.sum(VendaDiaria.valor_total),
+                func.sum(VendaDiaria.quantidade_itens)
             ).filter(
-                Venda.data_hora.between(inicio_dia, fim_dia),
-                Venda.status == StatusVenda.FINALIZADA
-            ).group_by(Venda.forma_pagamento).all()
+                VendaDiaria.data.in_([dia, dia_anterior])
+            )
+            if usuario_id:
+                query = query.filter(VendaDiaria.usuario_id == usuario_id)
+
+            linhas = query.group_by(
+                VendaDiaria.data,
+                VendaDiaria.forma_pagamento
+            ).order_by(
+                VendaDiaria.forma_pagamento
+            ).all()
+
+            do_dia = [linha for linha in linhas if linha[0] == dia]
+            anteriores = [linha for linha in linhas if linha[0] == dia_anterior]
+
+            valor_total = sum(float(valor) for _, _, _, valor, _ in do_dia)
+            valor_anterior = sum(float(valor) for _, _, _, valor, _ in anteriores)
 
             return {
-                "total_vendas": total_vendas,
-                "valor_total": float(valor_total),
+                "total_vendas": sum(quantidade for _, _, quantidade, _, _ in do_dia),
+                "valor_total": valor_total,
+                "quantidade_itens": sum(itens for _, _, _, _, itens in do_dia),
                 "vendas_por_pagamento": [
                     {
                         "forma": forma.value,
                         "quantidade": quantidade,
                         "valor_total": float(valor)
                     }
-                    for forma, quantidade, valor in vendas_por_pagamento
-                ]
+                    for _, forma, quantidade, valor, _ in do_dia
+                ],
+                "total_vendas_anterior": sum(quantidade for _, _, quantidade, _, _ in anteriores),
+                "valor_total_anterior": valor_anterior,
+                # Variação percentual do valor; None quando o dia anterior não teve vendas
+                "variacao_valor": (
+                    (valor_total - valor_anterior) / valor_anterior * 100
+                    if valor_anterior else None
+                )
             }
 
         except Exception as e:
-            raise Exception(f"Erro ao gerar resumo do dia: {str(e)}")
\ No newline at end of file
+            raise Exception(f"Erro ao gerar resumo do dia: {str(e)}")
+
+    def serie_temporal(self,
+                       inicio: datetime,
+                       fim: datetime,
+                       granularidade: str = "dia",
+                       agrupar_por: Optional[str] = None) -> List[Dict]:
+        """
+        Série de vendas finalizadas do período agregada em intervalos
+        (hora, dia, semana ou mês), calculada no banco
+        agrupar_por: None, "forma_pagamento" ou "usuario" (uma série por grupo)
+        Intervalos sem vendas aparecem zerados. Dia, semana e mês são lidos
+        dos totais diários (custo proporcional aos dias do período); hora lê as vendas.
+        """
+        try:
+            if granularidade not in GRANULARIDADES_SERIE:
+                raise ValueError(f"Granularidade inválida: {granularidade}")
+            if agrupar_por not in (None, *AGRUPAMENTOS_SERIE):
+                raise ValueError(f"Agrupamento inválido: {agrupar_por}")
+
+            if granularidade == "hora":
+                periodo = _expressao_periodo(Venda.data_hora, granularidade)
+                colunas = [func.count(Venda.id), func.sum(Venda.valor_total),
+                           func.sum(Venda.quantidade_itens)]
+                origem = Venda
+                filtros = [
+                    Venda.data_hora >= inicio,
+                    Venda.data_hora <= fim,
+                    Venda.status == StatusVenda.FINALIZADA
+                ]
+            else:
+                periodo = _expressao_periodo(VendaDiaria.data, granularidade)
+                colunas = [func.sum(VendaDiaria.total_vendas), func.sum(VendaDiaria.valor_total),
+                           func.sum(VendaDiaria.quantidade_itens)]
+                origem = VendaDiaria
+                filtros = [
+                    VendaDiaria.data >= inicio.date(),
+                    VendaDiaria.data <= fim.date()
+                ]
+
+            agrupamento = [periodo]
+            if agrupar_por == "forma_pagamento":
+                agrupamento.append(origem.forma_pagamento)
+            elif agrupar_por == "usuario":
+                agrupamento.append(origem.usuario_id)
+
+            query = self.db.query(*agrupamento, *colunas).filter(*filtros).group_by(*agrupamento)
+
+            totais = {}
+            for linha in query:
+                grupo = linha[1] if agrupar_por else None
+                if isinstance(grupo, FormaPagamento):
+                    grupo = grupo.value
+                totais[(datetime.fromisoformat(linha[0]), grupo)] = linha[-3:]
+
+            # Uma série por grupo encontrado, com todos os intervalos do período
+            grupos = sorted({grupo for _, grupo in totais}, key=str) or [None]
+            nomes = {}
+            if agrupar_por == "usuario" and totais:
+                nomes = dict(self.db.query(Usuario.id, Usuario.nome).filter(
+                    Usuario.id.in_(grupos)
+                ).all())
+            serie = []
+            periodo_atual = _inicio_periodo(inicio, granularidade)
+            while periodo_atual <= fim:
+                for grupo in grupos:
+                    quantidade, valor, itens = totais.get((periodo_atual, grupo), (0, 0, 0))
+                    ponto = {
+                        "periodo": periodo_atual,
+                        "total_vendas": quantidade,
+                        "valor_total": float(valor),
+                        "quantidade_itens": itens
+                    }
+                    if agrupar_por == "forma_pagamento":
+                        ponto["forma_pagamento"] = grupo
+                    elif agrupar_por == "usuario":
+                        ponto["usuario_id"] = grupo
+                        ponto["usuario"] = nomes.get(grupo)
+                    serie.append(ponto)
+                periodo_atual = _proximo_periodo(periodo_atual, granularidade)
+            return serie
+
+        except Exception as e:
+            raise Exception(f"Erro ao gerar série de vendas: {str(e)}")
@@ -0,0 +1,154 @@
+# src/controllers/vendas_diarias.py
+from datetime import date, datetime, time, timedelta
+from typing import Iterable, List, Optional, Tuple
+from sqlalchemy.orm import Session
+from sqlalchemy import func, select, delete, insert, tuple_
+from ..models import Venda, VendaDiaria, StatusVenda, FormaPagamento
+
+# Quantidade de chaves recalculadas por comando (limita os parâmetros do IN)
+TAMANHO_LOTE_CHAVES = 300
+
+ChaveDiaria = Tuple[date, int, FormaPagamento]
+
+
+# Mantém a tabela vendas_diarias sincronizada com as vendas finalizadas.
+# Os métodos de atualização não fazem commit: são chamados dentro da
+# transação da operação que finalizou, alterou ou cancelou a venda.
+class VendasDiariasController:
+    def __init__(self, db: Session):
+        self.db = db
+
+    def _select_dias(self):
+        """
+        Agregação das vendas finalizadas por dia, usuário e forma de pagamento
+        """
+        dia = func.date(Venda.data_hora)
+        return select(
+            dia,
+            Venda.usuario_id,
+            Venda.forma_pagamento,
+            func.count(Venda.id),
+            func.sum(Venda.valor_total),
+            func.sum(Venda.quantidade_itens)
+        ).where(
+            Venda.status == StatusVenda.FINALIZADA
+        ).group_by(
+            dia,
+            Venda.usuario_id,
+            Venda.forma_pagamento
+        )
+
+    def _inserir_dias(self, consulta):
+        """
+        Insere nos totais diários o resultado de uma consulta de _select_dias
+        """
+        self.db.execute(
+            insert(VendaDiaria).from_select(
+                [
+                    VendaDiaria.data,
+                    VendaDiaria.usuario_id,
+                    VendaDiaria.forma_pagamento,
+                    VendaDiaria.total_vendas,
+                    VendaDiaria.valor_total,
+                    VendaDiaria.quantidade_itens
+                ],
+                consulta
+            )
+        )
+
+    def atualizar_chaves(self, chaves: Iterable[ChaveDiaria]):
+        """
+        Recalcula as linhas (data, usuario_id, forma_pagamento) informadas
+        Linhas sem vendas finalizadas deixam de existir
+        """
+        chaves = list(set(chaves))
+        for inicio in range(0, len(chaves), TAMANHO_LOTE_CHAVES):
+            lote = chaves[inicio:inicio + TAMANHO_LOTE_CHAVES]
+            dias = [dia for dia, _, _ in lote]
+
+            self.db.execute(
+                delete(VendaDiaria).where(
+                    tuple_(
+                        VendaDiaria.data,
+                        VendaDiaria.usuario_id,
+                        VendaDiaria.forma_pagamento
+                    ).in_(lote)
+                )
+            )
+            # O intervalo de datas permite usar o índice de data_hora das vendas
+            self._inserir_dias(
+                self._select_dias().where(
+                    Venda.data_hora >= datetime.combine(min(dias), time.min),
+                    Venda.data_hora < datetime.combine(max(dias) + timedelta(days=1), time.min),
+                    tuple_(
+                        func.date(Venda.data_hora),
+                        Venda.usuario_id,
+                        Venda.forma_pagamento
+                    ).in_([(dia.isoformat(), usuario_id, forma) for dia, usuario_id, forma in lote])
+                )
+            )
+
+    def chaves_vendas(self, venda_ids: Iterable[int]) -> List[ChaveDiaria]:
+        """
+        Retorna as chaves diárias das vendas informadas, como estão no banco
+        """
+        # A sessão não usa autoflush: garante que as alterações pendentes sejam lidas
+        self.db.flush()
+        venda_ids = list(set(venda_ids))
+        chaves = []
+        for inicio in range(0, len(venda_ids), TAMANHO_LOTE_CHAVES):
+            chaves.extend(
+                (date.fromisoformat(dia), usuario_id, forma)
+                for dia, usuario_id, forma in self.db.query(
+                    func.date(Venda.data_hora),
+                    Venda.usuario_id,
+                    Venda.forma_pagamento
+                ).filter(
+                    Venda.id.in_(venda_ids[inicio:inicio + TAMANHO_LOTE_CHAVES])
+                ).distinct()
+            )
+        return chaves
+
+    def atualizar_vendas(self,
+                         venda_ids: Iterable[int],
+                         chaves_anteriores: Iterable[ChaveDiaria] = ()):
+        """
+        Recalcula as linhas diárias das vendas informadas
+        chaves_anteriores: chaves das vendas antes da alteração (ex.: troca da
+        forma de pagamento), que também precisam ser recalculadas
+        """
+        self.atualizar_chaves(list(chaves_anteriores) + self.chaves_vendas(venda_ids))
+
+    def reconstruir(self,
+                    data_inicio: Optional[date] = None,
+                    data_fim: Optional[date] = None) -> int:
+        """
+        Reconstrói os totais diários a partir das vendas (todo o histórico ou
+        só os dias do período informado)
+        Retorna a quantidade de linhas geradas no período
+        """
+        try:
+            remover = delete(VendaDiaria)
+            consulta = self._select_dias()
+            contagem = self.db.query(func.count(VendaDiaria.id))
+            if data_inicio:
+                remover = remover.where(VendaDiaria.data >= data_inicio)
+                consulta = consulta.where(Venda.data_hora >= datetime.combine(data_inicio, time.min))
+                contagem = contagem.filter(VendaDiaria.data >= data_inicio)
+            if data_fim:
+                remover = remover.where(VendaDiaria.data <= data_fim)
+                consulta = consulta.where(
+                    Venda.data_hora < datetime.combine(data_fim + timedelta(days=1), time.min)
+                )
+                contagem = contagem.filter(VendaDiaria.data <= data_fim)
+
+            self.db.execute(remover)
+            self._inserir_dias(consulta)
+            total = contagem.scalar()
+
+            self.db.commit()
+            return total
+
+        except Exception as e:
+            self.db.rollback()
+            raise Exception(f"Erro ao reconstruir vendas diárias: {str(e)}")
@@ -6,6 +6,10 @@ from .fornecedor import Fornecedor
 from .nota import NotaEntrada, StatusNota
 from .produto import Produto, StatusProduto
 from .venda import Venda, ItemVenda, FormaPagamento, StatusVenda
+from .estoque_resumo import EstoqueResumo
+from .exportacao import MarcaExportacao
+from .venda_diaria import VendaDiaria
+from .importacao import Importacao, ErroImportacao, StatusImportacao
 
 # Lista de todos os modelos para facilitar a criação das tabelas
 all_models = [
@@ -15,7 +19,12 @@ all_models = [
     NotaEntrada,
     Produto,
     Venda,
-    ItemVenda
+    ItemVenda,
+    EstoqueResumo,
+    MarcaExportacao,
+    VendaDiaria,
+    Importacao,
+    ErroImportacao
 ]
 
 # Função para criar todas as tabelas
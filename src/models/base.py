@@ -1,5 +1,5 @@
 # src/models/base.py
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 
@@ -12,6 +12,15 @@ engine = create_engine(
     connect_args={"check_same_thread": False}  # Necessário para SQLite
 )
 
+
+@event.listens_for(engine, "connect")
+def configurar_conexao_sqlite(dbapi_connection, connection_record):
+    """Modo WAL: leituras (relatórios, dashboard) não bloqueiam a gravação das vendas"""
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.close()
+
+
 # Criando a sessão
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
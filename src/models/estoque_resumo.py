@@ -0,0 +1,35 @@
+# src/models/estoque_resumo.py
+from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, Numeric, Index
+from sqlalchemy.orm import relationship
+from .base import Base
+
+
+# Resumo materializado do estoque em loja: uma linha por referência/tamanho/fornecedor,
+# mantida na mesma transação das operações que movimentam o estoque
+class EstoqueResumo(Base):
+    __tablename__ = "estoque_resumo"
+
+    id = Column(Integer, primary_key=True, index=True)
+    referencia = Column(String(50), nullable=False)
+    tamanho = Column(String(10), nullable=False)
+    fornecedor_id = Column(Integer, ForeignKey("fornecedores.id"), nullable=False)
+    descricao = Column(String(200), nullable=False)
+    total_lotes = Column(Integer, nullable=False)  # Produtos (lotes) em estoque no grupo
+    quantidade_total = Column(Integer, nullable=False)
+    valor_unitario_medio = Column(Numeric(10, 2), nullable=False)
+    valor_total = Column(Numeric(12, 2), nullable=False)
+    primeira_entrada = Column(DateTime(timezone=True), nullable=False)
+    ultima_entrada = Column(DateTime(timezone=True), nullable=False)
+
+    # Relacionamentos
+    fornecedor = relationship("Fornecedor")
+
+    __table_args__ = (
+        # Chave do grupo, também usada na paginação por cursor
+        Index('idx_resumo_chave', 'referencia', 'tamanho', 'fornecedor_id', unique=True),
+        Index('idx_resumo_fornecedor', 'fornecedor_id'),
+    )
+
+    def __repr__(self):
+        return (f"<EstoqueResumo(referencia={self.referencia}, tamanho={self.tamanho}, "
+                f"fornecedor_id={self.fornecedor_id}, quantidade_total={self.quantidade_total})>")
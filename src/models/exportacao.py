@@ -0,0 +1,19 @@
+# src/models/exportacao.py
+from sqlalchemy import Column, Integer, String, DateTime
+from .base import Base
+
+
+# Marca d'água das exportações incrementais de cada tabela: valor da sequência de
+# alterações (src/utils/alteracoes.py) até o qual as linhas já foram exportadas
+class MarcaExportacao(Base):
+    __tablename__ = "exportacao_marcas"
+
+    id = Column(Integer, primary_key=True, index=True)
+    tabela = Column(String(50), unique=True, nullable=False)
+    ultimo_id = Column(Integer, nullable=False)  # Maior id exportado (informativo)
+    ultima_alteracao = Column(Integer)
+    data_exportacao = Column(DateTime(timezone=True), nullable=False)
+    arquivo = Column(String(500))
+
+    def __repr__(self):
+        return f"<MarcaExportacao(tabela={self.tabela}, ultima_alteracao={self.ultima_alteracao})>"
@@ -0,0 +1,72 @@
+# src/models/importacao.py
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Enum, Boolean, Index
+from sqlalchemy.sql import func
+from sqlalchemy.orm import relationship
+from .base import Base
+
+import enum
+
+
+class StatusImportacao(enum.Enum):
+    PENDENTE = "pendente"
+    EM_ANDAMENTO = "em_andamento"
+    CONCLUIDA = "concluida"
+    ERRO = "erro"
+
+
+# Importação de planilha de produtos processada em segundo plano, em blocos.
+# ultima_linha é gravada na mesma transação dos produtos de cada bloco, e é o
+# ponto de retomada depois de uma queda do servidor.
+class Importacao(Base):
+    __tablename__ = "importacoes"
+
+    id = Column(Integer, primary_key=True, index=True)
+    nota_entrada_id = Column(Integer, ForeignKey("notas_entrada.id"), nullable=False)
+    usuario_id = Column(Integer, ForeignKey("usuarios.id"), nullable=False)
+    nome_arquivo = Column(String(255), nullable=False)
+    arquivo = Column(String(500), nullable=False)  # Cópia da planilha em disco
+    hash_arquivo = Column(String(64), nullable=False)  # SHA-256 do conteúdo
+    status = Column(Enum(StatusImportacao), nullable=False, default=StatusImportacao.PENDENTE)
+    tudo_ou_nada = Column(Boolean, nullable=False, default=False)
+    total_linhas = Column(Integer)
+    ultima_linha = Column(Integer, nullable=False, default=0)  # Linhas já processadas
+    importados = Column(Integer, nullable=False, default=0)
+    atualizados = Column(Integer, nullable=False, default=0, server_default="0")
+    ignorados = Column(Integer, nullable=False, default=0, server_default="0")  # Linhas já importadas
+    total_erros = Column(Integer, nullable=False, default=0)
+    mensagem = Column(String(500))  # Motivo da interrupção (status ERRO)
+    data_criacao = Column(DateTime(timezone=True), server_default=func.now())
+    data_atualizacao = Column(DateTime(timezone=True))
+    data_conclusao = Column(DateTime(timezone=True))
+
+    # Relacionamentos
+    nota_entrada = relationship("NotaEntrada")
+    usuario = relationship("Usuario")
+
+    __table_args__ = (
+        Index('idx_importacao_status', 'status'),
+        Index('idx_importacao_nota_hash', 'nota_entrada_id', 'hash_arquivo'),
+    )
+
+    def __repr__(self):
+        return (f"<Importacao(id={self.id}, nota_entrada_id={self.nota_entrada_id}, "
+                f"status={self.status}, ultima_linha={self.ultima_linha})>")
+
+
+# Erros por linha de uma importação (o log de erros do relatório)
+class ErroImportacao(Base):
+    __tablename__ = "importacoes_erros"
+
+    id = Column(Integer, primary_key=True, index=True)
+    importacao_id = Column(Integer, ForeignKey("importacoes.id"), nullable=False)
+    linha = Column(Integer, nullable=False)
+    codigo_barras = Column(String(50))
+    campo = Column(String(50))
+    erro = Column(String(500), nullable=False)
+
+    __table_args__ = (
+        Index('idx_importacao_erro_linha', 'importacao_id', 'linha'),
+    )
+
+    def __repr__(self):
+        return f"<ErroImportacao(importacao_id={self.importacao_id}, linha={self.linha})>"
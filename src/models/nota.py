@@ -1,5 +1,5 @@
 # src/models/nota.py
-from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, Enum, Index
+from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, Enum, Index, FetchedValue
 from sqlalchemy.sql import func
 from sqlalchemy.orm import relationship
 from .base import Base
@@ -24,6 +24,9 @@ class NotaEntrada(Base):
     status = Column(Enum(StatusNota), default=StatusNota.ATIVA, nullable=False)
     usuario_registro_id = Column(Integer, ForeignKey("usuarios.id"), nullable=False)
     observacoes = Column(String(500))
+    # Sequência da última alteração, gravada por trigger (src/utils/alteracoes.py)
+    seq_alteracao = Column(Integer, server_default=FetchedValue(), server_onupdate=FetchedValue(),
+                           index=True)
 
     # Relacionamentos
     fornecedor = relationship("Fornecedor", back_populates="notas_entrada")
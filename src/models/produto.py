@@ -1,5 +1,5 @@
 # src/models/produto.py
-from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, Enum, Numeric, Index
+from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, Enum, Numeric, Index, FetchedValue
 from sqlalchemy.sql import func
 from sqlalchemy.orm import relationship
 from .base import Base
@@ -28,6 +28,11 @@ class Produto(Base):
     status = Column(Enum(StatusProduto), default=StatusProduto.EM_ESTOQUE, nullable=False)
     data_registro = Column(DateTime(timezone=True), server_default=func.now())
     usuario_registro_id = Column(Integer, ForeignKey("usuarios.id"), nullable=False)
+    # Ordem FIFO (emissão da nota, registro, id) calculada por trigger (src/utils/fifo.py)
+    fifo_key = Column(String(46), server_default=FetchedValue(), server_onupdate=FetchedValue())
+    # Sequência da última alteração, gravada por trigger (src/utils/alteracoes.py)
+    seq_alteracao = Column(Integer, server_default=FetchedValue(), server_onupdate=FetchedValue(),
+                           index=True)
 
     # Relacionamentos
     nota_entrada = relationship("NotaEntrada", back_populates="produtos")
@@ -38,6 +43,11 @@ class Produto(Base):
     __table_args__ = (
         Index('idx_nota_status', 'nota_entrada_id', 'status'),
         Index('idx_produto_busca', 'referencia', 'descricao', 'tamanho'),
+        # Filtros e agrupamentos da visualização de estoque
+        Index('idx_produto_status_ref', 'status', 'referencia', 'tamanho'),
+        # Fila FIFO de cada referência/tamanho: a alocação percorre o índice já na ordem
+        # e para no LIMIT, sem ordenar os lotes
+        Index('idx_produto_fifo', 'referencia', 'tamanho', 'status', 'fifo_key', 'quantidade_atual'),
     )
 
     def __repr__(self):
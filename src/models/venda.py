@@ -1,5 +1,5 @@
 # src/models/venda.py
-from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, Enum, Numeric, Index
+from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, Enum, Numeric, Index, FetchedValue
 from sqlalchemy.sql import func
 from sqlalchemy.orm import relationship
 from .base import Base
@@ -28,14 +28,24 @@ class Venda(Base):
     cliente_nome = Column(String(100), nullable=False)
     cliente_cpf = Column(String(11))
     valor_total = Column(Numeric(10, 2), nullable=False)
+    quantidade_itens = Column(Integer, nullable=False, default=0, server_default="0")
     forma_pagamento = Column(Enum(FormaPagamento), nullable=False)
     status = Column(Enum(StatusVenda), default=StatusVenda.FINALIZADA, nullable=False)
     observacoes = Column(String(500))
+    # Identificador gerado no caixa; evita gravar duas vezes a mesma venda do diário
+    chave_idempotencia = Column(String(36))
+    # Sequência da última alteração, gravada por trigger (src/utils/alteracoes.py)
+    seq_alteracao = Column(Integer, server_default=FetchedValue(), server_onupdate=FetchedValue(),
+                           index=True)
 
     # Relacionamentos
     usuario = relationship("Usuario")
     itens = relationship("ItemVenda", back_populates="venda")
 
+    __table_args__ = (
+        Index('idx_venda_chave_idempotencia', 'chave_idempotencia', unique=True),
+    )
+
     def __repr__(self):
         return f"<Venda(id={self.id}, cliente={self.cliente_nome}, valor_total={self.valor_total})>"
 
@@ -49,15 +59,21 @@ class ItemVenda(Base):
     quantidade = Column(Integer, nullable=False)
     valor_unitario = Column(Numeric(10, 2), nullable=False)
     nota_entrada_id = Column(Integer, ForeignKey("notas_entrada.id"), nullable=False)
+    # Sequência da última alteração, gravada por trigger (src/utils/alteracoes.py)
+    seq_alteracao = Column(Integer, server_default=FetchedValue(), server_onupdate=FetchedValue(),
+                           index=True)
 
     # Relacionamentos
     venda = relationship("Venda", back_populates="itens")
     produto = relationship("Produto", back_populates="itens_venda")
     nota_entrada = relationship("NotaEntrada")
 
-    # Índice composto para consultas FIFO
+    # Índices compostos
     __table_args__ = (
+        # Consultas FIFO
         Index('idx_item_venda_nota', 'nota_entrada_id', 'produto_id'),
+        # Última venda de cada produto (produtos sem movimento)
+        Index('idx_item_venda_produto', 'produto_id', 'venda_id'),
     )
 
     def __repr__(self):
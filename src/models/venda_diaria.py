@@ -0,0 +1,31 @@
+# src/models/venda_diaria.py
+from sqlalchemy import Column, Integer, ForeignKey, Date, Enum, Numeric, Index
+from sqlalchemy.orm import relationship
+from .base import Base
+from .venda import FormaPagamento
+
+
+# Totais diários das vendas finalizadas: uma linha por dia/usuário/forma de pagamento,
+# mantida na mesma transação das operações que finalizam ou cancelam vendas
+class VendaDiaria(Base):
+    __tablename__ = "vendas_diarias"
+
+    id = Column(Integer, primary_key=True, index=True)
+    data = Column(Date, nullable=False)
+    usuario_id = Column(Integer, ForeignKey("usuarios.id"), nullable=False)
+    forma_pagamento = Column(Enum(FormaPagamento), nullable=False)
+    total_vendas = Column(Integer, nullable=False)
+    valor_total = Column(Numeric(12, 2), nullable=False)
+    quantidade_itens = Column(Integer, nullable=False)
+
+    # Relacionamentos
+    usuario = relationship("Usuario")
+
+    __table_args__ = (
+        # Chave da linha; também atende as consultas por período
+        Index('idx_venda_diaria_chave', 'data', 'usuario_id', 'forma_pagamento', unique=True),
+    )
+
+    def __repr__(self):
+        return (f"<VendaDiaria(data={self.data}, usuario_id={self.usuario_id}, "
+                f"forma_pagamento={self.forma_pagamento}, valor_total={self.valor_total})>")
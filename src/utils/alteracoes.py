@@ -0,0 +1,82 @@
+# src/utils/alteracoes.py
+
+# Sequência de alterações usada pela exportação incremental. Cada INSERT ou
+# UPDATE nas tabelas exportáveis grava em seq_alteracao o próximo valor de
+# exportacao_sequencia, e cada DELETE fica registrado em exportacao_exclusoes.
+# Como só um escritor grava por vez no SQLite, um valor já confirmado da
+# sequência garante que todas as alterações até ele também estão confirmadas.
+TABELAS_ALTERACOES = ["vendas", "itens_venda", "produtos", "notas_entrada"]
+
+PROXIMO_VALOR = "UPDATE exportacao_sequencia SET valor = valor + 1;"
+
+DDL_ALTERACOES = [
+    """
+    CREATE TABLE IF NOT EXISTS exportacao_sequencia (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        valor INTEGER NOT NULL
+    )
+    """,
+    """
+    INSERT OR IGNORE INTO exportacao_sequencia (id, valor) VALUES (1, 0)
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS exportacao_exclusoes (
+        seq_alteracao INTEGER PRIMARY KEY,
+        tabela VARCHAR(50) NOT NULL,
+        registro_id INTEGER NOT NULL
+    )
+    """
+]
+for _tabela in TABELAS_ALTERACOES:
+    _marcar = f"""
+        {PROXIMO_VALOR}
+        UPDATE {_tabela} SET seq_alteracao = (SELECT valor FROM exportacao_sequencia)
+        WHERE id = new.id;
+    """
+    DDL_ALTERACOES += [
+        f"""
+        CREATE TRIGGER IF NOT EXISTS {_tabela}_alteracao_insert AFTER INSERT ON {_tabela} BEGIN
+            {_marcar}
+        END
+        """,
+        # O WHEN ignora o UPDATE feito pelos próprios triggers de alteração
+        f"""
+        CREATE TRIGGER IF NOT EXISTS {_tabela}_alteracao_update AFTER UPDATE ON {_tabela}
+        WHEN new.seq_alteracao IS old.seq_alteracao BEGIN
+            {_marcar}
+        END
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS {_tabela}_alteracao_delete AFTER DELETE ON {_tabela} BEGIN
+            {PROXIMO_VALOR}
+            INSERT INTO exportacao_exclusoes (seq_alteracao, tabela, registro_id)
+            SELECT valor, '{_tabela}', old.id FROM exportacao_sequencia;
+        END
+        """
+    ]
+
+
+def criar_gatilhos_alteracoes(engine):
+    """Cria a sequência de alterações e os triggers que a mantêm, se não existirem"""
+    with engine.begin() as conexao:
+        for comando in DDL_ALTERACOES:
+            conexao.exec_driver_sql(comando)
+
+
+def preencher_alteracoes(engine) -> int:
+    """
+    Numera as linhas ainda sem seq_alteracao (gravadas antes dos triggers)
+    O próprio trigger de UPDATE atribui a sequência. Retorna as linhas numeradas.
+    """
+    with engine.begin() as conexao:
+        return sum(
+            conexao.exec_driver_sql(
+                f"UPDATE {tabela} SET seq_alteracao = NULL WHERE seq_alteracao IS NULL"
+            ).rowcount
+            for tabela in TABELAS_ALTERACOES
+        )
+
+
+def valor_atual_alteracoes(conexao) -> int:
+    """Último valor confirmado da sequência de alterações"""
+    return conexao.exec_driver_sql("SELECT valor FROM exportacao_sequencia").scalar() or 0
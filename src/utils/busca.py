@@ -0,0 +1,371 @@
+# src/utils/busca.py
+import re
+import threading
+import unicodedata
+from collections import defaultdict
+from typing import Dict, Hashable, List, Optional, Set, Tuple
+from sqlalchemy import text, Integer, Float
+
+# Índice de texto completo (SQLite FTS5) dos produtos, mantido por triggers.
+# O rowid do índice é o id do produto.
+DDL_INDICE_BUSCA = [
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS produtos_fts USING fts5(
+        codigo_barras,
+        referencia,
+        descricao,
+        fornecedor,
+        tokenize = 'unicode61 remove_diacritics 2'
+    )
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS produtos_fts_insert AFTER INSERT ON produtos BEGIN
+        INSERT INTO produtos_fts (rowid, codigo_barras, referencia, descricao, fornecedor)
+        SELECT new.id, new.codigo_barras, new.referencia, new.descricao, f.nome
+        FROM notas_entrada n
+        JOIN fornecedores f ON f.id = n.fornecedor_id
+        WHERE n.id = new.nota_entrada_id;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS produtos_fts_delete AFTER DELETE ON produtos BEGIN
+        DELETE FROM produtos_fts WHERE rowid = old.id;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS produtos_fts_update
+    AFTER UPDATE OF codigo_barras, referencia, descricao, nota_entrada_id ON produtos BEGIN
+        DELETE FROM produtos_fts WHERE rowid = old.id;
+        INSERT INTO produtos_fts (rowid, codigo_barras, referencia, descricao, fornecedor)
+        SELECT new.id, new.codigo_barras, new.referencia, new.descricao, f.nome
+        FROM notas_entrada n
+        JOIN fornecedores f ON f.id = n.fornecedor_id
+        WHERE n.id = new.nota_entrada_id;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS fornecedores_fts_update AFTER UPDATE OF nome ON fornecedores BEGIN
+        UPDATE produtos_fts SET fornecedor = new.nome
+        WHERE rowid IN (
+            SELECT p.id FROM produtos p
+            JOIN notas_entrada n ON n.id = p.nota_entrada_id
+            WHERE n.fornecedor_id = new.id
+        );
+    END
+    """
+]
+
+# Vocabulário do índice (termos distintos por coluna) e contador de versão
+# incrementado a cada alteração que muda os textos pesquisáveis. O contador
+# permite que os índices de trigramas em memória saibam quando reconstruir.
+DDL_INDICE_BUSCA += [
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS produtos_fts_vocab USING fts5vocab(produtos_fts, 'col')
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS busca_versao (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        versao INTEGER NOT NULL
+    )
+    """,
+    """
+    INSERT OR IGNORE INTO busca_versao (id, versao) VALUES (1, 0)
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS busca_versao_produtos_insert AFTER INSERT ON produtos BEGIN
+        UPDATE busca_versao SET versao = versao + 1;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS busca_versao_produtos_delete AFTER DELETE ON produtos BEGIN
+        UPDATE busca_versao SET versao = versao + 1;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS busca_versao_produtos_update
+    AFTER UPDATE OF referencia, descricao, nota_entrada_id ON produtos BEGIN
+        UPDATE busca_versao SET versao = versao + 1;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS busca_versao_fornecedores_insert AFTER INSERT ON fornecedores BEGIN
+        UPDATE busca_versao SET versao = versao + 1;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS busca_versao_fornecedores_update
+    AFTER UPDATE OF nome, ativo ON fornecedores BEGIN
+        UPDATE busca_versao SET versao = versao + 1;
+    END
+    """
+]
+
+# Campos que podem ser usados para restringir a busca
+CAMPOS_BUSCA = ("codigo_barras", "referencia", "descricao", "fornecedor")
+
+
+def criar_indice_busca(engine):
+    """Cria o índice de texto completo e os triggers de sincronização, se não existirem"""
+    with engine.begin() as conexao:
+        for comando in DDL_INDICE_BUSCA:
+            conexao.exec_driver_sql(comando)
+
+
+def reconstruir_indice_busca(engine) -> int:
+    """Repopula o índice de texto completo a partir das tabelas de produtos e fornecedores"""
+    with engine.begin() as conexao:
+        conexao.exec_driver_sql("DELETE FROM produtos_fts")
+        conexao.exec_driver_sql("""
+            INSERT INTO produtos_fts (rowid, codigo_barras, referencia, descricao, fornecedor)
+            SELECT p.id, p.codigo_barras, p.referencia, p.descricao, f.nome
+            FROM produtos p
+            JOIN notas_entrada n ON n.id = p.nota_entrada_id
+            JOIN fornecedores f ON f.id = n.fornecedor_id
+        """)
+        return conexao.exec_driver_sql("SELECT count(*) FROM produtos_fts").scalar()
+
+
+def montar_consulta_fts(termo: str, campos: Optional[List[str]] = None,
+                        indice: Optional["IndiceTrigramas"] = None) -> str:
+    """
+    Converte o texto digitado em uma consulta FTS5 com busca por prefixo
+    Cada palavra vira um termo entre aspas com '*', todas obrigatórias (AND)
+    Com um índice de trigramas, cada palavra aceita também os termos
+    parecidos do vocabulário (tolerância a erros de digitação)
+    Retorna string vazia quando o texto não tem palavras pesquisáveis
+    """
+    palavras = palavras_busca(termo)
+    if not palavras:
+        return ""
+
+    termos = []
+    for palavra in palavras:
+        alternativas = [f'"{palavra}"*']
+        if indice is not None:
+            alternativas += [
+                f'"{similar}"' for similar, _ in indice.termos_similares(palavra)
+                if not similar.startswith(palavra)
+            ]
+        termos.append(
+            alternativas[0] if len(alternativas) == 1
+            else "(" + " OR ".join(alternativas) + ")"
+        )
+
+    consulta = " AND ".join(termos)
+
+    if campos:
+        invalidos = [campo for campo in campos if campo not in CAMPOS_BUSCA]
+        if invalidos:
+            raise ValueError(f"Campos de busca inválidos: {', '.join(invalidos)}")
+        consulta = "{" + " ".join(campos) + "} : (" + consulta + ")"
+
+    return consulta
+
+
+def subconsulta_busca(consulta: str):
+    """
+    Subconsulta com os produtos que atendem à consulta FTS5 e sua relevância
+    Colunas: produto_id e rank (bm25, quanto menor mais relevante)
+    O LIMIT -1 impede o SQLite de achatar a subconsulta em consultas
+    agregadas, onde bm25() não pode ser avaliada
+    """
+    return text(
+        "SELECT rowid AS produto_id, bm25(produtos_fts) AS rank "
+        "FROM produtos_fts WHERE produtos_fts MATCH :consulta LIMIT -1"
+    ).bindparams(consulta=consulta).columns(
+        produto_id=Integer,
+        rank=Float
+    ).subquery("busca")
+
+
+# Busca aproximada por trigramas (tolerante a erros de digitação)
+
+# Similaridade mínima (coeficiente de Jaccard dos trigramas) para um termo
+# ser considerado parecido, o mesmo padrão do pg_trgm
+SIMILARIDADE_MINIMA = 0.3
+
+# Quantidade máxima de termos parecidos considerados por palavra
+MAXIMO_TERMOS_SIMILARES = 8
+
+# Palavras menores que isso não são expandidas (poucos trigramas, muito ruído)
+TAMANHO_MINIMO_APROXIMADO = 3
+
+
+def normalizar_texto(texto: str) -> str:
+    """Minúsculas e sem acentos, como o tokenizador do índice FTS5"""
+    decomposto = unicodedata.normalize("NFKD", texto.lower())
+    return "".join(c for c in decomposto if not unicodedata.combining(c))
+
+
+def palavras_busca(texto: str) -> List[str]:
+    """Quebra o texto em palavras normalizadas"""
+    return re.findall(r"\w+", normalizar_texto(texto or ""))
+
+
+def trigramas(palavra: str) -> Set[str]:
+    """Trigramas da palavra com dois espaços no início e um no fim (como o pg_trgm)"""
+    palavra = f"  {palavra} "
+    return {palavra[i:i + 3] for i in range(len(palavra) - 2)}
+
+
+def similaridade(palavra: str, termo: str) -> float:
+    """Similaridade entre duas palavras, de 0 a 1 (prefixo conta como 1)"""
+    if termo.startswith(palavra):
+        return 1.0
+    a, b = trigramas(palavra), trigramas(termo)
+    comuns = len(a & b)
+    return comuns / (len(a) + len(b) - comuns)
+
+
+def similaridade_texto(termo: str, texto: str) -> float:
+    """
+    Média, entre as palavras do termo, da melhor similaridade com alguma
+    palavra do texto. Usada para ordenar resultados da busca aproximada.
+    """
+    palavras = palavras_busca(termo)
+    alvo = palavras_busca(texto)
+    if not palavras or not alvo:
+        return 0.0
+    return sum(max(similaridade(p, t) for t in alvo) for p in palavras) / len(palavras)
+
+
+class IndiceTrigramas:
+    """
+    Índice invertido trigrama -> termos, com os documentos (chaves) de cada termo
+    Encontra termos parecidos contando trigramas em comum, sem percorrer o vocabulário
+    """
+
+    def __init__(self):
+        self._postings: Dict[str, Set[str]] = defaultdict(set)
+        self._tamanhos: Dict[str, int] = {}
+        self._chaves: Dict[str, Set[Hashable]] = defaultdict(set)
+
+    def __len__(self) -> int:
+        return len(self._tamanhos)
+
+    def adicionar(self, texto: str, chave: Hashable = None):
+        """Indexa as palavras do texto, associando-as à chave (se informada)"""
+        for palavra in palavras_busca(texto):
+            if palavra not in self._tamanhos:
+                grams = trigramas(palavra)
+                self._tamanhos[palavra] = len(grams)
+                for gram in grams:
+                    self._postings[gram].add(palavra)
+            if chave is not None:
+                self._chaves[palavra].add(chave)
+
+    def termos_similares(self, palavra: str,
+                         minimo: float = SIMILARIDADE_MINIMA,
+                         maximo: int = MAXIMO_TERMOS_SIMILARES) -> List[Tuple[str, float]]:
+        """Termos do vocabulário parecidos com a palavra, do mais para o menos similar"""
+        palavra = normalizar_texto(palavra)
+        if len(palavra) < TAMANHO_MINIMO_APROXIMADO or palavra.isdigit():
+            return []
+
+        grams = trigramas(palavra)
+        comuns: Dict[str, int] = defaultdict(int)
+        for gram in grams:
+            for termo in self._postings.get(gram, ()):
+                comuns[termo] += 1
+
+        similares = []
+        for termo, quantidade in comuns.items():
+            valor = quantidade / (len(grams) + self._tamanhos[termo] - quantidade)
+            if valor >= minimo:
+                similares.append((termo, valor))
+
+        similares.sort(key=lambda item: (-item[1], item[0]))
+        return similares[:maximo]
+
+    def termos_prefixados(self, palavra: str) -> List[str]:
+        """Termos do vocabulário que começam com a palavra"""
+        palavra = normalizar_texto(palavra)
+        # Um termo com esse prefixo contém todos os trigramas da palavra, menos o final
+        grams = trigramas(palavra) - {f"  {palavra} "[-3:]}
+        candidatos = None
+        for gram in sorted(grams, key=lambda g: len(self._postings.get(g, ()))):
+            termos = self._postings.get(gram, set())
+            candidatos = set(termos) if candidatos is None else candidatos & termos
+            if not candidatos:
+                return []
+        return [termo for termo in candidatos or () if termo.startswith(palavra)]
+
+    def buscar(self, texto: str, minimo: float = SIMILARIDADE_MINIMA) -> List[Tuple[Hashable, float]]:
+        """
+        Chaves cujos textos contêm, para cada palavra buscada, um termo com
+        o mesmo prefixo ou parecido. Ordenadas pela similaridade média.
+        """
+        palavras = palavras_busca(texto)
+        if not palavras:
+            return []
+
+        pontuacao: Optional[Dict[Hashable, float]] = None
+        for palavra in palavras:
+            candidatos = [(termo, 1.0) for termo in self.termos_prefixados(palavra)]
+            candidatos += self.termos_similares(palavra, minimo, maximo=len(self._tamanhos))
+
+            melhores: Dict[Hashable, float] = {}
+            for termo, valor in candidatos:
+                for chave in self._chaves.get(termo, ()):
+                    melhores[chave] = max(valor, melhores.get(chave, 0.0))
+
+            if pontuacao is None:
+                pontuacao = melhores
+            else:
+                pontuacao = {
+                    chave: pontuacao[chave] + valor
+                    for chave, valor in melhores.items() if chave in pontuacao
+                }
+
+        return sorted(
+            ((chave, valor / len(palavras)) for chave, valor in pontuacao.items()),
+            key=lambda item: -item[1]
+        )
+
+
+# Índices em memória compartilhados entre sessões, reconstruídos quando o
+# contador busca_versao muda
+_indices: Dict[str, Tuple[int, IndiceTrigramas]] = {}
+_trava_indices = threading.Lock()
+
+
+def _versao_busca(db) -> int:
+    return db.execute(text("SELECT versao FROM busca_versao WHERE id = 1")).scalar() or 0
+
+
+def _obter_indice(db, nome: str, construir) -> IndiceTrigramas:
+    versao = _versao_busca(db)
+    with _trava_indices:
+        atual = _indices.get(nome)
+        if atual is None or atual[0] != versao:
+            atual = (versao, construir(db))
+            _indices[nome] = atual
+        return atual[1]
+
+
+def _construir_indice_produtos(db) -> IndiceTrigramas:
+    indice = IndiceTrigramas()
+    termos = db.execute(text(
+        "SELECT DISTINCT term FROM produtos_fts_vocab "
+        "WHERE col IN ('referencia', 'descricao', 'fornecedor')"
+    ))
+    for (termo,) in termos:
+        indice.adicionar(termo)
+    return indice
+
+
+def _construir_indice_fornecedores(db) -> IndiceTrigramas:
+    indice = IndiceTrigramas()
+    for fornecedor_id, nome in db.execute(text("SELECT id, nome FROM fornecedores")):
+        indice.adicionar(nome, fornecedor_id)
+    return indice
+
+
+def indice_produtos(db) -> IndiceTrigramas:
+    """Índice de trigramas do vocabulário dos produtos (referência, descrição e fornecedor)"""
+    return _obter_indice(db, "produtos", _construir_indice_produtos)
+
+
+def indice_fornecedores(db) -> IndiceTrigramas:
+    """Índice de trigramas dos nomes dos fornecedores (chave: id do fornecedor)"""
+    return _obter_indice(db, "fornecedores", _construir_indice_fornecedores)
@@ -0,0 +1,95 @@
+# src/utils/cache_produtos.py
+import threading
+from collections import OrderedDict
+from decimal import Decimal
+from typing import Callable, Dict, Iterable, NamedTuple, Optional
+from ..models import StatusProduto
+
+# Quantidade máxima de códigos de barras mantidos em memória
+TAMANHO_MAXIMO_CACHE = 5000
+
+
+class ProdutoCodigo(NamedTuple):
+    """Dados de um produto necessários na leitura do código de barras no caixa"""
+    produto_id: int
+    nota_entrada_id: int
+    valor_unitario: Decimal
+    quantidade_atual: int
+    status: StatusProduto
+    referencia: str
+    tamanho: str
+    descricao: str
+
+
+class CacheCodigoBarras:
+    """
+    Cache LRU limitado de código de barras -> ProdutoCodigo, compartilhado entre
+    as sessões do processo. Só guarda produtos encontrados; as escritas invalidam
+    os códigos alterados depois do commit.
+    """
+
+    def __init__(self, maximo: int = TAMANHO_MAXIMO_CACHE):
+        self.maximo = maximo
+        self._itens: "OrderedDict[str, ProdutoCodigo]" = OrderedDict()
+        self._trava = threading.Lock()
+        # Incrementada a cada invalidação: uma leitura do banco iniciada antes
+        # de uma invalidação não pode repopular o cache com o valor antigo
+        self._geracao = 0
+        self._acertos = 0
+        self._faltas = 0
+        self._invalidacoes = 0
+
+    def obter(self, codigo_barras: str,
+              carregar: Callable[[str], Optional[ProdutoCodigo]]) -> Optional[ProdutoCodigo]:
+        """Retorna o produto do cache ou carrega do banco (e guarda) na falta"""
+        with self._trava:
+            item = self._itens.get(codigo_barras)
+            if item is not None:
+                self._itens.move_to_end(codigo_barras)
+                self._acertos += 1
+                return item
+            self._faltas += 1
+            geracao = self._geracao
+
+        item = carregar(codigo_barras)
+
+        if item is not None:
+            with self._trava:
+                if geracao == self._geracao:
+                    self._itens[codigo_barras] = item
+                    self._itens.move_to_end(codigo_barras)
+                    while len(self._itens) > self.maximo:
+                        self._itens.popitem(last=False)
+        return item
+
+    def invalidar(self, codigos_barras: Iterable[str]):
+        """Remove os códigos informados do cache"""
+        with self._trava:
+            self._geracao += 1
+            for codigo in codigos_barras:
+                if self._itens.pop(codigo, None) is not None:
+                    self._invalidacoes += 1
+
+    def limpar(self):
+        """Esvazia o cache (mantém as métricas)"""
+        with self._trava:
+            self._geracao += 1
+            self._invalidacoes += len(self._itens)
+            self._itens.clear()
+
+    def metricas(self) -> Dict:
+        """Métricas de uso do cache"""
+        with self._trava:
+            consultas = self._acertos + self._faltas
+            return {
+                "itens": len(self._itens),
+                "maximo": self.maximo,
+                "acertos": self._acertos,
+                "faltas": self._faltas,
+                "taxa_acerto": self._acertos / consultas if consultas else 0.0,
+                "invalidacoes": self._invalidacoes
+            }
+
+
+# Instância única do processo (compartilhada entre as sessões do Streamlit)
+cache_codigos = CacheCodigoBarras()
@@ -1,8 +1,14 @@
 # src/utils/database.py
 import bcrypt
+from typing import Optional
 from sqlalchemy.orm import Session
 from sqlalchemy import inspect
-from ..models import create_tables, get_db, Usuario, TipoUsuario, LogAcao, TipoAcao
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.schema import CreateColumn
+from ..models import Base, create_tables, get_db, Usuario, TipoUsuario, LogAcao, TipoAcao
+from .busca import criar_indice_busca, reconstruir_indice_busca
+from .fifo import criar_gatilhos_fifo, preencher_chaves_fifo
+from .alteracoes import criar_gatilhos_alteracoes, preencher_alteracoes
 
 
 def hash_senha(senha: str) -> str:
@@ -20,11 +26,41 @@ def verificar_senha(senha: str, hash_senha: str) -> bool:
     return bcrypt.checkpw(senha_bytes, hash_bytes)
 
 
+def iniciar_transacao_escrita(db: Session, espera_ms: Optional[int] = None):
+    """
+    Abre a transação da sessão já com o bloqueio de escrita (BEGIN IMMEDIATE no SQLite)
+    Assim a leitura do estoque e a baixa acontecem sem outro escritor no meio.
+    Não faz nada se a sessão já tiver uma transação de escrita aberta.
+    espera_ms: tempo máximo de espera pelo bloqueio, só para este BEGIN
+    (o padrão da conexão é restaurado em seguida)
+    """
+    conexao = db.connection()
+    if conexao.dialect.name != "sqlite":
+        return
+    if not conexao.connection.dbapi_connection.in_transaction:
+        if espera_ms is None:
+            conexao.exec_driver_sql("BEGIN IMMEDIATE")
+            return
+        espera_padrao = conexao.exec_driver_sql("PRAGMA busy_timeout").scalar()
+        conexao.exec_driver_sql(f"PRAGMA busy_timeout = {int(espera_ms)}")
+        try:
+            conexao.exec_driver_sql("BEGIN IMMEDIATE")
+        finally:
+            conexao.exec_driver_sql(f"PRAGMA busy_timeout = {espera_padrao}")
+
+
+def banco_bloqueado(erro: Exception) -> bool:
+    """Indica se o erro é o banco bloqueado por outro escritor (database is locked)"""
+    return isinstance(erro, OperationalError) and "locked" in str(erro.orig)
+
+
 def verificar_tabelas_existem(engine):
     """Verifica se todas as tabelas foram criadas"""
     inspector = inspect(engine)
     tabelas_esperadas = ['usuarios', 'log_acoes', 'fornecedores', 'notas_entrada',
-                         'produtos', 'vendas', 'itens_venda']
+                         'produtos', 'vendas', 'itens_venda', 'estoque_resumo',
+                         'exportacao_marcas', 'vendas_diarias', 'importacoes',
+                         'importacoes_erros']
     tabelas_existentes = inspector.get_table_names()
 
     for tabela in tabelas_esperadas:
@@ -33,6 +69,32 @@ def verificar_tabelas_existem(engine):
     return True
 
 
+def criar_indices_faltantes(engine):
+    """Cria índices declarados nos modelos que ainda não existem em tabelas já criadas"""
+    for tabela in Base.metadata.sorted_tables:
+        for indice in tabela.indexes:
+            indice.create(bind=engine, checkfirst=True)
+
+
+def criar_colunas_faltantes(engine) -> list:
+    """
+    Adiciona às tabelas já existentes as colunas novas declaradas nos modelos
+    (o create_all não altera tabelas existentes). As colunas novas precisam
+    aceitar nulo ou ter server_default. Retorna [(tabela, coluna)] adicionadas.
+    """
+    inspector = inspect(engine)
+    adicionadas = []
+    with engine.begin() as conexao:
+        for tabela in Base.metadata.sorted_tables:
+            existentes = {coluna['name'] for coluna in inspector.get_columns(tabela.name)}
+            for coluna in tabela.columns:
+                if coluna.name not in existentes:
+                    definicao = CreateColumn(coluna).compile(dialect=engine.dialect)
+                    conexao.exec_driver_sql(f"ALTER TABLE {tabela.name} ADD COLUMN {definicao}")
+                    adicionadas.append((tabela.name, coluna.name))
+    return adicionadas
+
+
 def criar_usuario_admin(db: Session, login: str, senha: str, nome: str):
     """Cria um usuário administrador se ele não existir"""
     try:
@@ -85,6 +147,22 @@ def inicializar_banco():
 
         print("Tabelas criadas com sucesso!")
 
+        # Bancos existentes não recebem as colunas e índices novos pelo create_all
+        colunas_novas = criar_colunas_faltantes(engine)
+        criar_indices_faltantes(engine)
+
+        # Índice de texto completo (FTS5) para a busca de produtos
+        criar_indice_busca(engine)
+        print(f"Índice de busca reconstruído: {reconstruir_indice_busca(engine)} produtos")
+
+        # Chave de ordenação FIFO dos produtos (triggers e preenchimento das faltantes)
+        criar_gatilhos_fifo(engine)
+        print(f"Chaves FIFO preenchidas: {preencher_chaves_fifo(engine)} produtos")
+
+        # Sequência de alterações da exportação incremental (triggers e linhas antigas)
+        criar_gatilhos_alteracoes(engine)
+        print(f"Alterações numeradas: {preencher_alteracoes(engine)} linhas")
+
         # Cria usuário admin
         print("Iniciando criação do usuário administrador...")
         db = next(get_db())
@@ -95,6 +173,24 @@ def inicializar_banco():
             nome="Administrador"
         )
 
+        # Sincroniza o resumo materializado do estoque com os produtos
+        print("Reconstruindo resumo do estoque...")
+        from ..controllers.estoque_resumo import EstoqueResumoController
+        grupos = EstoqueResumoController(db).reconstruir()
+        print(f"Resumo do estoque reconstruído: {grupos} grupos")
+
+        # Totais desnormalizados das vendas recém-criados precisam ser preenchidos
+        if ('vendas', 'quantidade_itens') in colunas_novas:
+            from ..controllers.venda import VendaController
+            corrigidas = VendaController(db).verificar_totais_vendas(corrigir=True)
+            print(f"Totais de vendas preenchidos: {len(corrigidas)} vendas")
+
+        # Sincroniza os totais diários com as vendas finalizadas
+        print("Reconstruindo vendas diárias...")
+        from ..controllers.vendas_diarias import VendasDiariasController
+        dias = VendasDiariasController(db).reconstruir()
+        print(f"Vendas diárias reconstruídas: {dias} linhas")
+
         print("\nInicialização do banco de dados concluída com sucesso!")
         print("\nDados de acesso do administrador:")
         print("Login: admin")
@@ -0,0 +1,50 @@
+# src/utils/fifo.py
+
+# Chave de ordenação FIFO gravada em produtos.fifo_key, mantida por triggers.
+# Concatena data de emissão da nota, data de registro do produto e id em
+# larguras fixas, para que a ordem do texto seja a ordem FIFO
+# (NotaEntrada.data_emissao, Produto.data_registro, Produto.id).
+EXPRESSAO_CHAVE_FIFO = """
+    (SELECT strftime('%Y%m%d%H%M%f', n.data_emissao)
+     FROM notas_entrada n WHERE n.id = produtos.nota_entrada_id)
+    || coalesce(strftime('%Y%m%d%H%M%f', produtos.data_registro), '000000000000000000')
+    || printf('%010d', produtos.id)
+"""
+
+DDL_CHAVE_FIFO = [
+    f"""
+    CREATE TRIGGER IF NOT EXISTS produtos_fifo_insert AFTER INSERT ON produtos BEGIN
+        UPDATE produtos SET fifo_key = {EXPRESSAO_CHAVE_FIFO} WHERE id = new.id;
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS produtos_fifo_update
+    AFTER UPDATE OF nota_entrada_id, data_registro ON produtos BEGIN
+        UPDATE produtos SET fifo_key = {EXPRESSAO_CHAVE_FIFO} WHERE id = new.id;
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS notas_fifo_update AFTER UPDATE OF data_emissao ON notas_entrada BEGIN
+        UPDATE produtos SET fifo_key = {EXPRESSAO_CHAVE_FIFO} WHERE nota_entrada_id = new.id;
+    END
+    """
+]
+
+
+def criar_gatilhos_fifo(engine):
+    """Cria os triggers que mantêm produtos.fifo_key, se não existirem"""
+    with engine.begin() as conexao:
+        for comando in DDL_CHAVE_FIFO:
+            conexao.exec_driver_sql(comando)
+
+
+def preencher_chaves_fifo(engine, todas: bool = False) -> int:
+    """
+    Calcula fifo_key dos produtos sem chave (ou de todos, com todas=True)
+    Retorna a quantidade de produtos atualizados
+    """
+    filtro = "" if todas else "WHERE fifo_key IS NULL"
+    with engine.begin() as conexao:
+        return conexao.exec_driver_sql(
+            f"UPDATE produtos SET fifo_key = {EXPRESSAO_CHAVE_FIFO} {filtro}"
+        ).rowcount
@@ -0,0 +1,116 @@
+# src/utils/planilhas.py
+import hashlib
+import os
+import shutil
+import tempfile
+from typing import BinaryIO, Dict, Iterator, Optional
+import pandas as pd
+from openpyxl import load_workbook
+from .validators import coluna_numero, verificar_colunas_importacao, validar_blocos_paralelo
+
+# Linhas lidas por vez das planilhas de fornecedores
+TAMANHO_BLOCO_PLANILHA = 5000
+
+# Linhas exibidas na prévia da importação
+LINHAS_PREVIA = 5
+
+# Tamanho dos pedaços copiados do upload para o disco
+TAMANHO_COPIA = 1024 * 1024
+
+# Colunas de texto lidas como texto (mantém zeros à esquerda dos códigos)
+COLUNAS_TEXTO_PLANILHA = ['codigo_barras', 'referencia', 'descricao', 'tamanho']
+
+
+def salvar_upload(arquivo: BinaryIO, nome: str) -> str:
+    """
+    Copia o arquivo enviado, em pedaços, para um arquivo temporário em disco
+    Retorna o caminho do temporário (quem chama deve removê-lo)
+    """
+    arquivo.seek(0)
+    with tempfile.NamedTemporaryFile(suffix=os.path.splitext(nome)[1].lower(),
+                                     delete=False) as destino:
+        shutil.copyfileobj(arquivo, destino, TAMANHO_COPIA)
+    return destino.name
+
+
+def _blocos_xlsx(caminho: str, tamanho_bloco: int) -> Iterator[pd.DataFrame]:
+    """Lê a primeira planilha do arquivo linha a linha (modo somente leitura)"""
+    pasta = load_workbook(caminho, read_only=True, data_only=True)
+    try:
+        linhas = pasta.worksheets[0].iter_rows(values_only=True)
+        cabecalho = next(linhas, None)
+        if cabecalho is None:
+            return
+        colunas = [str(coluna).strip() if coluna is not None else f"coluna_{i}"
+                   for i, coluna in enumerate(cabecalho)]
+
+        bloco = []
+        for linha in linhas:
+            # Linhas totalmente vazias (formatação no fim da planilha) são ignoradas
+            if all(valor is None for valor in linha):
+                continue
+            bloco.append(linha)
+            if len(bloco) == tamanho_bloco:
+                yield pd.DataFrame(bloco, columns=colunas)
+                bloco = []
+        if bloco:
+            yield pd.DataFrame(bloco, columns=colunas)
+    finally:
+        pasta.close()
+
+
+def ler_planilha_em_blocos(caminho: str,
+                           tamanho_bloco: int = TAMANHO_BLOCO_PLANILHA) -> Iterator[pd.DataFrame]:
+    """
+    Lê uma planilha CSV ou XLSX em blocos de até tamanho_bloco linhas
+    Só um bloco fica em memória por vez
+    """
+    if caminho.lower().endswith('.csv'):
+        with pd.read_csv(caminho, chunksize=tamanho_bloco,
+                         dtype={coluna: "string" for coluna in COLUNAS_TEXTO_PLANILHA}) as leitor:
+            yield from leitor
+    else:
+        yield from _blocos_xlsx(caminho, tamanho_bloco)
+
+
+def resumir_planilha(caminho: str, tamanho_bloco: int = TAMANHO_BLOCO_PLANILHA) -> Dict:
+    """
+    Prévia e totais da planilha de produtos, calculados bloco a bloco
+    Retorna {'previa', 'total_produtos', 'total_pecas', 'valor_total'}
+    """
+    resumo = {"previa": None, "total_produtos": 0, "total_pecas": 0, "valor_total": 0.0}
+    for bloco in ler_planilha_em_blocos(caminho, tamanho_bloco):
+        if resumo['previa'] is None:
+            verificar_colunas_importacao(bloco.columns)
+            resumo['previa'] = bloco.head(LINHAS_PREVIA)
+
+        quantidade = coluna_numero(bloco['quantidade'])
+        resumo['total_produtos'] += len(bloco)
+        resumo['total_pecas'] += int(quantidade.sum())
+        resumo['valor_total'] += float((coluna_numero(bloco['valor_unitario']) * quantidade).sum())
+
+    if resumo['previa'] is None:
+        raise ValueError("Arquivo sem linhas de produtos")
+    return resumo
+
+
+def validar_planilha(caminho: str,
+                     processos: Optional[int] = None,
+                     tamanho_bloco: int = TAMANHO_BLOCO_PLANILHA) -> Dict:
+    """
+    Relatório de validação da planilha de produtos, antes de qualquer gravação
+    Os blocos são validados em paralelo (validar_blocos_paralelo); códigos já
+    cadastrados no banco só são conferidos na importação
+    """
+    return validar_blocos_paralelo(
+        ler_planilha_em_blocos(caminho, tamanho_bloco), processos=processos
+    )
+
+
+def hash_arquivo(caminho: str) -> str:
+    """SHA-256 do conteúdo do arquivo, lido em pedaços"""
+    resumo = hashlib.sha256()
+    with open(caminho, "rb") as entrada:
+        for pedaco in iter(lambda: entrada.read(TAMANHO_COPIA), b""):
+            resumo.update(pedaco)
+    return resumo.hexdigest()
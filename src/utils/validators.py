@@ -0,0 +1,226 @@
+# src/utils/validators.py
+import multiprocessing
+import os
+from collections import deque
+from itertools import chain, islice
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterable, List, Optional, Tuple
+import numpy as np
+import pandas as pd
+
+# Colunas obrigatórias da planilha de produtos de uma nota de entrada
+COLUNAS_IMPORTACAO_PRODUTOS = [
+    'codigo_barras', 'referencia', 'descricao',
+    'tamanho', 'valor_unitario', 'quantidade'
+]
+
+TAMANHOS_VALIDOS = ["P", "M", "G", "GG", "U"]
+
+# Tamanhos máximos das colunas de texto em produtos
+LIMITES_TEXTO_PRODUTO = {'codigo_barras': 50, 'referencia': 50, 'descricao': 200}
+
+# Faixas aceitas por linha da planilha
+VALOR_UNITARIO_MAXIMO = 100000
+QUANTIDADE_MAXIMA = 10000
+
+# Códigos só com dígitos nestes tamanhos são GTIN (EAN-8, UPC-A, EAN-13, GTIN-14)
+# e precisam ter o dígito verificador correto; os demais são códigos internos
+TAMANHOS_GTIN = [8, 12, 13, 14]
+
+# Colunas do relatório de erros da validação
+COLUNAS_RELATORIO_ERROS = ['linha', 'codigo_barras', 'campo', 'erro']
+
+# Blocos a partir dos quais a validação usa o pool de processos (abaixo disso,
+# iniciar os processos custa mais que validar no próprio processo)
+BLOCOS_MINIMOS_PARALELO = 10
+
+
+def _coluna_texto(serie: pd.Series) -> pd.Series:
+    """Texto sem espaços nas pontas; números inteiros lidos como float perdem o '.0'"""
+    if pd.api.types.is_float_dtype(serie) and (serie.dropna() % 1 == 0).all():
+        serie = serie.astype("Int64")
+    return serie.astype("string").str.strip().replace("", pd.NA)
+
+
+def coluna_numero(serie: pd.Series) -> pd.Series:
+    """Números da planilha, aceitando vírgula decimal em colunas de texto"""
+    if not pd.api.types.is_numeric_dtype(serie):
+        serie = serie.astype("string").str.strip().str.replace(",", ".", regex=False)
+    return pd.to_numeric(serie, errors="coerce")
+
+
+def gtin_invalido(codigos: pd.Series) -> pd.Series:
+    """
+    Marca os códigos GTIN (só dígitos, 8/12/13/14 posições) com dígito verificador errado
+    Os códigos são completados com zeros à esquerda até 14 posições e conferidos
+    de uma vez, como matriz de dígitos (pesos 3 e 1 alternados a partir da esquerda)
+    """
+    codigos = codigos.astype("string")
+    gtin = (codigos.str.fullmatch(r"\d+") & codigos.str.len().isin(TAMANHOS_GTIN)).fillna(False)
+    invalido = pd.Series(False, index=codigos.index)
+    if not gtin.any():
+        return invalido
+
+    texto = "".join(codigos[gtin].str.zfill(14).tolist()).encode("ascii")
+    digitos = (np.frombuffer(texto, dtype=np.uint8) - ord("0")).reshape(-1, 14).astype(np.int64)
+    pesos = np.tile([3, 1], 7)[:13]
+    verificador = (10 - (digitos[:, :13] @ pesos) % 10) % 10
+    invalido[gtin] = verificador != digitos[:, 13]
+    return invalido
+
+
+def normalizar_referencia(referencias: pd.Series) -> pd.Series:
+    """Referência em maiúsculas, com espaços internos repetidos reduzidos a um"""
+    return referencias.str.upper().str.replace(r"\s+", " ", regex=True)
+
+
+def verificar_colunas_importacao(colunas: Iterable[str]):
+    """Levanta ValueError se faltar alguma coluna obrigatória da planilha de produtos"""
+    colunas = set(colunas)
+    faltantes = [coluna for coluna in COLUNAS_IMPORTACAO_PRODUTOS if coluna not in colunas]
+    if faltantes:
+        raise ValueError(f"Colunas faltantes no arquivo: {', '.join(faltantes)}")
+
+
+def validar_produtos_importacao(tabela: pd.DataFrame,
+                                primeira_linha: int = 2) -> Tuple[pd.DataFrame, List[Dict]]:
+    """
+    Valida e normaliza de uma vez (operações por coluna) as linhas de produtos
+    Retorna as linhas válidas normalizadas e a lista de erros
+    [{linha, codigo_barras, campo, erro}], uma entrada por regra violada.
+    primeira_linha: número da primeira linha de dados no arquivo (para o relatório)
+    """
+    verificar_colunas_importacao(tabela.columns)
+
+    tabela = tabela.reset_index(drop=True)
+    dados = pd.DataFrame({
+        'codigo_barras': _coluna_texto(tabela['codigo_barras']),
+        'referencia': normalizar_referencia(_coluna_texto(tabela['referencia'])),
+        'descricao': _coluna_texto(tabela['descricao']),
+        'tamanho': _coluna_texto(tabela['tamanho']).str.upper(),
+        'valor_unitario': coluna_numero(tabela['valor_unitario']).round(2),
+        'quantidade': coluna_numero(tabela['quantidade'])
+    })
+
+    regras = [
+        (dados['codigo_barras'].isna(), 'codigo_barras', "Código de barras obrigatório"),
+        (gtin_invalido(dados['codigo_barras']), 'codigo_barras',
+         "Dígito verificador do código de barras (GTIN) inválido"),
+        (dados['referencia'].isna(), 'referencia', "Referência obrigatória"),
+        (dados['descricao'].isna(), 'descricao', "Descrição obrigatória"),
+        (~dados['tamanho'].isin(TAMANHOS_VALIDOS), 'tamanho',
+         f"Tamanho inválido (use {', '.join(TAMANHOS_VALIDOS)})"),
+        (dados['valor_unitario'].isna() | (dados['valor_unitario'] <= 0), 'valor_unitario',
+         "Valor unitário inválido"),
+        (dados['valor_unitario'] > VALOR_UNITARIO_MAXIMO, 'valor_unitario',
+         f"Valor unitário acima de R$ {VALOR_UNITARIO_MAXIMO:,.2f}"),
+        (dados['quantidade'].isna() | (dados['quantidade'] <= 0) | (dados['quantidade'] % 1 != 0),
+         'quantidade', "Quantidade inválida"),
+        (dados['quantidade'] > QUANTIDADE_MAXIMA, 'quantidade',
+         f"Quantidade acima de {QUANTIDADE_MAXIMA}"),
+        (dados['codigo_barras'].notna() & dados['codigo_barras'].duplicated(keep='first'),
+         'codigo_barras', "Código de barras repetido no arquivo"),
+    ]
+    regras += [
+        (dados[coluna].str.len() > limite, coluna, f"Texto maior que {limite} caracteres")
+        for coluna, limite in LIMITES_TEXTO_PRODUTO.items()
+    ]
+
+    erros = []
+    invalidas = np.zeros(len(dados), dtype=bool)
+    for mascara, campo, mensagem in regras:
+        mascara = mascara.fillna(False).to_numpy(dtype=bool)
+        invalidas |= mascara
+        for posicao in np.flatnonzero(mascara):
+            codigo = dados['codigo_barras'].iat[posicao]
+            erros.append({
+                "linha": primeira_linha + int(posicao),
+                "codigo_barras": None if pd.isna(codigo) else str(codigo),
+                "campo": campo,
+                "erro": mensagem
+            })
+
+    erros.sort(key=lambda erro: erro['linha'])
+    validos = dados[~invalidas].copy()
+    validos['quantidade'] = validos['quantidade'].astype(int)
+    validos['linha'] = primeira_linha + np.flatnonzero(~invalidas)
+    return validos, erros
+
+
+def _validar_bloco_relatorio(tabela: pd.DataFrame,
+                             primeira_linha: int) -> Tuple[Dict[str, list], List[int], List[str]]:
+    """
+    Valida um bloco (executado nos processos do pool)
+    Retorna os erros em colunas e as linhas e códigos das linhas válidas
+    """
+    validos, erros = validar_produtos_importacao(tabela, primeira_linha)
+    return (
+        {coluna: [erro[coluna] for erro in erros] for coluna in COLUNAS_RELATORIO_ERROS},
+        validos['linha'].tolist(),
+        validos['codigo_barras'].astype(object).tolist()
+    )
+
+
+def validar_blocos_paralelo(blocos: Iterable[pd.DataFrame],
+                            primeira_linha: int = 2,
+                            processos: Optional[int] = None) -> Dict:
+    """
+    Valida os blocos de uma planilha em um pool de processos (um por núcleo),
+    sem acessar o banco, e junta o resultado em um relatório em colunas
+    Códigos repetidos em blocos diferentes são acusados na junção, na ordem do
+    arquivo. Só alguns blocos por processo ficam em espera, para não carregar o
+    arquivo inteiro; com um processo (ou poucos blocos) a validação roda aqui mesmo.
+    Retorna {'total_linhas', 'linhas_invalidas',
+             'erros': {'linha': [...], 'codigo_barras': [...], 'campo': [...], 'erro': [...]}}
+    """
+    processos = processos or os.cpu_count() or 1
+    relatorio = {coluna: [] for coluna in COLUNAS_RELATORIO_ERROS}
+    codigos_arquivo = set()
+    total_linhas = 0
+
+    def juntar(resultado: Tuple[Dict[str, list], List[int], List[str]]):
+        erros, linhas, codigos = resultado
+        for coluna in COLUNAS_RELATORIO_ERROS:
+            relatorio[coluna].extend(erros[coluna])
+        for linha, codigo in zip(linhas, codigos):
+            if codigo in codigos_arquivo:
+                relatorio['linha'].append(linha)
+                relatorio['codigo_barras'].append(codigo)
+                relatorio['campo'].append('codigo_barras')
+                relatorio['erro'].append("Código de barras repetido no arquivo")
+            else:
+                codigos_arquivo.add(codigo)
+
+    # Os primeiros blocos dizem se o arquivo é grande o bastante para o pool
+    blocos = iter(blocos)
+    iniciais = list(islice(blocos, BLOCOS_MINIMOS_PARALELO))
+    blocos = chain(iniciais, blocos)
+
+    if processos == 1 or len(iniciais) < BLOCOS_MINIMOS_PARALELO:
+        for tabela in blocos:
+            juntar(_validar_bloco_relatorio(tabela, primeira_linha + total_linhas))
+            total_linhas += len(tabela)
+    else:
+        # spawn: o servidor do Streamlit tem várias threads, e fork copiaria travas em uso
+        with ProcessPoolExecutor(max_workers=processos,
+                                 mp_context=multiprocessing.get_context("spawn")) as pool:
+            pendentes = deque()
+            for tabela in blocos:
+                pendentes.append(pool.submit(
+                    _validar_bloco_relatorio, tabela, primeira_linha + total_linhas
+                ))
+                total_linhas += len(tabela)
+                # Limita os blocos em espera (memória constante)
+                if len(pendentes) >= 2 * processos:
+                    juntar(pendentes.popleft().result())
+            while pendentes:
+                juntar(pendentes.popleft().result())
+
+    # Ordena o relatório pela linha do arquivo
+    ordem = sorted(range(len(relatorio['linha'])), key=relatorio['linha'].__getitem__)
+    relatorio = {coluna: [valores[i] for i in ordem] for coluna, valores in relatorio.items()}
+    return {
+        "total_linhas": total_linhas,
+        "linhas_invalidas": len(set(relatorio['linha'])),
+        "erros": relatorio
+    }
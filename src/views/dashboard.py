@@ -8,6 +8,12 @@ from src.controllers.venda import VendaController
 from src.controllers.estoque import EstoqueController
 from src.controllers.fornecedor import FornecedorController
 
+# Faixas de antiguidade (em dias) da análise detalhada do usuário master
+FAIXAS_ANALISE_DETALHADA = [15, 30, 60, 90, 180]
+
+# Intervalos do gráfico de vendas (granularidade de VendaController.serie_temporal)
+GRANULARIDADES_GRAFICO = {"hora": "Hora", "dia": "Dia", "semana": "Semana"}
+
 
 def formatar_valor(valor: float) -> str:
     """Formata valores monetários"""
@@ -19,6 +25,16 @@ def formatar_percentual(valor: float) -> str:
     return f"{valor:.1f}%"
 
 
+def formatar_faixa(faixa: str) -> str:
+    """Formata a chave de uma faixa de antiguidade (ex: 30_60_dias -> 30-60 dias)"""
+    partes = faixa.split("_")
+    if partes[0] == "ate":
+        return f"Até {partes[1]} dias"
+    if partes[0] == "mais":
+        return f"Mais de {partes[1]} dias"
+    return f"{partes[0]}-{partes[1]} dias"
+
+
 def mostrar_kpis():
     """Exibe os KPIs principais em um layout responsivo"""
     try:
@@ -40,14 +56,13 @@ def mostrar_kpis():
                 valor_vendas = resumo_vendas.get('valor_total', 0)
                 qtd_vendas = resumo_vendas.get('total_vendas', 0)
 
-                # Calcula variação com dia anterior (exemplo)
-                # TODO: Implementar lógica real de comparação
-                variacao = 5.2  # Exemplo
+                # Variação do valor em relação ao dia anterior (None sem vendas ontem)
+                variacao = resumo_vendas.get('variacao_valor')
 
                 st.metric(
                     label="Total de Vendas",
                     value=formatar_valor(valor_vendas),
-                    delta=formatar_percentual(variacao),
+                    delta=formatar_percentual(variacao) if variacao is not None else None,
                     help="Comparação com o dia anterior"
                 )
                 st.caption(f"Total de {qtd_vendas} vendas realizadas hoje")
@@ -87,7 +102,7 @@ def mostrar_kpis():
             # KPI de Giro de Estoque
             with col4:
                 st.markdown("### 🔄 Giro de Estoque")
-                produtos_parados = len(estoque_controller.produtos_sem_movimento(30))
+                produtos_parados = estoque_controller.contar_produtos_sem_movimento(30)
 
                 st.metric(
                     label="Produtos sem Movimento",
@@ -122,30 +137,50 @@ def mostrar_grafico_vendas():
             index=0
         )
 
+        col_granularidade, col_detalhe = st.columns(2)
+        with col_granularidade:
+            granularidade = st.selectbox(
+                "Agrupar por",
+                options=list(GRANULARIDADES_GRAFICO.keys()),
+                index=1,
+                format_func=lambda chave: GRANULARIDADES_GRAFICO[chave]
+            )
+        with col_detalhe:
+            por_pagamento = st.checkbox("Separar por forma de pagamento")
+
         dias = periodos[periodo_selecionado]
         data_fim = datetime.now()
-        data_inicio = data_fim - timedelta(days=dias)
+        data_inicio = (data_fim - timedelta(days=dias - 1)).replace(
+            hour=0, minute=0, second=0, microsecond=0
+        )
 
-        vendas = venda_controller.relatorio_vendas_periodo(data_inicio, data_fim)
+        # Um ponto por intervalo (e por forma de pagamento), agregado no banco
+        serie = venda_controller.serie_temporal(
+            data_inicio,
+            data_fim,
+            granularidade=granularidade,
+            agrupar_por="forma_pagamento" if por_pagamento else None
+        )
 
-        if vendas:
-            # Prepara dados
-            datas = [venda['data_hora'].strftime('%d/%m') for venda in vendas]
-            valores = [venda['valor_total'] for venda in vendas]
+        if any(ponto['total_vendas'] for ponto in serie):
+            formato_data = '%d/%m %Hh' if granularidade == "hora" else '%d/%m'
 
-            # Cria gráfico com Plotly
+            # Cria gráfico com Plotly (uma linha por forma de pagamento, se separado)
             fig = go.Figure()
-            fig.add_trace(go.Scatter(
-                x=datas,
-                y=valores,
-                mode='lines+markers',
-                name='Vendas',
-                line=dict(color='#2E86C1', width=2),
-                marker=dict(size=8),
-                hovertemplate="Data: %{x}<br>" +
-                              "Valor: R$ %{y:.2f}<br>" +
-                              "<extra></extra>"
-            ))
+            series = {}
+            for ponto in serie:
+                series.setdefault(ponto.get('forma_pagamento') or 'Vendas', []).append(ponto)
+            for nome, pontos in series.items():
+                fig.add_trace(go.Scatter(
+                    x=[ponto['periodo'].strftime(formato_data) for ponto in pontos],
+                    y=[ponto['valor_total'] for ponto in pontos],
+                    mode='lines+markers',
+                    name=nome,
+                    marker=dict(size=8),
+                    hovertemplate="Data: %{x}<br>" +
+                                  "Valor: R$ %{y:.2f}<br>" +
+                                  "<extra></extra>"
+                ))
 
             # Layout
             fig.update_layout(
@@ -161,8 +196,8 @@ def mostrar_grafico_vendas():
             st.plotly_chart(fig, use_container_width=True)
 
             # Resumo do período
-            total_periodo = sum(valores)
-            media_diaria = total_periodo / len(valores)
+            total_periodo = sum(ponto['valor_total'] for ponto in serie)
+            media_diaria = total_periodo / dias
 
             col1, col2 = st.columns(2)
             col1.metric("Total no Período", formatar_valor(total_periodo))
@@ -256,23 +291,14 @@ def mostrar_analise_detalhada():
         db = next(get_db())
         estoque_controller = EstoqueController(db)
 
-        # Análise por antiguidade em gráfico de pizza
-        analise = estoque_controller.analise_estoque_antiguidade()
+        # Análise por antiguidade em gráfico de pizza (faixas detalhadas)
+        analise = estoque_controller.analise_estoque_antiguidade(
+            faixas=FAIXAS_ANALISE_DETALHADA
+        )
 
         if analise:
-            labels = [
-                "Até 30 dias",
-                "30-60 dias",
-                "60-90 dias",
-                "Mais de 90 dias"
-            ]
-
-            valores = [
-                analise['ate_30_dias']['valor_total'],
-                analise['30_60_dias']['valor_total'],
-                analise['60_90_dias']['valor_total'],
-                analise['mais_90_dias']['valor_total']
-            ]
+            labels = [formatar_faixa(faixa) for faixa in analise]
+            valores = [dados['valor_total'] for dados in analise.values()]
 
             fig = go.Figure(data=[go.Pie(
                 labels=labels,
@@ -295,7 +321,7 @@ def mostrar_analise_detalhada():
             dados_tabela = []
             for periodo, dados in analise.items():
                 dados_tabela.append({
-                    "Período": periodo.replace("_", " ").title(),
+                    "Período": formatar_faixa(periodo),
                     "Total Produtos": dados['total_produtos'],
                     "Total Peças": dados['total_pecas'],
                     "Valor Total": formatar_valor(dados['valor_total'])
@@ -1,13 +1,31 @@
 # src/views/entrada_produtos.py
+import os
 import time
 import streamlit as st
 from datetime import datetime
-import pandas as pd
 from src.models import get_db
 from src.controllers.fornecedor import FornecedorController
 from src.controllers.nota_entrada import NotaEntradaController
+from src.controllers.importacao import ImportacaoController, acordar_processador_importacoes
 from src.views.fornecedores import formatar_cnpj
 from src.utils.pdf_generator import gerar_pdf_nota
+from src.utils.planilhas import salvar_upload, resumir_planilha, validar_planilha, hash_arquivo
+
+
+# Situação das importações em segundo plano, como exibida na tela
+STATUS_IMPORTACAO = {
+    "pendente": "⏳ Aguardando",
+    "em_andamento": "🔄 Em andamento",
+    "concluida": "✅ Concluída",
+    "erro": "❌ Erro"
+}
+
+# Importações e erros por importação listados na tela
+IMPORTACOES_EXIBIDAS = 5
+ERROS_EXIBIDOS = 1000
+
+# Intervalo (segundos) de atualização do progresso enquanto há importação ativa
+INTERVALO_PROGRESSO_IMPORTACAO = 2
 
 
 def selecionar_fornecedor():
@@ -279,6 +297,138 @@ def adicionar_produtos_manual(nota_id: int):
     return False
 
 
+def descartar_planilha():
+    """Remove o arquivo temporário da planilha em importação"""
+    planilha = st.session_state.pop('planilha_importacao', None)
+    if planilha and os.path.exists(planilha['caminho']):
+        os.remove(planilha['caminho'])
+
+
+def preparar_planilha(uploaded_file, nota_id: int) -> dict:
+    """
+    Copia o upload para o disco, calcula prévia e totais em blocos e valida
+    as linhas (em paralelo) antes de qualquer gravação
+    Se o mesmo arquivo (pelo hash do conteúdo) já foi importado para a nota,
+    não valida de novo: 'importacao' traz a importação existente
+    Guardado na sessão para não reler o arquivo a cada interação
+    """
+    chave = (nota_id, uploaded_file.name, uploaded_file.size)
+    planilha = st.session_state.get('planilha_importacao')
+    if planilha and planilha['chave'] == chave:
+        return planilha
+
+    descartar_planilha()
+    caminho = salvar_upload(uploaded_file, uploaded_file.name)
+    try:
+        db = next(get_db())
+        try:
+            importacao_controller = ImportacaoController(db)
+            existente = importacao_controller.buscar_importacao_arquivo(
+                nota_id, hash_arquivo(caminho)
+            )
+            importacao = importacao_controller.situacao(existente.id) if existente else None
+        finally:
+            db.close()
+
+        resumo = resumir_planilha(caminho)
+        validacao = None if importacao else validar_planilha(caminho)
+    except Exception:
+        os.remove(caminho)
+        raise
+
+    st.session_state.planilha_importacao = {
+        'chave': chave, 'caminho': caminho, 'resumo': resumo,
+        'validacao': validacao, 'importacao': importacao
+    }
+    return st.session_state.planilha_importacao
+
+
+def mostrar_erros_importacao(erros):
+    """Tabela de erros da importação (lista de linhas ou colunas)"""
+    st.dataframe(
+        erros,
+        hide_index=True,
+        use_container_width=True,
+        column_config={
+            "linha": st.column_config.NumberColumn("Linha"),
+            "codigo_barras": st.column_config.TextColumn("Código de Barras"),
+            "campo": st.column_config.TextColumn("Campo"),
+            "erro": st.column_config.TextColumn("Erro")
+        }
+    )
+
+
+def importacoes_ativas(importacoes: list) -> bool:
+    return any(importacao['status'] in ('pendente', 'em_andamento') for importacao in importacoes)
+
+
+def mostrar_importacoes(nota_id: int):
+    """
+    Progresso das importações em segundo plano da nota
+    Enquanto houver importação pendente ou em andamento, a seção é atualizada
+    sozinha a cada INTERVALO_PROGRESSO_IMPORTACAO segundos (fragmento)
+    """
+    try:
+        db = next(get_db())
+        ativas = importacoes_ativas(
+            ImportacaoController(db).listar_importacoes(nota_id, limite=IMPORTACOES_EXIBIDAS)
+        )
+    except Exception as e:
+        st.error(f"Erro ao carregar importações: {str(e)}")
+        return
+    finally:
+        db.close()
+
+    st.fragment(
+        progresso_importacoes,
+        run_every=INTERVALO_PROGRESSO_IMPORTACAO if ativas else None
+    )(nota_id, ativas)
+
+
+def progresso_importacoes(nota_id: int, acompanhando: bool):
+    """Lista as importações da nota (executada como fragmento pela mostrar_importacoes)"""
+    try:
+        db = next(get_db())
+        importacao_controller = ImportacaoController(db)
+        importacoes = importacao_controller.listar_importacoes(nota_id, limite=IMPORTACOES_EXIBIDAS)
+        if not importacoes:
+            return
+
+        st.markdown("#### Importações")
+        for importacao in importacoes:
+            status = STATUS_IMPORTACAO[importacao['status']]
+            linhas = f"{importacao['linhas_processadas']} de {importacao['total_linhas'] or '?'} linhas"
+            if importacao['status'] in ('pendente', 'em_andamento'):
+                st.progress(
+                    (importacao['percentual'] or 0) / 100,
+                    text=f"{status} · {importacao['nome_arquivo']}: {linhas}"
+                )
+            else:
+                st.caption(
+                    f"{status} · {importacao['nome_arquivo']}: "
+                    f"{importacao['importados']} produtos importados, "
+                    f"{importacao['atualizados']} atualizados, "
+                    f"{importacao['ignorados']} já existentes ignorados, {linhas}"
+                )
+            if importacao['mensagem']:
+                st.error(importacao['mensagem'])
+
+            if importacao['total_erros']:
+                with st.expander(f"⚠️ Erros na importação ({importacao['total_erros']})"):
+                    mostrar_erros_importacao(
+                        importacao_controller.listar_erros(importacao['id'], limite=ERROS_EXIBIDOS)
+                    )
+
+        # Importações encerradas: recarrega a página (produtos da nota) e para a atualização
+        if acompanhando and not importacoes_ativas(importacoes):
+            st.rerun()
+
+    except Exception as e:
+        st.error(f"Erro ao carregar importações: {str(e)}")
+    finally:
+        db.close()
+
+
 def adicionar_produtos_excel(nota_id: int):
     """Interface melhorada para importar produtos via Excel/CSV"""
     st.markdown("### 📎 Importar Excel/CSV")
@@ -309,27 +459,14 @@ def adicionar_produtos_excel(nota_id: int):
 
     if uploaded_file:
         try:
-            # Lê o arquivo
-            if uploaded_file.name.endswith('.csv'):
-                df = pd.read_csv(uploaded_file)
-            else:
-                df = pd.read_excel(uploaded_file)
-
-            # Verifica colunas necessárias
-            colunas_necessarias = [
-                'codigo_barras', 'referencia', 'descricao',
-                'tamanho', 'valor_unitario', 'quantidade'
-            ]
-
-            colunas_faltantes = [col for col in colunas_necessarias if col not in df.columns]
-            if colunas_faltantes:
-                st.error(f"Colunas faltantes no arquivo: {', '.join(colunas_faltantes)}")
-                return
+            # Arquivo copiado para o disco e resumido bloco a bloco (uma vez por upload)
+            planilha = preparar_planilha(uploaded_file, nota_id)
+            resumo = planilha['resumo']
 
             # Preview dos dados
             st.markdown("### Preview dos dados")
             st.dataframe(
-                df.head(),
+                resumo['previa'],
                 column_config={
                     "valor_unitario": st.column_config.NumberColumn(
                         "Valor Unitário",
@@ -339,56 +476,62 @@ def adicionar_produtos_excel(nota_id: int):
             )
 
             # Resumo da importação
-            total_produtos = len(df)
-            total_pecas = df['quantidade'].sum()
-            valor_total = (df['valor_unitario'] * df['quantidade']).sum()
+            total_produtos = resumo['total_produtos']
+            total_pecas = resumo['total_pecas']
+            valor_total = resumo['valor_total']
 
             col1, col2, col3 = st.columns(3)
             col1.metric("Total de Produtos", str(total_produtos))
             col2.metric("Total de Peças", str(total_pecas))
             col3.metric("Valor Total", f"R$ {valor_total:,.2f}")
 
-            # Botão de confirmação
-            if st.button("✨ Confirmar Importação", type="primary", use_container_width=True):
-                db = next(get_db())
-                nota_controller = NotaEntradaController(db)
+            # Mesmo arquivo já importado (ou em importação) para esta nota: nada a fazer
+            importacao = planilha['importacao']
+            if importacao:
+                st.info(
+                    f"Este arquivo já foi enviado para esta nota "
+                    f"({STATUS_IMPORTACAO[importacao['status']]}, importação {importacao['id']}). "
+                    "Nada a importar."
+                )
+            else:
+                # Erros encontrados na validação, antes da importação
+                validacao = planilha['validacao']
+                if validacao['linhas_invalidas']:
+                    st.warning(
+                        f"{validacao['linhas_invalidas']} de {validacao['total_linhas']} linhas "
+                        "com erro não serão importadas"
+                    )
+                    with st.expander("Ver erros de validação"):
+                        mostrar_erros_importacao(validacao['erros'])
+
+                tudo_ou_nada = st.checkbox(
+                    "Importar somente se todas as linhas forem válidas",
+                    help="Se alguma linha tiver erro, nenhum produto é importado"
+                )
 
-                with st.spinner("Importando produtos..."):
-                    produtos_adicionados = 0
-                    erros = []
-
-                    # Barra de progresso
-                    progress_bar = st.progress(0)
-                    total = len(df)
-
-                    for idx, row in df.iterrows():
-                        try:
-                            produto = nota_controller.adicionar_produto(
-                                nota_id=nota_id,
-                                codigo_barras=str(row['codigo_barras']),
-                                referencia=str(row['referencia']),
-                                descricao=str(row['descricao']),
-                                tamanho=str(row['tamanho']),
-                                valor_unitario=float(row['valor_unitario']),
-                                quantidade=int(row['quantidade']),
-                                usuario_id=st.session_state.usuario_id
-                            )
-                            if produto:
-                                produtos_adicionados += 1
-                        except Exception as e:
-                            erros.append(f"Erro na linha {idx + 2}: {str(e)}")
-
-                        # Atualiza barra de progresso
-                        progress_bar.progress((idx + 1) / total)
-
-                    # Resultado da importação
-                    if produtos_adicionados > 0:
-                        st.success(f"✅ {produtos_adicionados} produtos importados com sucesso!")
-
-                    if erros:
-                        with st.expander("⚠️ Erros na importação", expanded=True):
-                            for erro in erros:
-                                st.error(erro)
+                # Botão de confirmação
+                if st.button(
+                    "✨ Confirmar Importação",
+                    type="primary",
+                    use_container_width=True,
+                    disabled=tudo_ou_nada and validacao['linhas_invalidas'] > 0
+                ):
+                    db = next(get_db())
+                    importacao_controller = ImportacaoController(db)
+
+                    # A importação roda em segundo plano, em blocos, e é retomada
+                    # de onde parou se a página for recarregada ou o servidor reiniciar
+                    importacao_controller.criar_importacao(
+                        nota_id=nota_id,
+                        caminho=planilha['caminho'],
+                        nome_arquivo=uploaded_file.name,
+                        usuario_id=st.session_state.usuario_id,
+                        tudo_ou_nada=tudo_ou_nada,
+                        total_linhas=total_produtos
+                    )
+                    descartar_planilha()
+                    acordar_processador_importacoes()
+                    st.success("✅ Importação iniciada! Acompanhe o progresso abaixo.")
 
         except Exception as e:
             st.error(f"Erro ao processar arquivo: {str(e)}")
@@ -396,6 +539,8 @@ def adicionar_produtos_excel(nota_id: int):
             if 'db' in locals():
                 db.close()
 
+    mostrar_importacoes(nota_id)
+
 
 def mostrar_produtos_nota(nota_id: int):
     """Visualização melhorada dos produtos na nota"""
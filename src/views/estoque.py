@@ -1,45 +1,44 @@
 # src/views/estoque.py
+import csv
+import io
+import tempfile
 import streamlit as st
-import pandas as pd
 from datetime import datetime, timedelta
+from functools import partial
 import plotly.express as px
 import plotly.graph_objects as go
 from src.models import get_db
-from src.controllers.estoque import EstoqueController
+from src.controllers.estoque import EstoqueController, COLUNAS_EXPORTACAO_CSV, linha_csv_estoque
 from src.controllers.fornecedor import FornecedorController
 
 
-def exportar_estoque_csv(produtos: list) -> str:
-    """Formata os dados do estoque para CSV"""
-    # Criar DataFrame com as colunas na ordem desejada
-    df = pd.DataFrame({
-        'Status': [p['status'] for p in produtos],
-        'Referência': [p['referencia'] for p in produtos],
-        'Descrição': [p['descricao'] for p in produtos],
-        'Tamanho': [p['tamanho'] for p in produtos],
-        'Quantidade': [p['quantidade_total'] for p in produtos],
-        'Valor Unitário': [p['valor_unitario'] for p in produtos],
-        'Fornecedor': [p['fornecedor'] for p in produtos],
-        'Data Entrada': [p['data_entrada'] for p in produtos],
-        'Dias em Estoque': [p['dias_em_estoque'] for p in produtos]
-    })
-
-    # Remover emojis do status
-    df['Status'] = df['Status'].apply(lambda x: x.replace('✅', '').replace('⚡', '').replace('⚠️', '').strip())
-
-    # Formatar valores monetários
-    df['Valor Unitário'] = df['Valor Unitário'].apply(lambda x: f'R$ {x:.2f}'.replace('.', ','))
-
-    # Exportar para CSV
-    return df.to_csv(
-        index=False,
-        encoding='utf-8-sig',
-        sep=',',  # Mudamos para vírgula que é mais padrão
-        decimal=',',  # Usar vírgula como separador decimal
-        float_format='%.2f'  # Formatar números com 2 casas decimais
-    )
+def exportar_estoque_csv(filtros: dict, ordenar_por: str) -> bytes:
+    """
+    CSV do estoque filtrado completo, gerado só quando o download é pedido
+    (chamado pelo st.download_button, com sessão própria do banco). Os trechos
+    vão para um arquivo temporário anônimo, removido ao fechar, e o arquivo
+    é lido uma única vez para a resposta.
+    """
+    db = next(get_db())
+    try:
+        with tempfile.TemporaryFile() as arquivo:
+            for trecho in EstoqueController(db).exportar_estoque_csv(
+                    ordenar_por=ordenar_por, **filtros):
+                arquivo.write(trecho.encode("utf-8"))
+            arquivo.seek(0)
+            return arquivo.read()
+    finally:
+        db.close()
 
 
+def exportar_resultados_csv(produtos: list) -> str:
+    """Formata para CSV uma lista já carregada de grupos do estoque (ex: resultados da busca)"""
+    buffer = io.StringIO()
+    buffer.write('\ufeff')
+    escritor = csv.writer(buffer)
+    escritor.writerow(COLUNAS_EXPORTACAO_CSV)
+    escritor.writerows(linha_csv_estoque(p) for p in produtos)
+    return buffer.getvalue()
 
 
 def mostrar_resumo_estoque():
@@ -84,7 +83,7 @@ def mostrar_resumo_estoque():
                         unsafe_allow_html=True)
 
         with col3:
-            produtos_parados = len(estoque_controller.produtos_sem_movimento(30))
+            produtos_parados = estoque_controller.contar_produtos_sem_movimento(30)
             st.markdown("""
                 <div style='padding: 1rem; border-radius: 0.5rem; border: 1px solid #e0e0e0;'>
                     <h3 style='margin: 0; font-size: 1rem; color: #666;'>Sem Movimento</h3>
@@ -134,25 +133,25 @@ def visualizar_estoque():
             )
 
         with col3:
-            status_options = [
-                "Todos",
-                "✅ Em Estoque",
-                "⚡ Baixo Estoque",
-                "⚠️ Sem Movimento"
-            ]
+            status_options = {
+                "Todos": None,
+                "✅ Em Estoque": "em_estoque",
+                "⚡ Baixo Estoque": "baixo_estoque",
+                "⚠️ Sem Movimento": "sem_movimento"
+            }
             status = st.selectbox(
                 "Status",
-                options=status_options,
+                options=list(status_options.keys()),
                 key="filtro_status",
                 help="Filtrar por status do produto"
             )
 
         with col4:
             ordem_options = {
-                "Referência ↑": ("referencia", False),
-                "Quantidade ↓": ("quantidade_total", True),
-                "Valor ↓": ("valor_unitario", True),
-                "Mais Antigos": ("dias_em_estoque", True),
+                "Referência ↑": "referencia",
+                "Quantidade ↓": "quantidade",
+                "Valor ↓": "valor",
+                "Mais Antigos": "antiguidade",
             }
             ordenacao = st.selectbox(
                 "Ordenar por",
@@ -160,36 +159,44 @@ def visualizar_estoque():
                 help="Escolha como ordenar os resultados"
             )
 
-        # Obtém dados paginados
-        page = st.session_state.get('pagina_estoque', 1)
-        resultado = estoque_controller.visualizar_estoque_completo(page=page)
+        # Volta para a primeira página quando os filtros mudam
+        filtros = (fornecedor[0] if fornecedor else None, tamanho, status, ordenacao)
+        if st.session_state.get('filtros_estoque') != filtros:
+            st.session_state.filtros_estoque = filtros
+            st.session_state.pagina_estoque = 1
+            st.session_state.cursores_estoque = [None]
+
+        filtros_consulta = {
+            "fornecedor_id": fornecedor[0] if fornecedor else None,
+            "tamanho": None if tamanho == "Todos" else tamanho,
+            "status": status_options[status]
+        }
+
+        # Obtém dados paginados, já filtrados e ordenados pelo banco
+        paginacao_cursor = ordem_options[ordenacao] == "referencia"
+        if paginacao_cursor:
+            # Na ordem por referência a navegação usa cursor (custo constante por página)
+            cursores = st.session_state.get('cursores_estoque', [None])
+            resultado = estoque_controller.visualizar_estoque_cursor(
+                cursor=cursores[-1],
+                **filtros_consulta
+            )
+            page = len(cursores)
+            tem_proxima = resultado['proximo_cursor'] is not None
+            rotulo_pagina = f"Página {page}"
+        else:
+            page = st.session_state.get('pagina_estoque', 1)
+            resultado = estoque_controller.visualizar_estoque_completo(
+                page=page,
+                ordenar_por=ordem_options[ordenacao],
+                **filtros_consulta
+            )
+            tem_proxima = page < resultado['pages']
+            rotulo_pagina = f"Página {page} de {resultado['pages']}"
 
         if resultado['produtos']:
-            # Aplicar filtros
             produtos_filtrados = resultado['produtos']
 
-            if fornecedor and fornecedor[0]:
-                produtos_filtrados = [p for p in produtos_filtrados
-                                      if p['fornecedor'] == fornecedor[1]]
-
-            if tamanho != "Todos":
-                produtos_filtrados = [p for p in produtos_filtrados
-                                      if p['tamanho'] == tamanho]
-
-            if status != "Todos":
-                # Mapeamento correto dos status
-                status_map = {
-                    "✅ Em Estoque": "✅ Em Estoque",
-                    "⚡ Baixo Estoque": "⚡ Baixo Estoq",
-                    "⚠️ Sem Movimento": "⚠️ Sem Movim"
-                }
-                produtos_filtrados = [p for p in produtos_filtrados
-                                      if p['status'].strip() == status_map[status].strip()]
-
-            # Ordenação
-            campo, reverso = ordem_options[ordenacao]
-            produtos_filtrados.sort(key=lambda x: x[campo], reverse=reverso)
-
             # Mostra tabela
             st.dataframe(
                 produtos_filtrados,
@@ -250,26 +257,35 @@ def visualizar_estoque():
                 with col1:
                     if page > 1:
                         if st.button("⬅️", key="prev_page"):
-                            st.session_state.pagina_estoque = page - 1
+                            if paginacao_cursor:
+                                st.session_state.cursores_estoque = cursores[:-1]
+                            else:
+                                st.session_state.pagina_estoque = page - 1
                             st.rerun()
 
                 with col3:
                     st.markdown(f"<div style='text-align: center; padding: 0.5rem;'>"
-                                f"Página {page} de {resultado['pages']}</div>",
+                                f"{rotulo_pagina}</div>",
                                 unsafe_allow_html=True)
 
                 with col5:
-                    if page < resultado['pages']:
+                    if tem_proxima:
                         if st.button("➡️", key="next_page"):
-                            st.session_state.pagina_estoque = page + 1
+                            if paginacao_cursor:
+                                st.session_state.cursores_estoque = cursores + [resultado['proximo_cursor']]
+                            else:
+                                st.session_state.pagina_estoque = page + 1
                             st.rerun()
 
-            # Botão de exportação
+            # Exportação do estoque filtrado completo (todas as páginas): o CSV só
+            # é gerado no clique, com o estoque daquele momento, e nada fica na sessão
             st.download_button(
                 "📥 Exportar Dados",
-                data=exportar_estoque_csv(produtos_filtrados),
+                data=partial(exportar_estoque_csv, filtros_consulta, ordem_options[ordenacao]),
                 file_name=f"estoque_{datetime.now().strftime('%Y%m%d_%H%M')}.csv",
                 mime="text/csv",
+                help="Gera o CSV com todo o estoque filtrado",
+                on_click="ignore",
                 key='download-csv'
             )
 
@@ -347,46 +363,26 @@ def buscar_produtos():
 
         # Executa busca apenas se houver termo ou filtros
         if termo_busca or filtro_tamanho or filtro_status or (filtro_fornecedor and filtro_fornecedor[0]):
-            # Obtém resultados
-            resultados = estoque_controller.visualizar_estoque_completo(page=1, per_page=1000)['produtos']
-
-            # Aplica filtros
-            produtos_filtrados = resultados
-
-            # Filtro por termo de busca
-            if termo_busca:
-                if campo_busca == "Código":
-                    produtos_filtrados = [p for p in produtos_filtrados
-                                          if termo_busca.lower() in p['referencia'].lower()]
-                elif campo_busca == "Referência":
-                    produtos_filtrados = [p for p in produtos_filtrados
-                                          if termo_busca.lower() in p['referencia'].lower()]
-                elif campo_busca == "Descrição":
-                    produtos_filtrados = [p for p in produtos_filtrados
-                                          if termo_busca.lower() in p['descricao'].lower()]
-                else:  # Todos os campos
-                    produtos_filtrados = [p for p in produtos_filtrados
-                                          if termo_busca.lower() in p['referencia'].lower() or
-                                          termo_busca.lower() in p['descricao'].lower()]
-
-            # Aplica filtros adicionais
-            if filtro_tamanho:
-                produtos_filtrados = [p for p in produtos_filtrados
-                                      if p['tamanho'] in filtro_tamanho]
-
-            if filtro_status:
-                status_map = {
-                    "Em Estoque": "✅ Em Estoque",
-                    "Baixo Estoque": "⚡ Baixo Estoq",
-                    "Sem Movimento": "⚠️ Sem Movim"
-                }
-                status_filtrados = [status_map[s] for s in filtro_status]
-                produtos_filtrados = [p for p in produtos_filtrados
-                                      if p['status'] in status_filtrados]
-
-            if filtro_fornecedor and filtro_fornecedor[0]:
-                produtos_filtrados = [p for p in produtos_filtrados
-                                      if p['fornecedor'] == filtro_fornecedor[1]]
+            campos_map = {
+                "Todos os campos": None,
+                "Código": ["codigo_barras"],
+                "Referência": ["referencia"],
+                "Descrição": ["descricao"]
+            }
+            status_map = {
+                "Em Estoque": "em_estoque",
+                "Baixo Estoque": "baixo_estoque",
+                "Sem Movimento": "sem_movimento"
+            }
+
+            # Busca no índice de texto, filtrando e ordenando por relevância no banco
+            produtos_filtrados = estoque_controller.pesquisar_estoque(
+                termo=termo_busca,
+                campos=campos_map[campo_busca],
+                tamanhos=filtro_tamanho or None,
+                status=[status_map[s] for s in filtro_status] or None,
+                fornecedor_id=filtro_fornecedor[0] if filtro_fornecedor else None
+            )
 
             # Mostra resultados
             if produtos_filtrados:
@@ -447,7 +443,7 @@ def buscar_produtos():
                 # Botão de exportação
                 st.download_button(
                     "📥 Exportar Resultados",
-                    data=exportar_estoque_csv(produtos_filtrados),
+                    data=exportar_resultados_csv(produtos_filtrados),
                     file_name=f"busca_estoque_{datetime.now().strftime('%Y%m%d_%H%M')}.csv",
                     mime="text/csv",
                     key='download-csv-busca'
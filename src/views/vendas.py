@@ -4,6 +4,7 @@ from datetime import datetime
 from src.models import get_db, FormaPagamento
 from src.controllers.venda import VendaController
 from src.controllers.produto import ProdutoController
+from src.controllers.diario_vendas import registrar_venda_caixa, diario_vendas
 
 
 def inicializar_estado_venda():
@@ -16,6 +17,13 @@ def inicializar_estado_venda():
         st.session_state.total_venda = 0.0
 
 
+def limpar_venda():
+    """Descarta o carrinho da venda atual"""
+    st.session_state.venda_atual = None
+    st.session_state.itens_venda = []
+    st.session_state.total_venda = 0.0
+
+
 def nova_venda():
     """Interface para criar uma nova venda"""
     st.subheader("Nova Venda")
@@ -33,29 +41,75 @@ def nova_venda():
                 st.error("Nome do cliente é obrigatório")
                 return
 
+            # A venda só é gravada no banco ao finalizar (checkout do carrinho)
+            st.session_state.venda_atual = {
+                "cliente_nome": cliente_nome,
+                "cliente_cpf": cliente_cpf or None
+            }
+            st.session_state.itens_venda = []
+            st.session_state.total_venda = 0.0
+            st.success("Venda iniciada com sucesso!")
+            st.rerun()
+
+
+def ler_codigo_barras():
+    """Interface para adicionar ao carrinho a peça lida pelo código de barras"""
+    with st.form("form_codigo", clear_on_submit=True):
+        col1, col2 = st.columns([3, 1])
+
+        with col1:
+            codigo_barras = st.text_input("Código de Barras")
+        with col2:
+            quantidade = st.number_input("Qtd.", min_value=1, value=1)
+
+        if st.form_submit_button("Adicionar Peça") and codigo_barras:
             try:
                 db = next(get_db())
-                venda_controller = VendaController(db)
+                produto_controller = ProdutoController(db)
 
-                # Cria nova venda
-                venda = venda_controller.iniciar_venda(
-                    usuario_id=st.session_state.usuario_id,
-                    cliente_nome=cliente_nome,
-                    cliente_cpf=cliente_cpf
-                )
+                # Consulta pelo índice único do código (com cache em memória)
+                lote = produto_controller.consultar_codigo_barras(codigo_barras)
+                if not lote:
+                    st.error("Produto não encontrado")
+                    return
 
-                st.session_state.venda_atual = venda
-                st.success("Venda iniciada com sucesso!")
+                ja_no_carrinho = sum(
+                    item['quantidade'] for item in st.session_state.itens_venda
+                    if item.get('codigo_barras') == codigo_barras
+                )
+                if lote.quantidade_atual >= ja_no_carrinho + quantidade:
+                    valor_item = float(lote.valor_unitario) * quantidade
+                else:
+                    # Lote esgotado: prévia pelo FIFO da referência/tamanho
+                    produtos = produto_controller.calcular_produtos_venda_fifo(
+                        lote.referencia, lote.tamanho, int(quantidade)
+                    )
+                    if not produtos:
+                        st.error("Produtos insuficientes em estoque")
+                        return
+                    valor_item = sum(float(p['valor_unitario']) * p['quantidade'] for p in produtos)
+
+                st.session_state.itens_venda.append({
+                    "codigo_barras": codigo_barras,
+                    "referencia": lote.referencia,
+                    "tamanho": lote.tamanho,
+                    "quantidade": int(quantidade),
+                    "valor_total": valor_item
+                })
+                st.session_state.total_venda = sum(
+                    item['valor_total'] for item in st.session_state.itens_venda
+                )
+                st.success(f"{lote.descricao} adicionado")
                 st.rerun()
 
             except Exception as e:
-                st.error(f"Erro ao iniciar venda: {str(e)}")
+                st.error(f"Erro ao ler código de barras: {str(e)}")
             finally:
                 db.close()
 
 
 def adicionar_item():
-    """Interface para adicionar itens à venda"""
+    """Interface para adicionar itens ao carrinho da venda"""
     st.subheader("Adicionar Item")
 
     with st.form("form_item"):
@@ -71,24 +125,38 @@ def adicionar_item():
         if st.form_submit_button("Adicionar Item"):
             try:
                 db = next(get_db())
-                venda_controller = VendaController(db)
-
-                # Adiciona item usando FIFO
-                itens = venda_controller.adicionar_item(
-                    venda_id=st.session_state.venda_atual.id,
-                    referencia=referencia,
-                    tamanho=tamanho,
-                    quantidade=quantidade,
-                    usuario_id=st.session_state.usuario_id
+                produto_controller = ProdutoController(db)
+
+                # Prévia do FIFO considerando o que já está no carrinho pela referência
+                ja_no_carrinho = sum(
+                    item['quantidade'] for item in st.session_state.itens_venda
+                    if item['referencia'] == referencia and item['tamanho'] == tamanho
+                    and not item.get('codigo_barras')
+                )
+                anteriores = produto_controller.calcular_produtos_venda_fifo(
+                    referencia, tamanho, ja_no_carrinho
+                ) if ja_no_carrinho else []
+                produtos = produto_controller.calcular_produtos_venda_fifo(
+                    referencia, tamanho, ja_no_carrinho + int(quantidade)
                 )
 
-                if itens:
-                    st.session_state.itens_venda.extend(itens)
-                    st.success("Item adicionado com sucesso!")
-                    # Atualiza total
+                if not produtos:
+                    st.error("Produtos insuficientes em estoque")
+                else:
+                    valor_item = (
+                        sum(float(p['valor_unitario']) * p['quantidade'] for p in produtos) -
+                        sum(float(p['valor_unitario']) * p['quantidade'] for p in anteriores)
+                    )
+                    st.session_state.itens_venda.append({
+                        "referencia": referencia,
+                        "tamanho": tamanho,
+                        "quantidade": int(quantidade),
+                        "valor_total": valor_item
+                    })
                     st.session_state.total_venda = sum(
-                        item.valor_total for item in st.session_state.itens_venda
+                        item['valor_total'] for item in st.session_state.itens_venda
                     )
+                    st.success("Item adicionado com sucesso!")
                     st.rerun()
 
             except Exception as e:
@@ -98,7 +166,7 @@ def adicionar_item():
 
 
 def mostrar_itens_venda():
-    """Exibe os itens da venda atual"""
+    """Exibe os itens do carrinho da venda atual"""
     if st.session_state.itens_venda:
         st.subheader("Itens da Venda")
 
@@ -106,12 +174,11 @@ def mostrar_itens_venda():
         dados_tabela = []
         for item in st.session_state.itens_venda:
             dados_tabela.append({
-                "Referência": item.produto.referencia,
-                "Descrição": item.produto.descricao,
-                "Tamanho": item.produto.tamanho,
-                "Quantidade": item.quantidade,
-                "Valor Unit.": f"R$ {float(item.valor_unitario):,.2f}",
-                "Total": f"R$ {float(item.valor_total):,.2f}"
+                "Referência": item['referencia'],
+                "Tamanho": item['tamanho'],
+                "Quantidade": item['quantidade'],
+                "Valor Unit.": f"R$ {item['valor_total'] / item['quantidade']:,.2f}",
+                "Total": f"R$ {item['valor_total']:,.2f}"
             })
 
         st.dataframe(
@@ -137,22 +204,33 @@ def finalizar_venda():
         if st.form_submit_button("Finalizar Venda"):
             try:
                 db = next(get_db())
-                venda_controller = VendaController(db)
 
-                # Finaliza a venda
-                venda = venda_controller.finalizar_venda(
-                    venda_id=st.session_state.venda_atual.id,
+                # Grava a venda inteira (itens, estoque e logs) em uma transação;
+                # com o banco bloqueado, a venda vai para o diário local
+                venda, _ = registrar_venda_caixa(
+                    db,
+                    carrinho=[
+                        {
+                            "codigo_barras": item.get('codigo_barras'),
+                            "referencia": item['referencia'],
+                            "tamanho": item['tamanho'],
+                            "quantidade": item['quantidade']
+                        }
+                        for item in st.session_state.itens_venda
+                    ],
                     forma_pagamento=FormaPagamento(forma_pagamento),
-                    usuario_id=st.session_state.usuario_id
+                    usuario_id=st.session_state.usuario_id,
+                    cliente_nome=st.session_state.venda_atual['cliente_nome'],
+                    cliente_cpf=st.session_state.venda_atual['cliente_cpf']
                 )
 
                 if venda:
                     st.success("Venda finalizada com sucesso!")
-                    # Reset do estado
-                    st.session_state.venda_atual = None
-                    st.session_state.itens_venda = []
-                    st.session_state.total_venda = 0.0
-                    st.rerun()
+                else:
+                    st.warning("Banco de dados ocupado: venda guardada no diário e "
+                               "será gravada automaticamente")
+                limpar_venda()
+                st.rerun()
 
             except Exception as e:
                 st.error(f"Erro ao finalizar venda: {str(e)}")
@@ -190,9 +268,23 @@ def consultar_vendas():
             db.close()
 
 
+def mostrar_situacao_diario():
+    """Avisa quando há vendas do diário local aguardando gravação no banco"""
+    situacao = diario_vendas.situacao()
+    if situacao['pendentes']:
+        st.info(
+            f"{situacao['pendentes']} venda(s) aguardando gravação no banco "
+            f"(há {situacao['atraso_segundos']:.0f} s)"
+        )
+    if situacao['rejeitadas']:
+        st.error(f"{situacao['rejeitadas']} venda(s) do diário recusadas pelo banco: "
+                 f"confira com 'python manutencao.py diario-vendas'")
+
+
 def mostrar_pagina():
     """Exibe a página de vendas"""
     st.title("Vendas")
+    mostrar_situacao_diario()
 
     # Inicializa estado
     inicializar_estado_venda()
@@ -203,6 +295,7 @@ def mostrar_pagina():
         consultar_vendas()
     else:
         # Venda em andamento
+        ler_codigo_barras()
         adicionar_item()
         mostrar_itens_venda()
 
@@ -211,7 +304,5 @@ def mostrar_pagina():
 
             # Botão para cancelar venda
             if st.button("Cancelar Venda", type="secondary"):
-                st.session_state.venda_atual = None
-                st.session_state.itens_venda = []
-                st.session_state.total_venda = 0.0
+                limpar_venda()
                 st.rerun()
\ No newline at end of file